@@ -141,9 +141,14 @@ CREATE TABLE IF NOT EXISTS analytics_data (
 
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_analytics_event_type ON analytics_data(event_type);
-CREATE INDEX IF NOT EXISTS idx_analytics_user_id ON analytics_data(user_id);
+CREATE INDEX IF NOT EXISTS idx_analytics_user_type_timestamp ON analytics_data(user_id, event_type, timestamp);
+CREATE INDEX IF NOT EXISTS idx_analytics_user_recent ON analytics_data(user_id, timestamp DESC, id DESC) INCLUDE (event_type);
 CREATE INDEX IF NOT EXISTS idx_analytics_timestamp ON analytics_data(timestamp);
 CREATE INDEX IF NOT EXISTS idx_analytics_data_gin ON analytics_data USING GIN(data);
+CREATE INDEX IF NOT EXISTS idx_analytics_event_type_timestamp ON analytics_data(event_type, timestamp DESC, id DESC);
+
+-- Expression statistics so the planner can hash-aggregate DATE(timestamp)
+CREATE STATISTICS IF NOT EXISTS stats_analytics_date ON (DATE(timestamp)) FROM analytics_data;
 
 -- Insert sample analytics data
 INSERT INTO analytics_data (event_type, user_id, data) VALUES
@@ -0,0 +1,134 @@
+"""Compare the six-query and single-pass paths behind GET /api/analytics.
+
+Seeds a scratch database with synthetic events and times both aggregation
+paths for each table size. Run from the analytics-service directory:
+
+    python -m benchmarks.bench_aggregation --rows 1000000 10000000 100000000
+
+Connection settings use the service's POSTGRES_* variables, but the database
+defaults to BENCH_POSTGRES_DB=analytics_bench because the table is truncated.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+
+from src.aggregation import aggregate_analytics
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analytics_data (
+        id SERIAL PRIMARY KEY,
+        event_type VARCHAR(100) NOT NULL,
+        user_id INTEGER NOT NULL,
+        data JSONB NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_analytics_event_type ON analytics_data(event_type);
+    CREATE INDEX IF NOT EXISTS idx_analytics_user_id ON analytics_data(user_id);
+    CREATE INDEX IF NOT EXISTS idx_analytics_timestamp ON analytics_data(timestamp);
+    CREATE STATISTICS IF NOT EXISTS stats_analytics_date ON (DATE(timestamp)) FROM analytics_data;
+"""
+
+
+async def six_query_path(conn, where_clause, params):
+    """The original implementation: one full scan per response field."""
+    total_events = await conn.fetchval(f"SELECT COUNT(*) FROM analytics_data WHERE {where_clause}", *params)
+    events_by_type = await conn.fetch(f"""
+        SELECT event_type, COUNT(*) as count FROM analytics_data WHERE {where_clause}
+        GROUP BY event_type ORDER BY count DESC
+    """, *params)
+    events_by_user = await conn.fetch(f"""
+        SELECT user_id, COUNT(*) as count FROM analytics_data WHERE {where_clause}
+        GROUP BY user_id ORDER BY count DESC LIMIT 10
+    """, *params)
+    events_by_date = await conn.fetch(f"""
+        SELECT DATE(timestamp) as date, COUNT(*) as count FROM analytics_data WHERE {where_clause}
+        GROUP BY DATE(timestamp) ORDER BY date DESC LIMIT 30
+    """, *params)
+    top_users = await conn.fetch(f"""
+        SELECT user_id, COUNT(*) as count FROM analytics_data WHERE {where_clause}
+        GROUP BY user_id ORDER BY count DESC LIMIT 5
+    """, *params)
+    top_events = await conn.fetch(f"""
+        SELECT event_type, COUNT(*) as count FROM analytics_data WHERE {where_clause}
+        GROUP BY event_type ORDER BY count DESC LIMIT 5
+    """, *params)
+    return {
+        "total_events": total_events,
+        "events_by_type": {row[0]: row[1] for row in events_by_type},
+        "events_by_user": {str(row[0]): row[1] for row in events_by_user},
+        "events_by_date": {str(row[0]): row[1] for row in events_by_date},
+        "top_users": [{"user_id": row[0], "count": row[1]} for row in top_users],
+        "top_events": [{"event_type": row[0], "count": row[1]} for row in top_events]
+    }
+
+
+async def seed(conn, rows, users, event_types, days):
+    await conn.execute(SCHEMA)
+    await conn.execute("TRUNCATE analytics_data RESTART IDENTITY")
+    start = datetime.utcnow() - timedelta(days=days)
+    await conn.execute("""
+        INSERT INTO analytics_data (event_type, user_id, data, timestamp)
+        SELECT
+            'event_' || (i % $2),
+            (i * 7919) % $3,
+            '{}'::jsonb,
+            $4::timestamp + (i % ($5 * 86400)) * INTERVAL '1 second'
+        FROM generate_series(1, $1::bigint) AS i
+    """, rows, event_types, users, start, days)
+    await conn.execute("ANALYZE analytics_data")
+
+
+async def time_path(conn, path, where_clause, params, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = await path(conn, where_clause, params)
+        samples.append(time.perf_counter() - start)
+    return result, samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000, 100_000_000])
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--event-types', type=int, default=20)
+    parser.add_argument('--days', type=int, default=90)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(
+        host=os.getenv('POSTGRES_HOST', 'localhost'),
+        port=int(os.getenv('POSTGRES_PORT', 5432)),
+        database=os.getenv('BENCH_POSTGRES_DB', 'analytics_bench'),
+        user=os.getenv('POSTGRES_USER', 'postgres'),
+        password=os.getenv('POSTGRES_PASSWORD', 'password')
+    )
+
+    scenarios = [
+        ("all rows", "1=1", []),
+        ("last 7 days", "timestamp >= $1", [datetime.utcnow() - timedelta(days=7)]),
+    ]
+
+    print(f"{'rows':>12} {'filter':<12} {'six-query p50':>14} {'single-pass p50':>16} {'speedup':>8}")
+    try:
+        for rows in args.rows:
+            await seed(conn, rows, args.users, args.event_types, args.days)
+            for label, where_clause, params in scenarios:
+                expected, six = await time_path(conn, six_query_path, where_clause, params, args.iterations)
+                actual, single = await time_path(conn, aggregate_analytics, where_clause, params, args.iterations)
+                if expected["total_events"] != actual["total_events"] or expected["events_by_type"] != actual["events_by_type"]:
+                    raise SystemExit(f"Result mismatch at {rows} rows ({label})")
+                six_p50 = statistics.median(six)
+                single_p50 = statistics.median(single)
+                print(f"{rows:>12,} {label:<12} {six_p50 * 1000:>12.1f}ms {single_p50 * 1000:>14.1f}ms {six_p50 / single_p50:>7.2f}x")
+    finally:
+        await conn.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+"""Compare the Postgres and columnar-store paths behind GET /api/analytics.
+
+Seeds a scratch database with synthetic events (see bench_aggregation),
+backfills a columnar store in a temporary directory from it, and times both
+engines on the same AnalyticsQuery filters. Run from the analytics-service
+directory:
+
+    python -m benchmarks.bench_columnar --rows 1000000 10000000
+
+Connection settings use the service's POSTGRES_* variables, but the database
+defaults to BENCH_POSTGRES_DB=analytics_bench because the table is truncated.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.bench_aggregation import seed
+from src.aggregation import aggregate_analytics
+from src.app import AnalyticsQuery, build_where_clause
+from src.columnar import ColumnarStore
+from src.db import Database
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+async def time_engine(run, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = await run()
+        samples.append(time.perf_counter() - start)
+    return result, samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--event-types', type=int, default=20)
+    parser.add_argument('--days', type=int, default=90)
+    args = parser.parse_args()
+
+    os.environ['POSTGRES_DB'] = os.getenv('BENCH_POSTGRES_DB', 'analytics_bench')
+    database = Database()
+
+    # seed() spreads rows one second apart from `days` ago, so the oldest week is always populated
+    first_day = datetime.utcnow() - timedelta(days=args.days)
+    scenarios = [
+        ("all rows", AnalyticsQuery()),
+        ("first week", AnalyticsQuery(start_date=first_day, end_date=first_day + timedelta(days=7))),
+        ("one type", AnalyticsQuery(event_type='event_3')),
+        ("one user", AnalyticsQuery(user_id=4242)),
+    ]
+
+    print(f"{'rows':>12} {'filter':<12} {'postgres p50':>13} {'columnar p50':>13} {'speedup':>8}")
+    try:
+        for rows in args.rows:
+            async with database.acquire() as conn:
+                await seed(conn, rows, args.users, args.event_types, args.days)
+
+            with tempfile.TemporaryDirectory() as directory:
+                os.environ['ANALYTICS_COLUMNAR_DIR'] = directory
+                store = ColumnarStore(database)
+                start = time.perf_counter()
+                await store.start()
+                await store.stop()
+                print(f"{rows:>12,} backfill {time.perf_counter() - start:.1f}s, {directory_size(directory) / 2**20:.0f} MiB on disk")
+
+                for label, query in scenarios:
+                    where_clause, params = build_where_clause(query)
+
+                    async def postgres():
+                        async with database.acquire() as conn:
+                            return await aggregate_analytics(conn, where_clause, params)
+
+                    expected, postgres_samples = await time_engine(postgres, args.iterations)
+                    actual, columnar_samples = await time_engine(lambda: store.aggregate(query), args.iterations)
+                    if expected["total_events"] != actual["total_events"] or expected["events_by_type"] != actual["events_by_type"]:
+                        raise SystemExit(f"Result mismatch at {rows} rows ({label})")
+                    postgres_p50 = statistics.median(postgres_samples)
+                    columnar_p50 = statistics.median(columnar_samples)
+                    print(f"{rows:>12,} {label:<12} {postgres_p50 * 1000:>11.1f}ms {columnar_p50 * 1000:>11.1f}ms {postgres_p50 / columnar_p50:>7.2f}x")
+    finally:
+        await database.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
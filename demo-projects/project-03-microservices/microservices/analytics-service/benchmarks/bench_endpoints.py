@@ -0,0 +1,95 @@
+"""Load-test the analytics-service endpoints and compare against a baseline.
+
+Runs against a service on the local machine backed by local Postgres and
+Redis, so results do not depend on shared infrastructure. Three steps, run
+from the analytics-service directory:
+
+    # 1. Reset the scratch database and load synthetic events
+    python -m benchmarks.bench_endpoints seed --rows 1000000
+    # 2. Start the service against it (migrations build the derived tables)
+    POSTGRES_DB=analytics_bench uvicorn src.app:app --port 8001 --workers 4
+    # 3. Drive each scenario at each concurrency level
+    python -m benchmarks.bench_endpoints run --concurrency 1 16 64 --save-baseline baseline.json
+
+Later runs pass --baseline baseline.json. The run exits non-zero when a
+scenario's p95 latency or throughput is worse than the baseline by more than
+--tolerance. Baselines are only comparable on the machine that recorded them.
+Requires httpx.
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import asyncpg
+import loadtest
+import redis
+
+from benchmarks.bench_aggregation import seed
+
+
+def scenarios(args):
+    """Return (name, make_request) pairs; make_request(rng) gives httpx.request() kwargs."""
+    first_day = datetime.utcnow() - timedelta(days=args.days)
+
+    def date_range(rng):
+        # Day-aligned, so the rollups can answer it
+        start = datetime.combine(first_day.date(), datetime.min.time()) + timedelta(days=rng.randrange(1, args.days - 7))
+        return {"start_date": start.isoformat(), "end_date": (start + timedelta(days=7)).isoformat()}
+
+    def event(rng):
+        return {"event_type": f"event_{rng.randrange(args.event_types)}", "user_id": rng.randrange(args.users), "data": {}}
+
+    return [
+        ("analytics", lambda rng: {"method": "GET", "url": "/api/analytics"}),
+        ("analytics_by_user", lambda rng: {"method": "GET", "url": "/api/analytics", "params": {"user_id": rng.randrange(1, args.users)}}),
+        ("analytics_by_week", lambda rng: {"method": "GET", "url": "/api/analytics", "params": date_range(rng)}),
+        ("summary", lambda rng: {"method": "GET", "url": "/api/analytics/summary"}),
+        ("user_profile", lambda rng: {"method": "GET", "url": f"/api/analytics/users/{rng.randrange(args.users)}"}),
+        ("events_by_type", lambda rng: {"method": "GET", "url": f"/api/analytics/events/event_{rng.randrange(args.event_types)}"}),
+        # Writes invalidate the read caches, so they run last
+        ("ingest", lambda rng: {"method": "POST", "url": "/api/analytics", "json": event(rng)}),
+        ("ingest_batch", lambda rng: {"method": "POST", "url": "/api/analytics/batch", "json": [event(rng) for _ in range(100)]}),
+    ]
+
+
+async def reset(args):
+    conn = await asyncpg.connect(
+        host=os.getenv('POSTGRES_HOST', 'localhost'),
+        port=int(os.getenv('POSTGRES_PORT', 5432)),
+        database=os.getenv('BENCH_POSTGRES_DB', 'analytics_bench'),
+        user=os.getenv('POSTGRES_USER', 'postgres'),
+        password=os.getenv('POSTGRES_PASSWORD', 'password')
+    )
+    try:
+        # Start from an unmigrated schema so the service rebuilds rollups,
+        # sketches and partitions from the seeded rows when it starts
+        await conn.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+        await seed(conn, args.rows, args.users, args.event_types, args.days)
+    finally:
+        await conn.close()
+
+    cache = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)))
+    for key in cache.scan_iter(match='analytics:*'):
+        cache.delete(key)
+    print(f"Seeded {args.rows:,} events; start the service with POSTGRES_DB={os.getenv('BENCH_POSTGRES_DB', 'analytics_bench')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--event-types', type=int, default=20)
+    parser.add_argument('--days', type=int, default=90)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help="reset BENCH_POSTGRES_DB and load synthetic events")
+    seed_parser.add_argument('--rows', type=int, default=1_000_000)
+
+    loadtest.add_run_parser(commands, url='http://localhost:8001')
+    args = parser.parse_args()
+
+    asyncio.run(reset(args) if args.command == 'seed' else loadtest.run(args, scenarios(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Compare single-event and batch ingest throughput against a running service.
+
+Sends the same number of events through POST /api/analytics (one event per
+request) and POST /api/analytics/batch (JSON arrays and NDJSON) and reports
+events per second for each path. Requires httpx:
+
+    pip install httpx
+    python -m benchmarks.bench_ingest --url http://localhost:8001 --events 20000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+
+def make_event(i):
+    return {
+        "event_type": random.choice(["page_view", "click", "purchase", "signup"]),
+        "user_id": random.randint(1, 10_000),
+        "data": {"seq": i, "page": f"/products/{i % 500}"}
+    }
+
+
+async def run_requests(client, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(kwargs):
+        async with semaphore:
+            response = await client.post(**kwargs)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(kwargs) for kwargs in requests))
+    return time.perf_counter() - start
+
+
+def single_requests(events):
+    return [{"url": "/api/analytics", "json": event} for event in events]
+
+
+def array_requests(events, batch_size):
+    return [
+        {"url": "/api/analytics/batch", "json": events[i:i + batch_size]}
+        for i in range(0, len(events), batch_size)
+    ]
+
+
+def ndjson_requests(events, batch_size):
+    return [
+        {
+            "url": "/api/analytics/batch",
+            "content": "\n".join(json.dumps(event) for event in events[i:i + batch_size]),
+            "headers": {"Content-Type": "application/x-ndjson"}
+        }
+        for i in range(0, len(events), batch_size)
+    ]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8001')
+    parser.add_argument('--events', type=int, default=20_000)
+    parser.add_argument('--batch-size', type=int, default=1_000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    events = [make_event(i) for i in range(args.events)]
+    paths = [
+        ("single", single_requests(events)),
+        (f"batch json x{args.batch_size}", array_requests(events, args.batch_size)),
+        (f"batch ndjson x{args.batch_size}", ndjson_requests(events, args.batch_size)),
+    ]
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        print(f"{'path':<24} {'requests':>9} {'seconds':>9} {'events/s':>10}")
+        for label, requests in paths:
+            elapsed = await run_requests(client, requests, args.concurrency)
+            print(f"{label:<24} {len(requests):>9} {elapsed:>9.2f} {args.events / elapsed:>10,.0f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
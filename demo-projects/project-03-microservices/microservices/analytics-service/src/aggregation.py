@@ -0,0 +1,83 @@
+"""Single-pass aggregation for GET /api/analytics.
+
+One GROUPING SETS query replaces the six separate scans of analytics_data.
+GROUPING(event_type, user_id, DATE(timestamp)) is a bitmask telling which
+grouping set a row belongs to; per-set ranking happens in SQL so only the
+rows needed for the response leave Postgres.
+"""
+
+# GROUPING() bitmask for each grouping set (event_type=4, user_id=2, date=1)
+BY_TYPE = 0b011
+BY_USER = 0b101
+BY_DATE = 0b110
+TOTAL = 0b111
+
+USERS_LIMIT = 10
+DATES_LIMIT = 30
+TOP_LIMIT = 5
+
+
+def build_aggregate_sql(where_clause, source="analytics_data", weight=None):
+    """Build the aggregate query; `weight` names a pre-counted column to SUM instead of COUNT(*)."""
+    count = f"COALESCE(SUM({weight}), 0)::bigint" if weight else "COUNT(*)"
+    return f"""
+        WITH grouped AS (
+            SELECT
+                GROUPING(event_type, user_id, DATE(timestamp)) AS grouping_id,
+                event_type,
+                user_id,
+                DATE(timestamp) AS date,
+                {count} AS count
+            FROM {source}
+            WHERE {where_clause}
+            GROUP BY GROUPING SETS ((event_type), (user_id), (DATE(timestamp)), ())
+        ), ranked AS (
+            SELECT
+                grouped.*,
+                ROW_NUMBER() OVER (PARTITION BY grouping_id ORDER BY count DESC) AS count_rank,
+                ROW_NUMBER() OVER (PARTITION BY grouping_id ORDER BY date DESC) AS date_rank
+            FROM grouped
+        )
+        SELECT grouping_id, event_type, user_id, date, count
+        FROM ranked
+        WHERE grouping_id IN ({BY_TYPE}, {TOTAL})
+           OR (grouping_id = {BY_USER} AND count_rank <= {USERS_LIMIT})
+           OR (grouping_id = {BY_DATE} AND date_rank <= {DATES_LIMIT})
+    """
+
+
+def fan_out(rows):
+    """Split grouping-set rows into the fields of AnalyticsResponse."""
+    total_events = 0
+    by_type = []
+    by_user = []
+    by_date = []
+
+    for row in rows:
+        grouping_id = row['grouping_id']
+        if grouping_id == TOTAL:
+            total_events = row['count']
+        elif grouping_id == BY_TYPE:
+            by_type.append((row['event_type'], row['count']))
+        elif grouping_id == BY_USER:
+            by_user.append((row['user_id'], row['count']))
+        elif grouping_id == BY_DATE:
+            by_date.append((row['date'], row['count']))
+
+    by_type.sort(key=lambda item: item[1], reverse=True)
+    by_user.sort(key=lambda item: item[1], reverse=True)
+    by_date.sort(key=lambda item: item[0], reverse=True)
+
+    return {
+        "total_events": total_events,
+        "events_by_type": {event_type: count for event_type, count in by_type},
+        "events_by_user": {str(user_id): count for user_id, count in by_user},
+        "events_by_date": {str(date): count for date, count in by_date},
+        "top_users": [{"user_id": user_id, "count": count} for user_id, count in by_user[:TOP_LIMIT]],
+        "top_events": [{"event_type": event_type, "count": count} for event_type, count in by_type[:TOP_LIMIT]]
+    }
+
+
+async def aggregate_analytics(conn, where_clause, params):
+    rows = await conn.fetch(build_aggregate_sql(where_clause), *params)
+    return fan_out(rows)
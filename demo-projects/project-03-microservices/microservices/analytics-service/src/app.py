@@ -1,16 +1,30 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import psycopg2
-import redis
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 import os
 import logging
-from datetime import datetime, timedelta
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter, ValidationError, field_validator
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 import time
-import json
+
+from .aggregation import aggregate_analytics
+from .buffer import IngestBuffer
+from .cache import AnalyticsCache
+from .columnar import ColumnarStore
+from .db import db, DatabaseUnavailable
+from .events import EXPORT_FORMATS, PAGE_MAX_EVENTS, CursorError, fetch_events_page, stream_events
+from .ingest import BatchError, copy_events, read_batch
+from .partitions import PartitionManager
+from .realtime import LiveStream
+from .redis_client import RedisUnavailable, redis_client
+from .rollups import aggregate_from_rollups, event_bounds, pick_granularity, recent_events_from_rollups, summary_from_rollups
+from .schema import migrate
+from .sketches import SketchStore, approximate_aggregates, error_bounds
+from .users import RECENT_MAX_EVENTS, raw_user_counters, recent_user_events, user_counters, user_profile
 
 app = FastAPI(
     title="Analytics Service",
@@ -33,39 +47,13 @@ logger = logging.getLogger(__name__)
 REQUEST_COUNT = Counter('http_requests_total', 'Total HTTP requests', ['method', 'endpoint', 'status'])
 REQUEST_DURATION = Histogram('http_request_duration_seconds', 'HTTP request duration', ['method', 'endpoint'])
 
-# Database connection
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host=os.getenv('POSTGRES_HOST', 'postgres-service'),
-            port=os.getenv('POSTGRES_PORT', 5432),
-            database=os.getenv('POSTGRES_DB', 'analytics'),
-            user=os.getenv('POSTGRES_USER', 'postgres'),
-            password=os.getenv('POSTGRES_PASSWORD', 'password')
-        )
-        return conn
-    except Exception as e:
-        logger.error(f"Failed to connect to database: {e}")
-        return None
-
-# Redis connection
-def get_redis_connection():
-    try:
-        r = redis.Redis(
-            host=os.getenv('REDIS_HOST', 'redis-service'),
-            port=int(os.getenv('REDIS_PORT', 6379)),
-            decode_responses=True,
-            socket_connect_timeout=5,
-            socket_timeout=5,
-            retry_on_timeout=True
-        )
-        r.ping()
-        return r
-    except Exception as e:
-        logger.error(f"Failed to connect to Redis: {e}")
-        return None
-
 # Pydantic models
+def to_naive_utc(value):
+    # analytics_data.timestamp is a naive UTC column
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
 class AnalyticsData(BaseModel):
     id: Optional[int] = None
     event_type: str
@@ -73,12 +61,18 @@ class AnalyticsData(BaseModel):
     data: dict
     timestamp: Optional[datetime] = None
 
+    _normalize_timestamp = field_validator('timestamp')(to_naive_utc)
+
+analytics_batch_adapter = TypeAdapter(List[AnalyticsData])
+
 class AnalyticsQuery(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
     event_type: Optional[str] = None
     user_id: Optional[int] = None
 
+    _normalize_dates = field_validator('start_date', 'end_date')(to_naive_utc)
+
 class AnalyticsResponse(BaseModel):
     total_events: int
     events_by_type: dict
@@ -86,6 +80,106 @@ class AnalyticsResponse(BaseModel):
     events_by_date: dict
     top_users: List[dict]
     top_events: List[dict]
+    approximate: bool = False
+    error_bounds: Optional[dict] = None
+
+# Answer date-aligned reads from the rollup tables
+USE_ROLLUPS = os.getenv('ANALYTICS_USE_ROLLUPS', 'true').lower() == 'true'
+app.state.schema_ready = False
+
+# Approximate distinct-count and top-k sketches for ?approx=true
+sketch_store = SketchStore(db)
+
+# Optional columnar copy of analytics_data for vectorized aggregation
+COLUMNAR_ENABLED = os.getenv('ANALYTICS_COLUMNAR_STORE', 'false').lower() == 'true'
+QUERY_ENGINE = os.getenv('ANALYTICS_QUERY_ENGINE', 'postgres')
+columnar_store = ColumnarStore(db) if COLUMNAR_ENABLED else None
+
+# Sliding-window counters pushed to /api/analytics/stream subscribers
+live_stream = LiveStream(redis_client)
+
+# Shared response cache; writes invalidate it by bumping generation counters
+analytics_cache = AnalyticsCache(redis_client)
+# Aggregates over every user; user profiles are scoped by user_id instead
+AGGREGATE_NAMESPACES = ("query", "summary")
+
+async def on_events_ingested(events):
+    """Run after analytics events are committed to Postgres."""
+    await analytics_cache.invalidate(
+        *AGGREGATE_NAMESPACES, scoped={"user": {event.user_id for event in events}}
+    )
+    live_stream.observe(events)
+    if app.state.schema_ready:
+        sketch_store.observe(events)
+    if columnar_store:
+        columnar_store.observe(events)
+
+async def on_partitions_dropped(partitions):
+    """Run after retention has dropped partitions and trimmed the tables derived from them."""
+    # Any user may have had events in them
+    await analytics_cache.invalidate(*AGGREGATE_NAMESPACES, "user")
+
+# Creates partitions ahead of time and applies retention
+partition_manager = PartitionManager(db, on_drop=on_partitions_dropped)
+
+# Write-behind ingest buffer (opt-in)
+WRITE_BEHIND_ENABLED = os.getenv('ANALYTICS_WRITE_BEHIND', 'false').lower() == 'true'
+ingest_buffer = IngestBuffer(db, AnalyticsData, on_flush=on_events_ingested) if WRITE_BEHIND_ENABLED else None
+
+# Lifecycle
+@app.on_event("startup")
+async def startup():
+    await db.connect()
+    await redis_client.connect()
+    app.state.schema_ready = await migrate(db)
+    await live_stream.start()
+    if app.state.schema_ready:
+        await sketch_store.start()
+        await partition_manager.start()
+        if columnar_store:
+            await columnar_store.start()
+    if ingest_buffer:
+        await ingest_buffer.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if ingest_buffer:
+        await ingest_buffer.stop()
+    if columnar_store:
+        await columnar_store.stop()
+    await partition_manager.stop()
+    await sketch_store.stop()
+    await live_stream.stop()
+    await redis_client.close()
+    await db.close()
+
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Database not available"})
+
+def build_where_clause(query: AnalyticsQuery):
+    """Translate an AnalyticsQuery into a WHERE clause with asyncpg placeholders."""
+    where_conditions = []
+    params = []
+    
+    if query.start_date:
+        params.append(query.start_date)
+        where_conditions.append(f"timestamp >= ${len(params)}")
+    
+    if query.end_date:
+        params.append(query.end_date)
+        where_conditions.append(f"timestamp <= ${len(params)}")
+    
+    if query.event_type:
+        params.append(query.event_type)
+        where_conditions.append(f"event_type = ${len(params)}")
+    
+    if query.user_id:
+        params.append(query.user_id)
+        where_conditions.append(f"user_id = ${len(params)}")
+    
+    where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
+    return where_clause, params
 
 # Middleware
 @app.middleware("http")
@@ -113,18 +207,14 @@ app.add_middleware(
 async def health_check():
     try:
         # Check database connection
-        conn = get_db_connection()
-        if not conn:
-            raise Exception("Database not available")
-        
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT 1")
-        
-        conn.close()
+        async with db.acquire() as conn:
+            await conn.fetchval("SELECT 1")
         
         # Check Redis connection
-        redis_conn = get_redis_connection()
-        if not redis_conn:
+        try:
+            async with redis_client.acquire() as redis_conn:
+                await redis_conn.ping()
+        except RedisUnavailable:
             raise Exception("Redis not available")
         
         return {
@@ -147,279 +237,315 @@ async def health_check():
 
 @app.get("/metrics")
 async def metrics():
-    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.post("/api/analytics")
 async def create_analytics_data(data: AnalyticsData):
+    if ingest_buffer:
+        if not ingest_buffer.offer(data):
+            raise HTTPException(status_code=429, detail="Ingest buffer full, retry later")
+        return JSONResponse(status_code=202, content={"message": "Analytics data accepted"})
+    
     try:
-        conn = get_db_connection()
-        if not conn:
-            raise HTTPException(status_code=503, detail="Database not available")
-        
-        with conn.cursor() as cursor:
-            cursor.execute("""
+        data.timestamp = data.timestamp or datetime.utcnow()
+        async with db.acquire() as conn:
+            analytics_id = await conn.fetchval("""
                 INSERT INTO analytics_data (event_type, user_id, data, timestamp)
-                VALUES (%s, %s, %s, %s)
+                VALUES ($1, $2, $3, $4)
                 RETURNING id
-            """, (data.event_type, data.user_id, json.dumps(data.data), data.timestamp or datetime.utcnow()))
-            
-            analytics_id = cursor.fetchone()[0]
-            conn.commit()
-        
-        conn.close()
+            """, data.event_type, data.user_id, data.data, data.timestamp)
         
-        # Invalidate cache
-        redis_conn = get_redis_connection()
-        if redis_conn:
-            redis_conn.delete("analytics:*")
+        data.id = analytics_id
+        await on_events_ingested([data])
         
         logger.info(f"Analytics data created with ID: {analytics_id}")
         return {"id": analytics_id, "message": "Analytics data created successfully"}
         
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error creating analytics data: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.get("/api/analytics")
-async def get_analytics_data(query: AnalyticsQuery = Depends()):
+@app.post("/api/analytics/batch")
+async def create_analytics_batch(request: Request):
     try:
-        # Check cache first
-        redis_conn = get_redis_connection()
-        cache_key = f"analytics:query:{hash(str(query.dict()))}"
-        
-        if redis_conn:
-            cached = redis_conn.get(cache_key)
-            if cached:
-                logger.info("Analytics data retrieved from cache")
-                return json.loads(cached)
-        
-        conn = get_db_connection()
-        if not conn:
-            raise HTTPException(status_code=503, detail="Database not available")
-        
-        # Build query
-        where_conditions = []
-        params = []
+        try:
+            events = analytics_batch_adapter.validate_python(await read_batch(request))
+        except BatchError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
         
-        if query.start_date:
-            where_conditions.append("timestamp >= %s")
-            params.append(query.start_date)
+        async with db.acquire() as conn:
+            ids = await copy_events(conn, events)
         
-        if query.end_date:
-            where_conditions.append("timestamp <= %s")
-            params.append(query.end_date)
+        await on_events_ingested(events)
         
-        if query.event_type:
-            where_conditions.append("event_type = %s")
-            params.append(query.event_type)
-        
-        if query.user_id:
-            where_conditions.append("user_id = %s")
-            params.append(query.user_id)
-        
-        where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
-        
-        with conn.cursor() as cursor:
-            # Get total events
-            cursor.execute(f"SELECT COUNT(*) FROM analytics_data WHERE {where_clause}", params)
-            total_events = cursor.fetchone()[0]
-            
-            # Get events by type
-            cursor.execute(f"""
-                SELECT event_type, COUNT(*) as count
-                FROM analytics_data
-                WHERE {where_clause}
-                GROUP BY event_type
-                ORDER BY count DESC
-            """, params)
-            events_by_type = {row[0]: row[1] for row in cursor.fetchall()}
-            
-            # Get events by user
-            cursor.execute(f"""
-                SELECT user_id, COUNT(*) as count
-                FROM analytics_data
-                WHERE {where_clause}
-                GROUP BY user_id
-                ORDER BY count DESC
-                LIMIT 10
-            """, params)
-            events_by_user = {str(row[0]): row[1] for row in cursor.fetchall()}
-            
-            # Get events by date
-            cursor.execute(f"""
-                SELECT DATE(timestamp) as date, COUNT(*) as count
-                FROM analytics_data
-                WHERE {where_clause}
-                GROUP BY DATE(timestamp)
-                ORDER BY date DESC
-                LIMIT 30
-            """, params)
-            events_by_date = {str(row[0]): row[1] for row in cursor.fetchall()}
-            
-            # Get top users
-            cursor.execute(f"""
-                SELECT user_id, COUNT(*) as count
-                FROM analytics_data
-                WHERE {where_clause}
-                GROUP BY user_id
-                ORDER BY count DESC
-                LIMIT 5
-            """, params)
-            top_users = [{"user_id": row[0], "count": row[1]} for row in cursor.fetchall()]
-            
-            # Get top events
-            cursor.execute(f"""
-                SELECT event_type, COUNT(*) as count
-                FROM analytics_data
-                WHERE {where_clause}
-                GROUP BY event_type
-                ORDER BY count DESC
-                LIMIT 5
-            """, params)
-            top_events = [{"event_type": row[0], "count": row[1]} for row in cursor.fetchall()]
-        
-        conn.close()
+        logger.info(f"Analytics batch of {len(ids)} events created with IDs {ids[0]}-{ids[-1]}")
+        return {
+            "count": len(ids),
+            "first_id": ids[0],
+            "last_id": ids[-1],
+            "message": "Analytics batch created successfully"
+        }
         
-        result = AnalyticsResponse(
-            total_events=total_events,
-            events_by_type=events_by_type,
-            events_by_user=events_by_user,
-            events_by_date=events_by_date,
-            top_users=top_users,
-            top_events=top_events
-        )
+    except (HTTPException, DatabaseUnavailable):
+        raise
+    except Exception as e:
+        logger.error(f"Error creating analytics batch: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+async def compute_analytics(query: AnalyticsQuery, approx: bool, engine: str):
+    # Build query
+    where_clause, params = build_where_clause(query)
+    
+    granularity = pick_granularity(query) if USE_ROLLUPS and app.state.schema_ready else None
+    # Sketches are per day across all users and types, so they cannot apply those filters
+    use_sketches = approx and app.state.schema_ready and not query.event_type and not query.user_id
+    
+    if engine == 'columnar' and not use_sketches:
+        return AnalyticsResponse(**await columnar_store.aggregate(query)).model_dump(mode='json')
+    
+    async with db.acquire() as conn:
+        if use_sketches:
+            sketch, events_by_day = await sketch_store.load(conn, query.start_date, query.end_date)
+            aggregates = approximate_aggregates(sketch, events_by_day)
+        elif granularity:
+            aggregates = await aggregate_from_rollups(conn, query, granularity)
+        else:
+            aggregates = await aggregate_analytics(conn, where_clause, params)
+    
+    return AnalyticsResponse(**aggregates).model_dump(mode='json')
+
+@app.get("/api/analytics")
+async def get_analytics_data(
+    query: AnalyticsQuery = Depends(),
+    approx: bool = False,
+    engine: Optional[str] = Query(None, pattern="^(postgres|columnar)$")
+):
+    try:
+        if engine == 'columnar' and not columnar_store:
+            raise HTTPException(status_code=400, detail="Columnar store is not enabled")
+        engine = engine or (QUERY_ENGINE if columnar_store else 'postgres')
         
         # Cache for 5 minutes
-        if redis_conn:
-            redis_conn.setex(cache_key, 300, json.dumps(result.dict()))
+        result = await analytics_cache.get_or_compute(
+            "query",
+            {**query.model_dump(mode='json'), "approx": approx, "engine": engine},
+            lambda: compute_analytics(query, approx, engine),
+            300
+        )
         
-        logger.info(f"Retrieved analytics data: {total_events} total events")
+        logger.info(f"Retrieved analytics data: {result['total_events']} total events")
         return result
         
+    except (HTTPException, DatabaseUnavailable):
+        raise
     except Exception as e:
         logger.error(f"Error getting analytics data: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+async def raw_summary(conn):
+    # Get summary statistics
+    summary = await conn.fetchrow("""
+        SELECT 
+            COUNT(*) as total_events,
+            COUNT(DISTINCT user_id) as unique_users,
+            COUNT(DISTINCT event_type) as unique_event_types,
+            MIN(timestamp) as first_event,
+            MAX(timestamp) as last_event
+        FROM analytics_data
+    """)
+    
+    # Get recent activity (last 24 hours)
+    recent_events = await conn.fetchval("""
+        SELECT COUNT(*) as recent_events
+        FROM analytics_data
+        WHERE timestamp >= NOW() - INTERVAL '24 hours'
+    """)
+    return summary, recent_events
+
+async def compute_summary(approx: bool):
+    sketch = None
+    async with db.acquire() as conn:
+        if approx:
+            sketch, _ = await sketch_store.load(conn)
+            bounds = await event_bounds(conn)
+            summary = (
+                sketch.events,
+                sketch.users.estimate(),
+                sketch.event_types.estimate(),
+                bounds['first_event'],
+                bounds['last_event']
+            )
+            recent_events = await recent_events_from_rollups(conn)
+        elif USE_ROLLUPS and app.state.schema_ready:
+            summary, recent_events = await summary_from_rollups(conn)
+        else:
+            summary, recent_events = await raw_summary(conn)
+    
+    result = {
+        "total_events": summary[0],
+        "unique_users": summary[1],
+        "unique_event_types": summary[2],
+        "first_event": summary[3].isoformat() if summary[3] else None,
+        "last_event": summary[4].isoformat() if summary[4] else None,
+        "recent_events_24h": recent_events
+    }
+    
+    if sketch is not None:
+        result["top_users"] = [
+            {"user_id": user_id, "count": count, "max_error": error}
+            for user_id, count, error in sketch.top_users.top(5)
+        ]
+        result["top_events"] = [
+            {"event_type": event_type, "count": count, "max_error": error}
+            for event_type, count, error in sketch.top_events.top(5)
+        ]
+        result["approximate"] = True
+        result["error_bounds"] = error_bounds(sketch)
+    
+    return result
+
 @app.get("/api/analytics/summary")
-async def get_analytics_summary():
+async def get_analytics_summary(approx: bool = False):
     try:
-        # Check cache first
-        redis_conn = get_redis_connection()
-        if redis_conn:
-            cached = redis_conn.get("analytics:summary")
-            if cached:
-                logger.info("Analytics summary retrieved from cache")
-                return json.loads(cached)
-        
-        conn = get_db_connection()
-        if not conn:
-            raise HTTPException(status_code=503, detail="Database not available")
-        
-        with conn.cursor() as cursor:
-            # Get summary statistics
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_events,
-                    COUNT(DISTINCT user_id) as unique_users,
-                    COUNT(DISTINCT event_type) as unique_event_types,
-                    MIN(timestamp) as first_event,
-                    MAX(timestamp) as last_event
-                FROM analytics_data
-            """)
-            
-            summary = cursor.fetchone()
-            
-            # Get recent activity (last 24 hours)
-            cursor.execute("""
-                SELECT COUNT(*) as recent_events
-                FROM analytics_data
-                WHERE timestamp >= NOW() - INTERVAL '24 hours'
-            """)
-            
-            recent_events = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        result = {
-            "total_events": summary[0],
-            "unique_users": summary[1],
-            "unique_event_types": summary[2],
-            "first_event": summary[3].isoformat() if summary[3] else None,
-            "last_event": summary[4].isoformat() if summary[4] else None,
-            "recent_events_24h": recent_events
-        }
+        approx = approx and app.state.schema_ready
         
         # Cache for 1 minute
-        if redis_conn:
-            redis_conn.setex("analytics:summary", 60, json.dumps(result))
+        result = await analytics_cache.get_or_compute(
+            "summary", {"approx": approx}, lambda: compute_summary(approx), 60
+        )
         
         logger.info("Retrieved analytics summary")
         return result
         
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error getting analytics summary: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.get("/api/analytics/events/{event_type}")
-async def get_events_by_type(event_type: str, limit: int = 100):
+async def compute_user_profile(user_id: int, recent: int):
+    async with db.acquire() as conn:
+        if app.state.schema_ready:
+            counters = await user_counters(conn, user_id)
+        else:
+            counters = await raw_user_counters(conn, user_id)
+        events = await recent_user_events(conn, user_id, recent)
+    
+    return user_profile(user_id, counters, events)
+
+@app.get("/api/analytics/users/{user_id}")
+async def get_user_analytics(user_id: int, recent: int = Query(10, ge=0, le=RECENT_MAX_EVENTS)):
     try:
-        conn = get_db_connection()
-        if not conn:
-            raise HTTPException(status_code=503, detail="Database not available")
+        # Cache for 1 minute; only events of this user invalidate it
+        result = await analytics_cache.get_or_compute(
+            "user",
+            {"user_id": user_id, "recent": recent},
+            lambda: compute_user_profile(user_id, recent),
+            60,
+            scope=user_id
+        )
         
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT id, user_id, data, timestamp
-                FROM analytics_data
-                WHERE event_type = %s
-                ORDER BY timestamp DESC
-                LIMIT %s
-            """, (event_type, limit))
-            
-            events = []
-            for row in cursor.fetchall():
-                events.append({
-                    "id": row[0],
-                    "user_id": row[1],
-                    "data": json.loads(row[2]),
-                    "timestamp": row[3].isoformat()
-                })
+        logger.info(f"Retrieved analytics for user {user_id}")
+        return result
         
-        conn.close()
+    except DatabaseUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting analytics for user {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.get("/api/analytics/stream")
+async def stream_live_analytics():
+    # One snapshot, then a delta of the changed 1m/5m/1h counters per tick
+    return StreamingResponse(
+        live_stream.subscribe(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/analytics/events/{event_type}")
+async def get_events_by_type(
+    event_type: str,
+    limit: int = Query(100, ge=1, le=PAGE_MAX_EVENTS),
+    cursor: Optional[str] = None
+):
+    try:
+        try:
+            async with db.acquire() as conn:
+                events, next_cursor = await fetch_events_page(conn, event_type, limit, cursor)
+        except CursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         logger.info(f"Retrieved {len(events)} events of type {event_type}")
-        return {"events": events, "count": len(events)}
+        return {"events": events, "count": len(events), "next_cursor": next_cursor}
         
+    except (HTTPException, DatabaseUnavailable):
+        raise
     except Exception as e:
         logger.error(f"Error getting events by type {event_type}: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/api/analytics/events/{event_type}/export")
+async def export_events_by_type(
+    event_type: str,
+    format: str = Query('ndjson', pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None
+):
+    start_date, end_date = to_naive_utc(start_date), to_naive_utc(end_date)
+    
+    # The connection is held for the whole stream and released once the
+    # response finishes, whether it completes, fails or the client goes away
+    resources = AsyncExitStack()
+    try:
+        conn = await resources.enter_async_context(db.acquire())
+        await resources.enter_async_context(conn.transaction(isolation='repeatable_read', readonly=True))
+    except BaseException:
+        await resources.aclose()
+        raise
+    
+    async def body():
+        try:
+            async for chunk in stream_events(conn, event_type, format, start_date, end_date):
+                yield chunk
+        except Exception as e:
+            logger.error(f"Error exporting events of type {event_type}: {str(e)}")
+            raise
+        finally:
+            await resources.aclose()
+    
+    logger.info(f"Exporting events of type {event_type} as {format}")
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{event_type}.{format}"'},
+        background=BackgroundTask(resources.aclose)
+    )
+
 @app.delete("/api/analytics/{analytics_id}")
 async def delete_analytics_data(analytics_id: int):
     try:
-        conn = get_db_connection()
-        if not conn:
-            raise HTTPException(status_code=503, detail="Database not available")
-        
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM analytics_data WHERE id = %s", (analytics_id,))
-            
-            if cursor.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Analytics data not found")
-            
-            conn.commit()
+        async with db.acquire() as conn:
+            user_id = await conn.fetchval(
+                "DELETE FROM analytics_data WHERE id = $1 RETURNING user_id", analytics_id
+            )
         
-        conn.close()
+        if user_id is None:
+            raise HTTPException(status_code=404, detail="Analytics data not found")
         
         # Invalidate cache
-        redis_conn = get_redis_connection()
-        if redis_conn:
-            redis_conn.delete("analytics:*")
+        await analytics_cache.invalidate(*AGGREGATE_NAMESPACES, scoped={"user": [user_id]})
+        if columnar_store:
+            columnar_store.delete(analytics_id)
         
         logger.info(f"Analytics data {analytics_id} deleted")
         return {"message": "Analytics data deleted successfully"}
         
-    except HTTPException:
+    except (HTTPException, DatabaseUnavailable):
         raise
     except Exception as e:
         logger.error(f"Error deleting analytics data {analytics_id}: {str(e)}")
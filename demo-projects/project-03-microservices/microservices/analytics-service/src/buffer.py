@@ -0,0 +1,193 @@
+"""Write-behind buffer for single analytics events.
+
+Accepted events are kept in memory and appended to a local spill segment
+before the request returns. A background task COPYs them to Postgres when
+the batch size is reached or the flush interval elapses, then deletes the
+spill segments that covered the batch. Segments left behind by a crashed
+worker are replayed on startup, so delivery is at-least-once.
+
+Every open segment holds an exclusive flock, which lets a worker tell the
+segments of a live sibling apart from the ones of a dead process.
+"""
+import asyncio
+import fcntl
+import glob
+import logging
+import os
+import time
+from datetime import datetime
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .ingest import copy_events
+
+logger = logging.getLogger(__name__)
+
+BUFFER_QUEUE_DEPTH = Gauge('analytics_buffer_queue_depth', 'Events waiting in the write-behind buffer')
+BUFFER_REJECTED = Counter('analytics_buffer_rejected_total', 'Events rejected because the buffer was full')
+BUFFER_FLUSH_SIZE = Histogram(
+    'analytics_buffer_flush_size',
+    'Events written per buffer flush',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+)
+BUFFER_FLUSH_DURATION = Histogram('analytics_buffer_flush_duration_seconds', 'Time spent writing a buffer flush')
+BUFFER_FLUSH_FAILURES = Counter('analytics_buffer_flush_failures_total', 'Buffer flushes that failed and were retried')
+
+
+class SpillSegment:
+    """An append-only NDJSON file holding events that are not yet in Postgres."""
+
+    def __init__(self, path, create=False):
+        self.path = path
+        flags = os.O_RDWR | os.O_APPEND | (os.O_CREAT | os.O_EXCL if create else 0)
+        self.file = os.fdopen(os.open(path, flags, 0o600), 'a+')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # The previous owner may have deleted the file while we waited
+            if os.fstat(self.file.fileno()).st_nlink == 0:
+                raise FileNotFoundError(path)
+        except OSError:
+            self.file.close()
+            raise
+
+    def append(self, line):
+        self.file.write(line + '\n')
+        self.file.flush()
+
+    def read(self):
+        self.file.seek(0)
+        return [line for line in self.file.read().splitlines() if line.strip()]
+
+    def remove(self):
+        os.remove(self.path)
+        self.file.close()
+
+
+class IngestBuffer:
+    def __init__(self, db, model, on_flush=None):
+        self.db = db
+        self.model = model
+        self.on_flush = on_flush
+        self.max_events = int(os.getenv('ANALYTICS_BUFFER_MAX_EVENTS', 10000))
+        self.batch_size = int(os.getenv('ANALYTICS_BUFFER_BATCH_SIZE', 500))
+        self.flush_interval = float(os.getenv('ANALYTICS_BUFFER_FLUSH_INTERVAL', 1.0))
+        self.spill_dir = os.getenv('ANALYTICS_SPILL_DIR', '/tmp/analytics-spill')
+        self.pending = []
+        self._active = None
+        self._segments = []
+        self._sequence = 0
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        BUFFER_QUEUE_DEPTH.set_function(lambda: len(self.pending))
+
+    async def start(self):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._recover()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.pending and not await self.flush():
+            logger.warning(f"{len(self.pending)} buffered events left in {self.spill_dir} for replay")
+
+    def offer(self, event):
+        """Queue an event; returns False when the buffer is full."""
+        if len(self.pending) >= self.max_events:
+            BUFFER_REJECTED.inc()
+            return False
+
+        if event.timestamp is None:
+            event.timestamp = datetime.utcnow()
+        if self._active is None:
+            self._active = self._open_segment()
+        self._active.append(event.model_dump_json())
+        self.pending.append(event)
+
+        if len(self.pending) >= self.batch_size:
+            self._batch_ready.set()
+        return True
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self.pending:
+                return True
+
+            batch, self.pending = self.pending, []
+            if self._active:
+                self._segments.append(self._active)
+                self._active = None
+            segments, self._segments = self._segments, []
+
+            start_time = time.perf_counter()
+            try:
+                async with self.db.acquire() as conn:
+                    await copy_events(conn, batch)
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} buffered events: {e}")
+                BUFFER_FLUSH_FAILURES.inc()
+                self.pending = batch + self.pending
+                self._segments = segments + self._segments
+                return False
+
+            BUFFER_FLUSH_DURATION.observe(time.perf_counter() - start_time)
+            BUFFER_FLUSH_SIZE.observe(len(batch))
+            # The batch is durable from here on; failures below must not retry it
+            for segment in segments:
+                try:
+                    segment.remove()
+                except OSError as e:
+                    logger.error(f"Failed to remove flushed spill segment {segment.path}: {e}")
+
+            if self.on_flush:
+                try:
+                    await self.on_flush(batch)
+                except Exception as e:
+                    logger.error(f"Post-flush processing of {len(batch)} buffered events failed: {e}")
+            return True
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+
+            try:
+                flushed = not self.pending or await self.flush()
+            except Exception as e:
+                logger.error(f"Buffer flush failed unexpectedly: {e}")
+                flushed = False
+            if not flushed:
+                # Back off instead of spinning while the database is down
+                await asyncio.sleep(self.flush_interval)
+
+    def _open_segment(self):
+        self._sequence += 1
+        path = os.path.join(self.spill_dir, f"spill-{os.getpid()}-{int(time.time())}-{self._sequence}.ndjson")
+        return SpillSegment(path, create=True)
+
+    def _recover(self):
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, 'spill-*.ndjson'))):
+            try:
+                segment = SpillSegment(path)
+            except (BlockingIOError, FileNotFoundError):
+                # Still owned by a live worker, or claimed by one first
+                continue
+
+            events = []
+            for line in segment.read():
+                try:
+                    events.append(self.model.model_validate_json(line))
+                except ValueError as e:
+                    logger.error(f"Dropping unreadable spilled event in {path}: {e}")
+            self.pending.extend(events)
+            self._segments.append(segment)
+            logger.info(f"Recovered {len(events)} buffered events from {path}")
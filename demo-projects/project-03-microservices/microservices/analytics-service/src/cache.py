@@ -0,0 +1,217 @@
+"""Two-tier response cache for the analytics read endpoints.
+
+Redis is the shared tier. Keys are derived from a canonical JSON encoding of
+the request parameters, so every uvicorn worker computes the same key for
+the same query. Each namespace has its own generation counter, and an entry
+may also belong to a scope within it (one user's profile) with a counter of
+its own. Entries are tagged with the counters current when they were
+computed; a write INCRs only the counters it affects and every older entry
+under them becomes stale without being enumerated. A lookup fetches the
+counters and the entry in one MGET.
+
+In front of it sits a size-bounded in-process LRU. A local entry is served
+without touching Redis for ANALYTICS_LOCAL_CACHE_TTL seconds; after that,
+and after any write in this worker, it is served stale while a background
+task revalidates it, until the endpoint's own TTL runs out. Writes made by
+other workers therefore show up locally within ANALYTICS_LOCAL_CACHE_TTL
+plus one refresh.
+
+Concurrent misses for the same key share one in-flight computation.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge
+
+from .redis_client import RedisUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Bump when the shape of cached responses changes
+CACHE_SCHEMA_VERSION = 2
+GENERATION_KEY_PREFIX = "analytics:cache:generation"
+
+CACHE_LOOKUPS = Counter(
+    'analytics_cache_lookups_total',
+    'Analytics cache lookups by tier and outcome (hit, miss, stale, error)',
+    ['namespace', 'tier', 'result']
+)
+CACHE_COALESCED = Counter(
+    'analytics_cache_coalesced_total',
+    'Cache misses that waited on an in-flight computation instead of starting one',
+    ['namespace']
+)
+CACHE_INVALIDATIONS = Counter(
+    'analytics_cache_invalidations_total', 'Analytics cache generation bumps', ['namespace']
+)
+LOCAL_CACHE_ENTRIES = Gauge('analytics_local_cache_entries', 'Entries held in the in-process analytics cache')
+
+
+def cache_key(namespace, params):
+    """Deterministic key for `params`, a JSON-serializable dict."""
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+    digest = hashlib.sha256(canonical.encode()).hexdigest()[:32]
+    return f"analytics:cache:v{CACHE_SCHEMA_VERSION}:{namespace}:{digest}"
+
+
+def generation_key(namespace, scope=None):
+    key = f"{GENERATION_KEY_PREFIX}:{namespace}"
+    return key if scope is None else f"{key}:{scope}"
+
+
+def generation_keys(namespace, scope=None):
+    """Counters an entry is tagged with: its namespace's, then its scope's."""
+    if scope is None:
+        return [generation_key(namespace)]
+    return [generation_key(namespace), generation_key(namespace, scope)]
+
+
+class LocalCache:
+    """LRU of key -> (value, fresh_until, stale_until, epoch)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Bumped on local writes; entries from an older epoch are stale
+        self.epoch = 0
+        LOCAL_CACHE_ENTRIES.set_function(lambda: len(self.entries))
+
+    def get(self, key):
+        """Return (value, is_fresh), or None if absent or past its stale window."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, fresh_until, stale_until, epoch = entry
+        now = time.monotonic()
+        if now >= stale_until:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value, now < fresh_until and epoch == self.epoch
+
+    def set(self, key, value, fresh_for, stale_for, epoch):
+        now = time.monotonic()
+        self.entries[key] = (value, now + fresh_for, now + stale_for, epoch)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class AnalyticsCache:
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.local = LocalCache(int(os.getenv('ANALYTICS_LOCAL_CACHE_SIZE', 1024)))
+        self.local_ttl = float(os.getenv('ANALYTICS_LOCAL_CACHE_TTL', 5))
+        self._inflight = {}
+
+    async def get_or_compute(self, namespace, params, compute, ttl, scope=None):
+        """Return the cached value for `params`, awaiting `compute()` on a miss.
+
+        `compute` must return a JSON-serializable value; `ttl` bounds how long
+        it is kept in Redis and served stale locally. An entry with a `scope`
+        also goes stale when that scope is invalidated (see `invalidate`).
+        """
+        key = cache_key(namespace, params)
+        generations = generation_keys(namespace, scope)
+
+        local = self.local.get(key)
+        if local is not None:
+            value, fresh = local
+            if fresh:
+                CACHE_LOOKUPS.labels(namespace=namespace, tier='local', result='hit').inc()
+            else:
+                CACHE_LOOKUPS.labels(namespace=namespace, tier='local', result='stale').inc()
+                self._load(namespace, key, generations, compute, ttl, background=True)
+            return value
+
+        CACHE_LOOKUPS.labels(namespace=namespace, tier='local', result='miss').inc()
+        if key in self._inflight:
+            CACHE_COALESCED.labels(namespace=namespace).inc()
+        # Shielded so a disconnecting client does not cancel the other waiters
+        return await asyncio.shield(self._load(namespace, key, generations, compute, ttl))
+
+    def _load(self, namespace, key, generations, compute, ttl, background=False):
+        """Start (or join) the single in-flight load for `key`."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fill(namespace, key, generations, compute, ttl))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.pop(key, None))
+        if background:
+            task.add_done_callback(self._log_refresh_failure)
+        return task
+
+    def _log_refresh_failure(self, task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"Background cache refresh failed: {task.exception()}")
+
+    async def _fill(self, namespace, key, generations, compute, ttl):
+        # An invalidation while computing leaves the new entry locally stale
+        epoch = self.local.epoch
+        generation, value = await self._redis_lookup(namespace, key, generations)
+        if value is None:
+            value = await compute()
+            await self._redis_store(key, generation, value, ttl)
+        self.local.set(key, value, min(self.local_ttl, ttl), ttl, epoch)
+        return value
+
+    async def _redis_lookup(self, namespace, key, generations):
+        """Return (generation, value); value is None unless the entry is current."""
+        try:
+            async with self.redis.acquire() as redis_conn:
+                *generation, cached = await redis_conn.mget(*generations, key)
+        except RedisUnavailable:
+            CACHE_LOOKUPS.labels(namespace=namespace, tier='redis', result='error').inc()
+            return None, None
+
+        generation = [int(counter or 0) for counter in generation]
+        if cached is None:
+            CACHE_LOOKUPS.labels(namespace=namespace, tier='redis', result='miss').inc()
+            return generation, None
+
+        cached = json.loads(cached)
+        if cached['generation'] != generation:
+            CACHE_LOOKUPS.labels(namespace=namespace, tier='redis', result='stale').inc()
+            return generation, None
+
+        CACHE_LOOKUPS.labels(namespace=namespace, tier='redis', result='hit').inc()
+        return generation, cached['value']
+
+    async def _redis_store(self, key, generation, value, ttl):
+        if generation is None:
+            # The lookup could not read the generation, so the entry cannot be tagged
+            return
+        try:
+            async with self.redis.acquire() as redis_conn:
+                await redis_conn.setex(key, ttl, json.dumps({"generation": generation, "value": value}))
+        except RedisUnavailable:
+            pass
+
+    async def invalidate(self, *namespaces, scoped=None):
+        """Mark cached responses stale.
+
+        Every entry in `namespaces` goes stale, and so does every entry in a
+        scope listed in `scoped`, a dict of namespace -> scopes.
+        """
+        keys = [(namespace, generation_key(namespace)) for namespace in namespaces]
+        for namespace, scopes in (scoped or {}).items():
+            keys.extend((namespace, generation_key(namespace, scope)) for scope in scopes)
+        if not keys:
+            return
+
+        self.local.epoch += 1
+        try:
+            async with self.redis.acquire() as redis_conn:
+                async with redis_conn.pipeline(transaction=False) as pipe:
+                    for _, key in keys:
+                        pipe.incr(key)
+                    await pipe.execute()
+            for namespace, _ in keys:
+                CACHE_INVALIDATIONS.labels(namespace=namespace).inc()
+        except RedisUnavailable:
+            pass
@@ -0,0 +1,426 @@
+"""Embedded columnar copy of analytics_data for vectorized aggregation.
+
+Events are kept on local disk as immutable segments, one .npy file per
+column (id, timestamp in epoch microseconds, user_id, event_type codes plus
+the segment's own list of event type names). Segments are memory-mapped, so
+a query only pages in the columns it touches. Filters and group-bys run as
+NumPy operations per segment, and segments outside the requested date range
+are skipped by their min/max timestamp.
+
+manifest.json names the live segments and tombstone files and is replaced
+atomically under an flock, so uvicorn workers sharing the directory never
+see a segment twice while it is being compacted. The store is filled once
+from Postgres, then fed from ingest: each worker buffers the events it
+committed and writes them out as a segment every
+ANALYTICS_COLUMNAR_FLUSH_INTERVAL seconds. Deletes are recorded as
+tombstone ids and masked out at query time, until compaction drops the
+rows and prunes their ids.
+
+The store only sees events ingested on this host; run it where every worker
+shares the directory. Events committed while the initial backfill snapshot
+is taken can be missed; delete the directory to rebuild from Postgres.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .aggregation import DATES_LIMIT, TOP_LIMIT, USERS_LIMIT
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+MICROS_PER_DAY = 86_400_000_000
+# Integer keys below this are counted with np.bincount instead of a sort
+BINCOUNT_LIMIT = 1 << 24
+
+
+def to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+class Columns:
+    def __init__(self, ids, timestamps, user_ids, codes, event_types):
+        self.ids = ids
+        self.timestamps = timestamps
+        self.user_ids = user_ids
+        self.codes = codes
+        self.event_types = event_types
+        self.first_timestamp = int(timestamps.min()) if len(timestamps) else None
+        self.last_timestamp = int(timestamps.max()) if len(timestamps) else None
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build columns from (id, timestamp, user_id, event_type) tuples."""
+        event_types = sorted({row[3] for row in rows})
+        code_of = {event_type: code for code, event_type in enumerate(event_types)}
+        return cls(
+            np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([to_micros(row[1]) for row in rows], dtype=np.int64),
+            np.array([row[2] for row in rows], dtype=np.int64),
+            np.array([code_of[row[3]] for row in rows], dtype=np.int32),
+            event_types
+        )
+
+    @classmethod
+    def load(cls, path):
+        def column(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+
+        with open(os.path.join(path, 'event_types.json')) as f:
+            event_types = json.load(f)
+        return cls(column('id'), column('timestamp'), column('user_id'), column('event_type'), event_types)
+
+    def save(self, path):
+        os.makedirs(path)
+        np.save(os.path.join(path, 'id.npy'), self.ids)
+        np.save(os.path.join(path, 'timestamp.npy'), self.timestamps)
+        np.save(os.path.join(path, 'user_id.npy'), self.user_ids)
+        np.save(os.path.join(path, 'event_type.npy'), self.codes)
+        with open(os.path.join(path, 'event_types.json'), 'w') as f:
+            json.dump(self.event_types, f)
+
+    @classmethod
+    def concat(cls, parts, deleted):
+        """Merge segments into one, dropping deleted rows and re-coding event types."""
+        event_types = sorted({event_type for part in parts for event_type in part.event_types})
+        code_of = {event_type: code for code, event_type in enumerate(event_types)}
+        ids, timestamps, user_ids, codes = [], [], [], []
+        for part in parts:
+            keep = ~np.isin(part.ids, deleted)
+            recode = np.array([code_of[event_type] for event_type in part.event_types], dtype=np.int32)
+            ids.append(part.ids[keep])
+            timestamps.append(part.timestamps[keep])
+            user_ids.append(part.user_ids[keep])
+            codes.append(recode[part.codes[keep]])
+        return cls(np.concatenate(ids), np.concatenate(timestamps), np.concatenate(user_ids), np.concatenate(codes), event_types)
+
+
+def _count_keys(values):
+    """Return (keys, counts) for an integer array."""
+    if not len(values):
+        return values[:0], np.zeros(0, dtype=np.int64)
+    low, high = int(values.min()), int(values.max())
+    if high - low < BINCOUNT_LIMIT:
+        counts = np.bincount(values - low)
+        keys = np.flatnonzero(counts)
+        return keys + low, counts[keys]
+    return np.unique(values, return_counts=True)
+
+
+def _merge_counts(keys, counts):
+    if not keys:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    merged_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    merged_counts = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+    return merged_keys, merged_counts
+
+
+def _mask(columns, query, deleted):
+    """Return the boolean row mask for `query`, or None if nothing can match."""
+    start = to_micros(query.start_date) if query.start_date else None
+    end = to_micros(query.end_date) if query.end_date else None
+    if columns.first_timestamp is None:
+        return None
+    if start is not None and columns.last_timestamp < start:
+        return None
+    if end is not None and columns.first_timestamp > end:
+        return None
+
+    mask = np.ones(len(columns.ids), dtype=bool)
+    if start is not None and columns.first_timestamp < start:
+        mask &= columns.timestamps >= start
+    if end is not None and columns.last_timestamp > end:
+        mask &= columns.timestamps <= end
+    if query.event_type:
+        if query.event_type not in columns.event_types:
+            return None
+        mask &= columns.codes == columns.event_types.index(query.event_type)
+    if query.user_id:
+        mask &= columns.user_ids == query.user_id
+    if len(deleted):
+        mask &= ~np.isin(columns.ids, deleted)
+    return mask
+
+
+def aggregate_columns(parts, query, deleted):
+    """Answer an AnalyticsQuery over column sets with the AnalyticsResponse fields."""
+    total_events = 0
+    by_type = {}
+    user_keys, user_counts = [], []
+    date_keys, date_counts = [], []
+
+    for columns in parts:
+        mask = _mask(columns, query, deleted)
+        if mask is None:
+            continue
+        matched = int(np.count_nonzero(mask))
+        if not matched:
+            continue
+        total_events += matched
+
+        type_counts = np.bincount(columns.codes[mask], minlength=len(columns.event_types))
+        for code in np.flatnonzero(type_counts):
+            event_type = columns.event_types[code]
+            by_type[event_type] = by_type.get(event_type, 0) + int(type_counts[code])
+
+        keys, counts = _count_keys(columns.user_ids[mask])
+        user_keys.append(keys)
+        user_counts.append(counts)
+        keys, counts = _count_keys(columns.timestamps[mask] // MICROS_PER_DAY)
+        date_keys.append(keys)
+        date_counts.append(counts)
+
+    users, counts = _merge_counts(user_keys, user_counts)
+    top = np.argsort(-counts, kind='stable')[:USERS_LIMIT]
+    by_user = [(int(users[i]), int(counts[i])) for i in top]
+
+    days, counts = _merge_counts(date_keys, date_counts)
+    by_date = [(str(np.datetime64(int(days[i]), 'D')), int(counts[i])) for i in range(len(days) - 1, -1, -1)][:DATES_LIMIT]
+
+    by_type = sorted(by_type.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "total_events": total_events,
+        "events_by_type": dict(by_type),
+        "events_by_user": {str(user_id): count for user_id, count in by_user},
+        "events_by_date": dict(by_date),
+        "top_users": [{"user_id": user_id, "count": count} for user_id, count in by_user[:TOP_LIMIT]],
+        "top_events": [{"event_type": event_type, "count": count} for event_type, count in by_type[:TOP_LIMIT]]
+    }
+
+
+class ColumnarStore:
+    def __init__(self, db):
+        self.db = db
+        self.directory = os.getenv('ANALYTICS_COLUMNAR_DIR', '/tmp/analytics-columnar')
+        self.segment_rows = int(os.getenv('ANALYTICS_COLUMNAR_SEGMENT_ROWS', 100_000))
+        self.flush_interval = float(os.getenv('ANALYTICS_COLUMNAR_FLUSH_INTERVAL', 5))
+        self.compact_after = int(os.getenv('ANALYTICS_COLUMNAR_COMPACT_AFTER', 8))
+        self.retention_days = int(os.getenv('ANALYTICS_RETENTION_DAYS', 0))
+        self.pending = []
+        self.pending_deletes = []
+        # Events with ids at or below this were loaded by the backfill
+        self.backfilled_id = None
+        self._manifest_mtime = None
+        self._segments = {}
+        self._deleted = np.zeros(0, dtype=np.int64)
+        self._task = None
+
+    # Manifest and files
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    @asynccontextmanager
+    async def _locked(self):
+        fd = os.open(self._path('.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            await asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path('manifest.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, manifest):
+        tmp = self._path(f'manifest.json.{os.getpid()}')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path('manifest.json'))
+
+    def _write_segment(self, columns):
+        name = f"{time.time_ns():020d}-{os.getpid()}"
+        tmp = self._path('tmp', name)
+        columns.save(tmp)
+        os.rename(tmp, self._path('segments', name))
+        return name
+
+    def _write_tombstones(self, ids):
+        name = f"{time.time_ns():020d}-{os.getpid()}.npy"
+        tmp = self._path('tmp', name)
+        np.save(tmp, np.asarray(ids, dtype=np.int64))
+        os.rename(tmp, self._path('tombstones', name))
+        return name
+
+    def _columns(self, name):
+        columns = self._segments.get(name)
+        if columns is None:
+            columns = Columns.load(self._path('segments', name))
+        return columns
+
+    def _refresh(self):
+        """Reload the manifest if another worker replaced it."""
+        while True:
+            try:
+                mtime = os.stat(self._path('manifest.json')).st_mtime_ns
+                if mtime == self._manifest_mtime:
+                    return
+                manifest = self._read_manifest()
+                segments = {name: self._columns(name) for name in manifest['segments']}
+                tombstones = [np.load(self._path('tombstones', name)) for name in manifest['tombstones']]
+                break
+            except FileNotFoundError:
+                # A compaction replaced the manifest between reading it and loading a file
+                if self._read_manifest() is None:
+                    return
+        self._segments = segments
+        self._deleted = np.concatenate(tombstones) if tombstones else np.zeros(0, dtype=np.int64)
+        self.backfilled_id = manifest['backfilled_id']
+        self._manifest_mtime = mtime
+
+    # Lifecycle
+
+    async def start(self):
+        for subdirectory in ('segments', 'tombstones', 'tmp'):
+            os.makedirs(self._path(subdirectory), exist_ok=True)
+        async with self._locked():
+            if self._read_manifest() is None:
+                await self._backfill()
+        self._refresh()
+        self.pending = [row for row in self.pending if row[0] > self.backfilled_id]
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _backfill(self):
+        """Load every row from Postgres; only runs while there is no manifest."""
+        shutil.rmtree(self._path('segments'))
+        os.makedirs(self._path('segments'))
+        names = []
+        backfilled_id = 0
+        async with self.db.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                cursor = await conn.cursor("SELECT id, timestamp, user_id, event_type FROM analytics_data")
+                while True:
+                    rows = await cursor.fetch(self.segment_rows)
+                    if not rows:
+                        break
+                    names.append(self._write_segment(Columns.from_rows(rows)))
+                    backfilled_id = max(backfilled_id, max(row[0] for row in rows))
+        self._write_manifest({"segments": names, "tombstones": [], "backfilled_id": backfilled_id})
+        logger.info(f"Backfilled columnar store with {len(names)} segments up to id {backfilled_id}")
+
+    # Writes
+
+    def observe(self, events):
+        """Buffer committed AnalyticsData events until the next flush."""
+        for event in events:
+            if self.backfilled_id is None or event.id > self.backfilled_id:
+                self.pending.append((event.id, event.timestamp, event.user_id, event.event_type))
+
+    def delete(self, analytics_id):
+        self.pending_deletes.append(analytics_id)
+
+    async def flush(self):
+        if self.backfilled_id is None or not (self.pending or self.pending_deletes):
+            return
+        rows, self.pending = self.pending, []
+        deletes, self.pending_deletes = self.pending_deletes, []
+        try:
+            async with self._locked():
+                manifest = self._read_manifest()
+                if rows:
+                    manifest['segments'].append(self._write_segment(Columns.from_rows(rows)))
+                if deletes:
+                    manifest['tombstones'].append(self._write_tombstones(deletes))
+                removed, pruned = self._compact(manifest)
+                self._write_manifest(manifest)
+            for name in removed:
+                shutil.rmtree(self._path('segments', name), ignore_errors=True)
+            for name in pruned:
+                try:
+                    os.remove(self._path('tombstones', name))
+                except FileNotFoundError:
+                    pass
+        except Exception as e:
+            logger.error(f"Failed to flush {len(rows)} events to the columnar store: {e}")
+            self.pending = rows + self.pending
+            self.pending_deletes = deletes + self.pending_deletes
+
+    def _compact(self, manifest):
+        """Expire and merge segments, then prune the tombstones they applied.
+
+        Returns the segment and tombstone names no longer in the manifest.
+        """
+        removed = []
+        if self.retention_days > 0:
+            # Whole segments only, so rows may outlive the Postgres partitions a little
+            cutoff = to_micros(datetime.utcnow() - timedelta(days=self.retention_days))
+            removed = [name for name in manifest['segments'] if self._columns(name).last_timestamp < cutoff]
+
+        small = [
+            name for name in manifest['segments']
+            if name not in removed and len(self._columns(name).ids) < self.segment_rows
+        ]
+        if len(small) >= self.compact_after:
+            tombstones = [np.load(self._path('tombstones', name)) for name in manifest['tombstones']]
+            deleted = np.concatenate(tombstones) if tombstones else np.zeros(0, dtype=np.int64)
+            merged = Columns.concat([self._columns(name) for name in small], deleted)
+            removed += small
+            manifest['segments'].append(self._write_segment(merged))
+
+        manifest['segments'] = [name for name in manifest['segments'] if name not in removed]
+        return removed, self._prune_tombstones(manifest, removed)
+
+    def _prune_tombstones(self, manifest, removed):
+        """Drop tombstone ids whose rows were in `removed` segments.
+
+        Ids are unique, so those rows are gone from every live segment. Ids of
+        rows that are in no segment yet, because another worker has not
+        flushed them, are kept. Returns the tombstone names replaced.
+        """
+        if not removed or not manifest['tombstones']:
+            return []
+        applied = np.concatenate([self._columns(name).ids for name in removed])
+        pruned, tombstones = [], []
+        for name in manifest['tombstones']:
+            ids = np.load(self._path('tombstones', name))
+            remaining = ids[~np.isin(ids, applied)]
+            if len(remaining) == len(ids):
+                tombstones.append(name)
+                continue
+            pruned.append(name)
+            if len(remaining):
+                tombstones.append(self._write_tombstones(remaining))
+        manifest['tombstones'] = tombstones
+        return pruned
+
+    # Reads
+
+    async def aggregate(self, query):
+        self._refresh()
+        parts = list(self._segments.values())
+        if self.pending:
+            parts.append(Columns.from_rows(self.pending))
+        deleted = self._deleted
+        if self.pending_deletes:
+            deleted = np.concatenate([deleted, np.asarray(self.pending_deletes, dtype=np.int64)])
+        # NumPy releases the GIL for the heavy lifting, so run it off the event loop
+        return await asyncio.to_thread(aggregate_columns, parts, query, deleted)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+from prometheus_client import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Pool metrics
+POOL_SIZE = Gauge('db_pool_size', 'Open connections in the Postgres pool')
+POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Postgres connections currently checked out')
+POOL_WAITING = Gauge('db_pool_acquire_waiting', 'Requests waiting for a Postgres connection')
+POOL_ACQUIRE_DURATION = Histogram(
+    'db_pool_acquire_duration_seconds',
+    'Time spent waiting to acquire a Postgres connection',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when no pooled connection can be handed out."""
+
+
+def _encode_jsonb(value):
+    # Binary JSONB is a version byte followed by the JSON text
+    return b'\x01' + json.dumps(value).encode()
+
+
+def _decode_jsonb(value):
+    return json.loads(value[1:])
+
+
+async def _init_connection(conn):
+    # Decode JSONB columns straight into Python objects; the binary format
+    # is required for COPY
+    await conn.set_type_codec(
+        'jsonb', encoder=_encode_jsonb, decoder=_decode_jsonb, schema='pg_catalog', format='binary'
+    )
+    await conn.set_type_codec('json', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+class Database:
+    """Bounded asyncpg pool shared by every request in the worker process."""
+
+    def __init__(self):
+        self.pool = None
+        self.min_size = int(os.getenv('POSTGRES_POOL_MIN_SIZE', 2))
+        self.max_size = int(os.getenv('POSTGRES_POOL_MAX_SIZE', 10))
+        self.acquire_timeout = float(os.getenv('POSTGRES_POOL_ACQUIRE_TIMEOUT', 5))
+        self._lock = asyncio.Lock()
+        POOL_SIZE.set_function(lambda: self.pool.get_size() if self.pool else 0)
+
+    async def connect(self):
+        async with self._lock:
+            if self.pool:
+                return self.pool
+            try:
+                self.pool = await asyncpg.create_pool(
+                    host=os.getenv('POSTGRES_HOST', 'postgres-service'),
+                    port=int(os.getenv('POSTGRES_PORT', 5432)),
+                    database=os.getenv('POSTGRES_DB', 'analytics'),
+                    user=os.getenv('POSTGRES_USER', 'postgres'),
+                    password=os.getenv('POSTGRES_PASSWORD', 'password'),
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    init=_init_connection
+                )
+                logger.info(f"Postgres pool ready (min={self.min_size}, max={self.max_size})")
+            except Exception as e:
+                logger.error(f"Failed to create database pool: {e}")
+                self.pool = None
+            return self.pool
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def acquire(self):
+        pool = self.pool or await self.connect()
+        if not pool:
+            raise DatabaseUnavailable("Database not available")
+
+        start_time = time.perf_counter()
+        POOL_WAITING.inc()
+        try:
+            conn = await pool.acquire(timeout=self.acquire_timeout)
+        except (asyncio.TimeoutError, OSError, asyncpg.PostgresError) as e:
+            logger.error(f"Failed to acquire database connection: {e}")
+            raise DatabaseUnavailable("Database not available") from e
+        finally:
+            POOL_WAITING.dec()
+            POOL_ACQUIRE_DURATION.observe(time.perf_counter() - start_time)
+
+        POOL_IN_USE.inc()
+        try:
+            yield conn
+        finally:
+            POOL_IN_USE.dec()
+            await pool.release(conn)
+
+
+db = Database()
@@ -0,0 +1,128 @@
+"""Raw event reads: keyset pages and streaming exports.
+
+Events of a type are ordered newest first by (timestamp, id). A page ends
+with an opaque cursor encoding the last (timestamp, id) returned; the next
+page seeks past it on idx_analytics_event_type_timestamp instead of
+counting an OFFSET. Exports walk the same index through a server-side
+cursor, so memory stays flat however many rows match.
+"""
+import base64
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+PAGE_MAX_EVENTS = int(os.getenv('ANALYTICS_EVENTS_PAGE_MAX', 1000))
+EXPORT_PREFETCH = int(os.getenv('ANALYTICS_EXPORT_PREFETCH', 1000))
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CSV_COLUMNS = ('id', 'event_type', 'user_id', 'timestamp', 'data')
+
+
+class CursorError(Exception):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(timestamp, event_id):
+    raw = f"{timestamp.isoformat()}|{event_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, event_id = raw.split('|')
+        timestamp, event_id = datetime.fromisoformat(timestamp), int(event_id)
+    except ValueError as e:
+        raise CursorError(f"Invalid cursor: {cursor}") from e
+    # analytics_data.timestamp is naive; asyncpg rejects an aware bound
+    if timestamp.tzinfo is not None:
+        raise CursorError(f"Invalid cursor: {cursor}")
+    return timestamp, event_id
+
+
+def _event_filter(event_type, start_date=None, end_date=None, cursor=None):
+    params = [event_type]
+    conditions = ["event_type = $1", "timestamp IS NOT NULL"]
+
+    if start_date:
+        params.append(start_date)
+        conditions.append(f"timestamp >= ${len(params)}")
+
+    if end_date:
+        params.append(end_date)
+        conditions.append(f"timestamp <= ${len(params)}")
+
+    if cursor:
+        params.extend(decode_cursor(cursor))
+        conditions.append(f"(timestamp, id) < (${len(params) - 1}, ${len(params)})")
+
+    return " AND ".join(conditions), params
+
+
+def _serialize(row):
+    return {
+        "id": row['id'],
+        "user_id": row['user_id'],
+        "data": row['data'],
+        "timestamp": row['timestamp'].isoformat()
+    }
+
+
+async def fetch_events_page(conn, event_type, limit, cursor=None):
+    """Return (events, next_cursor); next_cursor is None on the last page."""
+    where_clause, params = _event_filter(event_type, cursor=cursor)
+    params.append(limit + 1)
+    rows = await conn.fetch(f"""
+        SELECT id, user_id, data, timestamp
+        FROM analytics_data
+        WHERE {where_clause}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ${len(params)}
+    """, *params)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+    return [_serialize(row) for row in rows], next_cursor
+
+
+def _format_ndjson(rows):
+    return ''.join(json.dumps(_serialize(row)) + '\n' for row in rows)
+
+
+def _format_csv(rows, header=False):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow((row['id'], row['event_type'], row['user_id'], row['timestamp'].isoformat(), json.dumps(row['data'])))
+    return out.getvalue()
+
+
+async def stream_events(conn, event_type, export_format, start_date=None, end_date=None):
+    """Yield the matching events as NDJSON or CSV text chunks.
+
+    `conn` must already be inside a transaction, which asyncpg cursors need.
+    """
+    where_clause, params = _event_filter(event_type, start_date, end_date)
+    cursor = await conn.cursor(f"""
+        SELECT id, event_type, user_id, data, timestamp
+        FROM analytics_data
+        WHERE {where_clause}
+        ORDER BY timestamp DESC, id DESC
+    """, *params)
+
+    if export_format == 'csv':
+        yield _format_csv([], header=True)
+    while True:
+        rows = await cursor.fetch(EXPORT_PREFETCH)
+        if not rows:
+            break
+        yield _format_csv(rows) if export_format == 'csv' else _format_ndjson(rows)
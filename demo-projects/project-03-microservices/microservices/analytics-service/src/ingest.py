@@ -0,0 +1,89 @@
+"""Bulk ingest for analytics events.
+
+Batches arrive as a JSON array or as NDJSON (one event per line) and are
+loaded with a single COPY inside one transaction. IDs are drawn from the
+table's sequence up front so the response can report the assigned range.
+"""
+import json
+import os
+from datetime import datetime
+
+BATCH_MAX_EVENTS = int(os.getenv('ANALYTICS_BATCH_MAX_EVENTS', 10000))
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+COPY_COLUMNS = ('id', 'event_type', 'user_id', 'data', 'timestamp')
+
+
+class BatchError(Exception):
+    """Raised when a batch payload cannot be parsed."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _check_size(count):
+    if count > BATCH_MAX_EVENTS:
+        raise BatchError(f"Batch exceeds {BATCH_MAX_EVENTS} events", status_code=413)
+
+
+async def _read_ndjson(request):
+    events = []
+    buffer = b''
+    line_number = 0
+
+    def parse(line):
+        if line.strip():
+            try:
+                events.append(json.loads(line))
+            except ValueError as e:
+                raise BatchError(f"Invalid JSON on line {line_number}: {e}")
+            _check_size(len(events))
+
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line_number += 1
+            parse(line)
+
+    line_number += 1
+    parse(buffer)
+    return events
+
+
+async def read_batch(request):
+    """Return the raw event dicts from a JSON array or NDJSON request body."""
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type in NDJSON_CONTENT_TYPES:
+        events = await _read_ndjson(request)
+    else:
+        try:
+            events = json.loads(await request.body())
+        except ValueError as e:
+            raise BatchError(f"Invalid JSON: {e}")
+        if not isinstance(events, list):
+            raise BatchError("Expected a JSON array of events")
+        _check_size(len(events))
+
+    if not events:
+        raise BatchError("Batch contains no events")
+    return events
+
+
+async def copy_events(conn, events):
+    """COPY validated AnalyticsData events into analytics_data and return their IDs."""
+    now = datetime.utcnow()
+    async with conn.transaction():
+        ids = await conn.fetch("""
+            SELECT nextval(pg_get_serial_sequence('analytics_data', 'id'))
+            FROM generate_series(1, $1)
+        """, len(events))
+        ids = [row[0] for row in ids]
+        records = []
+        for analytics_id, event in zip(ids, events):
+            event.id = analytics_id
+            event.timestamp = event.timestamp or now
+            records.append((analytics_id, event.event_type, event.user_id, event.data, event.timestamp))
+        await conn.copy_records_to_table('analytics_data', records=records, columns=COPY_COLUMNS)
+    return ids
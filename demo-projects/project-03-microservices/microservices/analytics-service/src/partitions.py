@@ -0,0 +1,211 @@
+"""Time partitions and retention for analytics_data.
+
+analytics_data is range-partitioned on timestamp into daily or monthly
+partitions (ANALYTICS_PARTITION_INTERVAL), named analytics_data_pYYYYMMDD
+or analytics_data_pYYYYMM. Date-filtered queries only scan the partitions
+they overlap. A default partition catches rows that arrive before their
+partition exists.
+
+A background job, serialized across workers by an advisory lock:
+
+- creates the partitions ANALYTICS_PARTITIONS_AHEAD periods ahead of now;
+- moves rows out of the default partition into partitions of their own;
+- with ANALYTICS_RETENTION_DAYS set, drops partitions that ended before
+  the retention window, together with the rollup and sketch rows covering
+  the same period, then calls on_drop so cached results can be invalidated.
+
+Rows moved or dropped this way bypass the rollup triggers, which fire only
+for statements against the parent table.
+"""
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+PARTITION_LOCK_ID = 7_301_002
+DEFAULT_PARTITION = "analytics_data_default"
+
+PARTITION_NAME_FORMATS = {
+    'day': '%Y%m%d',
+    'month': '%Y%m',
+}
+PARTITION_NAME = re.compile(r'^analytics_data_p(\d{6}|\d{8})$')
+
+PARTITION_INTERVAL = os.getenv('ANALYTICS_PARTITION_INTERVAL', 'month')
+if PARTITION_INTERVAL not in PARTITION_NAME_FORMATS:
+    raise ValueError(f"ANALYTICS_PARTITION_INTERVAL must be one of {', '.join(PARTITION_NAME_FORMATS)}")
+PARTITIONS_AHEAD = int(os.getenv('ANALYTICS_PARTITIONS_AHEAD', 3))
+
+PARTITIONS_CREATED = Counter('analytics_partitions_created_total', 'analytics_data partitions created')
+PARTITIONS_DROPPED = Counter('analytics_partitions_dropped_total', 'analytics_data partitions dropped by retention')
+
+
+def period_start(value, interval):
+    if interval == 'month':
+        return datetime(value.year, value.month, 1)
+    return datetime(value.year, value.month, value.day)
+
+
+def next_period(start, interval):
+    if interval == 'month':
+        return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start + timedelta(days=1)
+
+
+def partition_name(start, interval):
+    return f"analytics_data_p{start.strftime(PARTITION_NAME_FORMATS[interval])}"
+
+
+def parse_partition_name(name):
+    """Return (start, end) for a partition name, or None if it is not one of ours."""
+    match = PARTITION_NAME.match(name)
+    if not match:
+        return None
+    digits = match.group(1)
+    interval = 'day' if len(digits) == 8 else 'month'
+    start = datetime.strptime(digits, PARTITION_NAME_FORMATS[interval])
+    return start, next_period(start, interval)
+
+
+async def existing_partitions(conn):
+    """Return {name: (start, end)} for the range partitions of analytics_data."""
+    rows = await conn.fetch("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'analytics_data'::regclass
+    """)
+    partitions = {}
+    for row in rows:
+        bounds = parse_partition_name(row['relname'])
+        if bounds:
+            partitions[row['relname']] = bounds
+    return partitions
+
+
+async def create_partition(conn, start, interval):
+    """Create the partition for the period at `start`, claiming its rows from the default partition."""
+    name = partition_name(start, interval)
+    end = next_period(start, interval)
+    # Built detached and then attached, because a plain CREATE ... PARTITION OF
+    # fails while the default partition holds rows in the new range
+    await conn.execute(f"CREATE TABLE {name} (LIKE analytics_data INCLUDING DEFAULTS)")
+    await conn.execute(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE timestamp >= $1 AND timestamp < $2
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, start, end)
+    await conn.execute(f"""
+        ALTER TABLE analytics_data ATTACH PARTITION {name}
+        FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+    """)
+    PARTITIONS_CREATED.inc()
+    logger.info(f"Created partition {name}")
+
+
+async def ensure_partitions(conn, interval, ahead, now=None):
+    """Create missing partitions up to `ahead` periods past now and for rows parked in the default partition."""
+    now = now or datetime.utcnow()
+    existing = {start for start, _ in (await existing_partitions(conn)).values()}
+
+    wanted = set()
+    start = period_start(now, interval)
+    for _ in range(ahead + 1):
+        wanted.add(start)
+        start = next_period(start, interval)
+
+    parked = await conn.fetch(
+        f"SELECT DISTINCT date_trunc('{interval}', timestamp) AS start FROM {DEFAULT_PARTITION}"
+    )
+    wanted.update(row['start'] for row in parked)
+
+    for start in sorted(wanted - existing):
+        await create_partition(conn, start, interval)
+
+
+async def drop_expired_partitions(conn, retention_days, now=None):
+    """Drop partitions that ended before the retention window; returns the dropped names."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    expired = {
+        name: end for name, (_, end) in (await existing_partitions(conn)).items() if end <= cutoff
+    }
+    if not expired:
+        return []
+
+    boundary = max(expired.values())
+    for name in sorted(expired):
+        await conn.execute(f"DROP TABLE {name}")
+        PARTITIONS_DROPPED.inc()
+    # Everything before the boundary is gone from analytics_data, so the
+    # derived tables are trimmed to match
+    await conn.execute(f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < $1", boundary)
+    for granularity in ('minute', 'hour', 'day'):
+        await conn.execute(f"DELETE FROM analytics_rollup_{granularity} WHERE bucket < $1", boundary)
+    await conn.execute("DELETE FROM analytics_sketches WHERE bucket < $1", boundary.date())
+    # Per-user counters that included dropped rows are recounted from what is left
+    pairs = await conn.fetch("""
+        DELETE FROM analytics_user_counters WHERE first_seen < $1
+        RETURNING user_id, event_type
+    """, boundary)
+    if pairs:
+        await conn.execute("""
+            INSERT INTO analytics_user_counters (user_id, event_type, count, first_seen, last_seen)
+            SELECT user_id, event_type, COUNT(*), MIN(timestamp), MAX(timestamp)
+            FROM analytics_data
+            WHERE (user_id, event_type) IN (SELECT * FROM unnest($1::integer[], $2::varchar[]))
+            GROUP BY 1, 2
+        """, [pair['user_id'] for pair in pairs], [pair['event_type'] for pair in pairs])
+
+    logger.info(f"Retention dropped partitions {', '.join(sorted(expired))}")
+    return sorted(expired)
+
+
+class PartitionManager:
+    def __init__(self, db, on_drop=None):
+        self.db = db
+        # Awaited with the dropped partition names once retention has committed
+        self.on_drop = on_drop
+        self.retention_days = int(os.getenv('ANALYTICS_RETENTION_DAYS', 0))
+        self.maintenance_interval = float(os.getenv('ANALYTICS_PARTITION_MAINTENANCE_INTERVAL', 3600))
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.maintain()
+            await asyncio.sleep(self.maintenance_interval)
+
+    async def maintain(self):
+        try:
+            async with self.db.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("SELECT pg_advisory_xact_lock($1)", PARTITION_LOCK_ID)
+                    await ensure_partitions(conn, PARTITION_INTERVAL, PARTITIONS_AHEAD)
+
+                if self.retention_days > 0:
+                    async with conn.transaction():
+                        await conn.execute("SELECT pg_advisory_xact_lock($1)", PARTITION_LOCK_ID)
+                        dropped = await drop_expired_partitions(conn, self.retention_days)
+                    if dropped and self.on_drop:
+                        await self.on_drop(dropped)
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
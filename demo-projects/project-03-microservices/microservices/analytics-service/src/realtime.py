@@ -0,0 +1,212 @@
+"""Live sliding-window event counts pushed to dashboards over SSE.
+
+Each worker counts the events it ingests per second and event type, and
+keeps running totals for the last minute, five minutes and hour. Once per
+ANALYTICS_STREAM_TICK the worker:
+
+- publishes its new per-second counts on a Redis channel, so every worker
+  sees every event whichever worker ingested it;
+- expires buckets that left each window;
+- sends the counters that changed to every subscriber.
+
+A tick's message is serialized once and shared by all subscribers, so the
+cost grows with events and ticks, not with clients times polls. New
+subscribers start from a full snapshot. A subscriber that falls more than
+ANALYTICS_STREAM_QUEUE messages behind is resynced with a fresh snapshot
+instead of buffering without bound. Without Redis a worker only counts its
+own events.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from prometheus_client import Counter as MetricCounter, Gauge
+
+from .redis_client import RedisUnavailable
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = {'1m': 60, '5m': 300, '1h': 3600}
+HORIZON = max(WINDOWS.values())
+EPOCH = datetime(1970, 1, 1)
+
+STREAM_SUBSCRIBERS = Gauge('analytics_stream_subscribers', 'Connected live analytics subscribers')
+STREAM_RESYNCS = MetricCounter('analytics_stream_resyncs_total', 'Slow subscribers reset to a snapshot')
+
+
+class SlidingWindows:
+    """Per-second buckets with a running per-event-type total for each window."""
+
+    def __init__(self, now):
+        self.buckets = {}
+        self.totals = {name: Counter() for name in WINDOWS}
+        # Last second already subtracted from each window
+        self.expired = {name: now - size for name, size in WINDOWS.items()}
+
+    def add(self, second, event_type, count):
+        if second <= self.expired['1h']:
+            return
+        self.buckets.setdefault(second, Counter())[event_type] += count
+        for name in WINDOWS:
+            if second > self.expired[name]:
+                self.totals[name][event_type] += count
+
+    def advance(self, now):
+        """Drop buckets that fell out of each window; returns the changed (window, event_type) pairs."""
+        changed = set()
+        for name, size in WINDOWS.items():
+            for second in range(self.expired[name] + 1, now - size + 1):
+                for event_type, count in self.buckets.get(second, {}).items():
+                    self.totals[name][event_type] -= count
+                    changed.add((name, event_type))
+                    if not self.totals[name][event_type]:
+                        del self.totals[name][event_type]
+            self.expired[name] = max(self.expired[name], now - size)
+        for second in [second for second in self.buckets if second <= self.expired['1h']]:
+            del self.buckets[second]
+        return changed
+
+    def snapshot(self):
+        return {name: dict(totals) for name, totals in self.totals.items()}
+
+
+class LiveStream:
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.tick = float(os.getenv('ANALYTICS_STREAM_TICK', 1.0))
+        self.queue_size = int(os.getenv('ANALYTICS_STREAM_QUEUE', 64))
+        self.channel = os.getenv('ANALYTICS_STREAM_CHANNEL', 'analytics:live')
+        self.origin = uuid.uuid4().hex
+        self.windows = SlidingWindows(int(time.time()))
+        self.subscribers = set()
+        # Event types counted since the last tick, and the local
+        # (second, event_type) counts still to be published
+        self._touched = set()
+        self._outbox = Counter()
+        self._tasks = []
+        STREAM_SUBSCRIBERS.set_function(lambda: len(self.subscribers))
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._relay())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    # Counting
+
+    def _add(self, second, event_type, count):
+        self.windows.add(second, event_type, count)
+        self._touched.add(event_type)
+
+    def observe(self, events):
+        """Count committed AnalyticsData events by their timestamp."""
+        now = int(time.time())
+        for event in events:
+            second = int((event.timestamp - EPOCH).total_seconds()) if event.timestamp else now
+            # Clock skew must not park counts past the window edge
+            second = min(second, now)
+            if second > now - HORIZON:
+                self._add(second, event.event_type, 1)
+                self._outbox[(second, event.event_type)] += 1
+
+    async def _publish(self):
+        if not self._outbox:
+            return
+        counts, self._outbox = self._outbox, Counter()
+        message = json.dumps({
+            "origin": self.origin,
+            "counts": [[second, event_type, count] for (second, event_type), count in counts.items()]
+        })
+        try:
+            async with self.redis.acquire() as redis_conn:
+                await redis_conn.publish(self.channel, message)
+        except RedisUnavailable:
+            pass
+
+    async def _relay(self):
+        """Fold counts published by other workers into the local windows."""
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        payload = json.loads(message['data'])
+                        if payload['origin'] == self.origin:
+                            continue
+                        for second, event_type, count in payload['counts']:
+                            self._add(second, event_type, count)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Live counts relay disconnected: {e}")
+                await asyncio.sleep(self.tick)
+
+    # Fan-out
+
+    def _message(self, event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def snapshot_message(self):
+        return self._message('snapshot', {"timestamp": time.time(), "windows": self.windows.snapshot()})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self._tick()
+            except Exception as e:
+                # Subscribers stay connected and get the next tick's delta
+                logger.error(f"Live counts tick failed: {e}")
+
+    async def _tick(self):
+        await self._publish()
+
+        changed = self.windows.advance(int(time.time()))
+        changed.update((name, event_type) for name in WINDOWS for event_type in self._touched)
+        self._touched = set()
+        if not changed or not self.subscribers:
+            return
+
+        delta = {name: {} for name in WINDOWS}
+        for name, event_type in changed:
+            delta[name][event_type] = self.windows.totals[name].get(event_type, 0)
+        self.broadcast(self._message('delta', {"timestamp": time.time(), "windows": delta}))
+
+    def broadcast(self, message):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Too far behind to catch up on deltas; start it over from a snapshot
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.snapshot_message())
+                STREAM_RESYNCS.inc()
+
+    async def subscribe(self, keepalive=15):
+        """Yield SSE messages for one client until it disconnects."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        try:
+            yield self.snapshot_message()
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            self.subscribers.discard(queue)
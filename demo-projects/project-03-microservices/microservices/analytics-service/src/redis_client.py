@@ -0,0 +1,123 @@
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import redis.asyncio as aioredis
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_OPEN = Gauge('redis_circuit_open', 'Whether Redis calls are currently short-circuited')
+REDIS_FAILURES = Counter('redis_failures_total', 'Redis calls that failed or timed out')
+REDIS_SHORT_CIRCUITED = Counter('redis_short_circuited_total', 'Redis calls skipped while the circuit was open')
+
+
+class RedisUnavailable(Exception):
+    """Raised when Redis failed or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Open after `threshold` consecutive failures; let one probe through after `reset_timeout`."""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        CIRCUIT_OPEN.set(0)
+
+    def record_neutral(self):
+        # The call failed for reasons unrelated to Redis; let the next call probe
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            if self.opened_at is None or self.probing:
+                logger.warning(f"Redis circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self.probing = False
+            CIRCUIT_OPEN.set(1)
+
+
+class RedisClient:
+    """Async Redis client with a shared connection pool for the worker process.
+
+    Socket timeouts are kept short so a slow Redis adds bounded latency, and
+    once the breaker opens callers skip Redis entirely until a probe succeeds.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.subscriber = None
+        self.max_connections = int(os.getenv('REDIS_POOL_MAX_CONNECTIONS', 20))
+        self.socket_timeout = float(os.getenv('REDIS_SOCKET_TIMEOUT', 0.25))
+        self.breaker = CircuitBreaker(
+            int(os.getenv('REDIS_CIRCUIT_FAILURE_THRESHOLD', 5)),
+            float(os.getenv('REDIS_CIRCUIT_RESET_TIMEOUT', 30))
+        )
+
+    def _redis(self, **options):
+        return aioredis.Redis(
+            host=os.getenv('REDIS_HOST', 'redis-service'),
+            port=int(os.getenv('REDIS_PORT', 6379)),
+            decode_responses=True,
+            socket_connect_timeout=self.socket_timeout,
+            **options
+        )
+
+    async def connect(self):
+        if self.client is None:
+            # Connections are opened lazily by the pool
+            self.client = self._redis(max_connections=self.max_connections, socket_timeout=self.socket_timeout)
+        return self.client
+
+    def pubsub(self):
+        """PubSub on a separate client; subscribers block on reads, so no socket timeout."""
+        if self.subscriber is None:
+            self.subscriber = self._redis(socket_timeout=None)
+        return self.subscriber.pubsub()
+
+    async def close(self):
+        for client in (self.client, self.subscriber):
+            if client:
+                await client.close()
+        self.client = None
+        self.subscriber = None
+
+    @asynccontextmanager
+    async def acquire(self):
+        client = self.client or await self.connect()
+        if not self.breaker.allow():
+            REDIS_SHORT_CIRCUITED.inc()
+            raise RedisUnavailable("Redis circuit open")
+
+        try:
+            yield client
+        except (aioredis.RedisError, OSError) as e:
+            logger.error(f"Redis call failed: {e}")
+            REDIS_FAILURES.inc()
+            self.breaker.record_failure()
+            raise RedisUnavailable("Redis not available") from e
+        except BaseException:
+            self.breaker.record_neutral()
+            raise
+        self.breaker.record_success()
+
+
+redis_client = RedisClient()
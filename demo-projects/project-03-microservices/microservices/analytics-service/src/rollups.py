@@ -0,0 +1,121 @@
+"""Read path over the minute/hour/day rollup tables.
+
+The rollups are kept current by triggers on analytics_data (see schema.py).
+A query can be answered from them when its date filters fall on bucket
+boundaries. end_date is inclusive, so events stamped exactly at end_date are
+read from the raw table with a point lookup on the timestamp index.
+"""
+from datetime import datetime, timedelta
+
+from .aggregation import build_aggregate_sql, fan_out
+
+GRANULARITIES = (
+    ('day', timedelta(days=1)),
+    ('hour', timedelta(hours=1)),
+    ('minute', timedelta(minutes=1)),
+)
+
+
+def _is_aligned(value, step):
+    if value is None:
+        return True
+    offset = value - datetime.combine(value.date(), datetime.min.time())
+    return offset % step == timedelta(0)
+
+
+def pick_granularity(query):
+    """Return the coarsest rollup the query's date range lines up with, or None."""
+    for granularity, step in GRANULARITIES:
+        if _is_aligned(query.start_date, step) and _is_aligned(query.end_date, step):
+            return granularity
+    return None
+
+
+def build_rollup_source(query, granularity):
+    """Return a subquery yielding (timestamp, event_type, user_id, count) rows."""
+    params = []
+    rollup_conditions = ["count > 0"]
+    raw_conditions = []
+
+    if query.start_date:
+        params.append(query.start_date)
+        rollup_conditions.append(f"bucket >= ${len(params)}")
+
+    if query.end_date:
+        params.append(query.end_date)
+        rollup_conditions.append(f"bucket < ${len(params)}")
+        raw_conditions.append(f"timestamp = ${len(params)}")
+
+    if query.event_type:
+        params.append(query.event_type)
+        rollup_conditions.append(f"event_type = ${len(params)}")
+        raw_conditions.append(f"event_type = ${len(params)}")
+
+    if query.user_id:
+        params.append(query.user_id)
+        rollup_conditions.append(f"user_id = ${len(params)}")
+        raw_conditions.append(f"user_id = ${len(params)}")
+
+    source = f"""
+        SELECT bucket AS timestamp, event_type, user_id, count
+        FROM analytics_rollup_{granularity}
+        WHERE {" AND ".join(rollup_conditions)}
+    """
+    if query.end_date:
+        source += f"""
+        UNION ALL
+        SELECT timestamp, event_type, user_id, 1
+        FROM analytics_data
+        WHERE {" AND ".join(raw_conditions)}
+        """
+    return f"({source}) AS source", params
+
+
+async def aggregate_from_rollups(conn, query, granularity):
+    source, params = build_rollup_source(query, granularity)
+    rows = await conn.fetch(build_aggregate_sql("1=1", source=source, weight="count"), *params)
+    return fan_out(rows)
+
+
+async def event_bounds(conn):
+    # MIN/MAX are answered from the timestamp index
+    return await conn.fetchrow("""
+        SELECT MIN(timestamp) AS first_event, MAX(timestamp) AS last_event
+        FROM analytics_data
+    """)
+
+
+async def recent_events_from_rollups(conn):
+    # Whole minutes come from the rollup, the partial first minute from raw rows
+    recent_events = await conn.fetchval("""
+        WITH window_start AS (
+            SELECT cutoff, date_trunc('minute', cutoff) + INTERVAL '1 minute' AS boundary
+            FROM (SELECT (NOW() - INTERVAL '24 hours')::timestamp AS cutoff) AS now_window
+        )
+        SELECT
+            (SELECT COALESCE(SUM(count), 0) FROM analytics_rollup_minute, window_start
+             WHERE bucket >= boundary)
+          + (SELECT COUNT(*) FROM analytics_data, window_start
+             WHERE timestamp >= cutoff AND timestamp < boundary)
+    """)
+    return int(recent_events)
+
+
+async def summary_from_rollups(conn):
+    totals = await conn.fetchrow("""
+        SELECT
+            COALESCE(SUM(count), 0)::bigint AS total_events,
+            COUNT(DISTINCT user_id) AS unique_users,
+            COUNT(DISTINCT event_type) AS unique_event_types
+        FROM analytics_rollup_day
+        WHERE count > 0
+    """)
+    bounds = await event_bounds(conn)
+    summary = (
+        totals['total_events'],
+        totals['unique_users'],
+        totals['unique_event_types'],
+        bounds['first_event'],
+        bounds['last_event']
+    )
+    return summary, await recent_events_from_rollups(conn)
@@ -0,0 +1,328 @@
+"""Versioned schema migrations for the analytics database.
+
+Migrations run once at startup under an advisory lock so that concurrent
+uvicorn workers do not race. Each one is applied in its own transaction and
+recorded in schema_migrations.
+"""
+import logging
+from datetime import datetime
+
+from .partitions import DEFAULT_PARTITION, PARTITION_INTERVAL, PARTITIONS_AHEAD, create_partition, ensure_partitions
+from .sketches import backfill_sketches
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK_ID = 7_301_001
+
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analytics_data (
+        id SERIAL PRIMARY KEY,
+        event_type VARCHAR(100) NOT NULL,
+        user_id INTEGER NOT NULL,
+        data JSONB NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_analytics_event_type ON analytics_data(event_type);
+    CREATE INDEX IF NOT EXISTS idx_analytics_user_id ON analytics_data(user_id);
+    CREATE INDEX IF NOT EXISTS idx_analytics_timestamp ON analytics_data(timestamp);
+    CREATE INDEX IF NOT EXISTS idx_analytics_data_gin ON analytics_data USING GIN(data);
+    CREATE STATISTICS IF NOT EXISTS stats_analytics_date ON (DATE(timestamp)) FROM analytics_data;
+"""
+
+ROLLUP_GRANULARITIES = ('minute', 'hour', 'day')
+
+
+def _rollup_tables():
+    return "\n".join(f"""
+        CREATE TABLE IF NOT EXISTS analytics_rollup_{granularity} (
+            bucket TIMESTAMP NOT NULL,
+            event_type VARCHAR(100) NOT NULL,
+            user_id INTEGER NOT NULL,
+            count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, event_type, user_id)
+        );
+    """ for granularity in ROLLUP_GRANULARITIES)
+
+
+def _rollup_upsert(granularity, source):
+    # Rows are applied in key order so concurrent statements lock in the same order
+    return f"""
+        INSERT INTO analytics_rollup_{granularity} (bucket, event_type, user_id, count)
+        SELECT date_trunc('{granularity}', timestamp), event_type, user_id, COUNT(*)
+        FROM {source}
+        WHERE timestamp IS NOT NULL
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (bucket, event_type, user_id)
+        DO UPDATE SET count = analytics_rollup_{granularity}.count + EXCLUDED.count;
+    """
+
+
+def _rollup_decrement(granularity):
+    return f"""
+        UPDATE analytics_rollup_{granularity} AS rollup
+        SET count = rollup.count - removed.count
+        FROM (
+            SELECT date_trunc('{granularity}', timestamp) AS bucket, event_type, user_id, COUNT(*) AS count
+            FROM old_rows
+            WHERE timestamp IS NOT NULL
+            GROUP BY 1, 2, 3
+            ORDER BY 1, 2, 3
+        ) AS removed
+        WHERE rollup.bucket = removed.bucket
+          AND rollup.event_type = removed.event_type
+          AND rollup.user_id = removed.user_id;
+    """
+
+
+ROLLUP_TRIGGERS = """
+    CREATE TRIGGER analytics_rollup_insert AFTER INSERT ON analytics_data
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION analytics_rollup_insert();
+    CREATE TRIGGER analytics_rollup_delete AFTER DELETE ON analytics_data
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION analytics_rollup_delete();
+    CREATE TRIGGER analytics_rollup_truncate AFTER TRUNCATE ON analytics_data
+        FOR EACH STATEMENT EXECUTE FUNCTION analytics_rollup_truncate();
+"""
+
+ROLLUP_SCHEMA = _rollup_tables() + f"""
+    CREATE OR REPLACE FUNCTION analytics_rollup_insert() RETURNS trigger AS $$
+    BEGIN
+        {''.join(_rollup_upsert(granularity, 'new_rows') for granularity in ROLLUP_GRANULARITIES)}
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION analytics_rollup_delete() RETURNS trigger AS $$
+    BEGIN
+        {''.join(_rollup_decrement(granularity) for granularity in ROLLUP_GRANULARITIES)}
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION analytics_rollup_truncate() RETURNS trigger AS $$
+    BEGIN
+        TRUNCATE {', '.join(f'analytics_rollup_{granularity}' for granularity in ROLLUP_GRANULARITIES)};
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- Block writers while the triggers are installed and history is backfilled
+    LOCK TABLE analytics_data IN SHARE ROW EXCLUSIVE MODE;
+""" + ROLLUP_TRIGGERS + ''.join(_rollup_upsert(granularity, 'analytics_data') for granularity in ROLLUP_GRANULARITIES)
+
+SKETCH_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analytics_sketches (
+        bucket DATE PRIMARY KEY,
+        events BIGINT NOT NULL DEFAULT 0,
+        users_hll BYTEA,
+        event_types_hll BYTEA,
+        top_users JSONB,
+        top_events JSONB
+    );
+"""
+
+EVENTS_KEYSET_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_analytics_event_type_timestamp
+        ON analytics_data (event_type, timestamp DESC, id DESC);
+"""
+
+USER_COUNTERS_SCHEMA = """
+    -- (user_id, event_type, timestamp) serves per-user counts and first/last
+    -- seen as index-only scans; it supersedes the single-column user index
+    CREATE INDEX IF NOT EXISTS idx_analytics_user_type_timestamp
+        ON analytics_data (user_id, event_type, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_analytics_user_recent
+        ON analytics_data (user_id, timestamp DESC, id DESC) INCLUDE (event_type);
+    DROP INDEX IF EXISTS idx_analytics_user_id;
+
+    CREATE TABLE IF NOT EXISTS analytics_user_counters (
+        user_id INTEGER NOT NULL,
+        event_type VARCHAR(100) NOT NULL,
+        count BIGINT NOT NULL,
+        first_seen TIMESTAMP NOT NULL,
+        last_seen TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, event_type)
+    );
+
+    CREATE OR REPLACE FUNCTION analytics_user_counters_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO analytics_user_counters (user_id, event_type, count, first_seen, last_seen)
+        SELECT user_id, event_type, COUNT(*), MIN(timestamp), MAX(timestamp)
+        FROM new_rows
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (user_id, event_type) DO UPDATE SET
+            count = analytics_user_counters.count + EXCLUDED.count,
+            first_seen = LEAST(analytics_user_counters.first_seen, EXCLUDED.first_seen),
+            last_seen = GREATEST(analytics_user_counters.last_seen, EXCLUDED.last_seen);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- Deleted rows may have been a pair's first or last event, so the bounds
+    -- of the touched pairs are re-read from the (user_id, event_type, timestamp) index
+    CREATE OR REPLACE FUNCTION analytics_user_counters_delete() RETURNS trigger AS $$
+    BEGIN
+        UPDATE analytics_user_counters AS counters
+        SET count = counters.count - removed.count
+        FROM (
+            SELECT user_id, event_type, COUNT(*) AS count
+            FROM old_rows
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+        ) AS removed
+        WHERE counters.user_id = removed.user_id
+          AND counters.event_type = removed.event_type;
+
+        DELETE FROM analytics_user_counters
+        WHERE count <= 0
+          AND (user_id, event_type) IN (SELECT user_id, event_type FROM old_rows);
+
+        UPDATE analytics_user_counters AS counters
+        SET first_seen = bounds.first_seen, last_seen = bounds.last_seen
+        FROM (
+            SELECT pairs.user_id, pairs.event_type,
+                   (SELECT MIN(timestamp) FROM analytics_data
+                    WHERE user_id = pairs.user_id AND event_type = pairs.event_type) AS first_seen,
+                   (SELECT MAX(timestamp) FROM analytics_data
+                    WHERE user_id = pairs.user_id AND event_type = pairs.event_type) AS last_seen
+            FROM (SELECT DISTINCT user_id, event_type FROM old_rows) AS pairs
+        ) AS bounds
+        WHERE counters.user_id = bounds.user_id
+          AND counters.event_type = bounds.event_type;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION analytics_user_counters_truncate() RETURNS trigger AS $$
+    BEGIN
+        TRUNCATE analytics_user_counters;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- Block writers while the triggers are installed and history is backfilled
+    LOCK TABLE analytics_data IN SHARE ROW EXCLUSIVE MODE;
+
+    CREATE TRIGGER analytics_user_counters_insert AFTER INSERT ON analytics_data
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION analytics_user_counters_insert();
+    CREATE TRIGGER analytics_user_counters_delete AFTER DELETE ON analytics_data
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION analytics_user_counters_delete();
+    CREATE TRIGGER analytics_user_counters_truncate AFTER TRUNCATE ON analytics_data
+        FOR EACH STATEMENT EXECUTE FUNCTION analytics_user_counters_truncate();
+
+    INSERT INTO analytics_user_counters (user_id, event_type, count, first_seen, last_seen)
+    SELECT user_id, event_type, COUNT(*), MIN(timestamp), MAX(timestamp)
+    FROM analytics_data
+    GROUP BY 1, 2;
+    ANALYZE analytics_user_counters;
+"""
+
+
+async def create_sketches(conn):
+    await conn.execute(SKETCH_SCHEMA)
+    await backfill_sketches(conn)
+
+
+async def partition_analytics_data(conn):
+    """Rebuild analytics_data as a table range-partitioned on timestamp.
+
+    The existing rows are copied into the new partitions. The rollups already
+    count them, so the triggers are only reinstalled after the copy. Partition
+    keys cannot be NULL, so undated rows, which the rollups skipped, are
+    stamped with the migration time and inserted once the triggers are back.
+    """
+    await conn.execute("""
+        LOCK TABLE analytics_data IN ACCESS EXCLUSIVE MODE;
+        ALTER TABLE analytics_data RENAME TO analytics_data_unpartitioned;
+        CREATE TABLE analytics_data (
+            id INTEGER NOT NULL DEFAULT nextval('analytics_data_id_seq'),
+            event_type VARCHAR(100) NOT NULL,
+            user_id INTEGER NOT NULL,
+            data JSONB NOT NULL,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) PARTITION BY RANGE (timestamp);
+        ALTER SEQUENCE analytics_data_id_seq OWNED BY analytics_data.id;
+    """)
+    await conn.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF analytics_data DEFAULT")
+
+    periods = await conn.fetch(f"""
+        SELECT DISTINCT date_trunc('{PARTITION_INTERVAL}', timestamp) AS start
+        FROM analytics_data_unpartitioned
+        WHERE timestamp IS NOT NULL
+    """)
+    for period in sorted(row['start'] for row in periods):
+        await create_partition(conn, period, PARTITION_INTERVAL)
+    await ensure_partitions(conn, PARTITION_INTERVAL, PARTITIONS_AHEAD)
+
+    await conn.execute("""
+        INSERT INTO analytics_data (id, event_type, user_id, data, timestamp)
+        SELECT id, event_type, user_id, data, timestamp
+        FROM analytics_data_unpartitioned
+        WHERE timestamp IS NOT NULL;
+        CREATE TEMPORARY TABLE analytics_data_undated ON COMMIT DROP AS
+        SELECT id, event_type, user_id, data FROM analytics_data_unpartitioned
+        WHERE timestamp IS NULL;
+        DROP TABLE analytics_data_unpartitioned;
+    """)
+
+    # Unique constraints on a partitioned table must include the partition key
+    await conn.execute("ALTER TABLE analytics_data ADD PRIMARY KEY (id, timestamp)")
+    await conn.execute(BASE_SCHEMA + EVENTS_KEYSET_INDEX + ROLLUP_TRIGGERS)
+
+    await conn.execute("""
+        INSERT INTO analytics_data (id, event_type, user_id, data, timestamp)
+        SELECT id, event_type, user_id, data, $1 FROM analytics_data_undated
+    """, datetime.utcnow())
+    await conn.execute("ANALYZE analytics_data")
+
+
+# Each step is either a SQL script or an async callable taking the connection
+MIGRATIONS = [
+    (1, "analytics_data table and indexes", BASE_SCHEMA),
+    (2, "minute/hour/day rollups maintained by triggers", ROLLUP_SCHEMA),
+    (3, "per-day approximate sketches backfilled from rollups", create_sketches),
+    (4, "keyset index for events by type", EVENTS_KEYSET_INDEX),
+    (5, "range-partition analytics_data on timestamp", partition_analytics_data),
+    (6, "per-user counters and covering indexes", USER_COUNTERS_SCHEMA),
+]
+
+
+async def migrate(db):
+    """Apply pending migrations; returns False if the database was unreachable."""
+    try:
+        async with db.acquire() as conn:
+            await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+            try:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                applied = {row['version'] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+
+                for version, description, step in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    async with conn.transaction():
+                        if callable(step):
+                            await step(conn)
+                        else:
+                            await conn.execute(step)
+                        await conn.execute(
+                            "INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+                            version, description
+                        )
+                    logger.info(f"Applied schema migration {version}: {description}")
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+    except Exception as e:
+        logger.error(f"Schema migration failed: {e}")
+        return False
+    return True
@@ -0,0 +1,276 @@
+"""Mergeable approximate sketches for the ?approx=true read paths.
+
+Every ingested event updates per-day sketches held in memory. A background
+task folds those deltas into analytics_sketches (one row per day) under a
+row lock. Reads merge the rows for the requested days.
+
+- Distinct users and event types use HyperLogLog. Registers merge with an
+  element-wise max. The relative standard error is 1.04 / sqrt(2^precision):
+  0.81% for users (precision 14) and 3.25% for event types (precision 10).
+- Top users and top events use Space-Saving with ANALYTICS_TOPK_CAPACITY
+  counters. A reported count never underestimates the true count, and
+  overestimates it by at most `error`, which is bounded by N / capacity.
+
+Sketches only grow: deleted events are still counted.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+from .aggregation import DATES_LIMIT, TOP_LIMIT, USERS_LIMIT
+
+logger = logging.getLogger(__name__)
+
+USERS_PRECISION = 14
+EVENT_TYPES_PRECISION = 10
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    def __init__(self, precision, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            self.registers = np.zeros(self.m, dtype=np.uint8)
+        else:
+            self.registers = np.frombuffer(registers, dtype=np.uint8).copy()
+
+    def add(self, value):
+        x = _hash64(value)
+        index = x >> (64 - self.precision)
+        remainder = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m * self.m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * self.m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return round(self.m * math.log(self.m / zeros))
+        return round(raw)
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def to_bytes(self):
+        return self.registers.tobytes()
+
+
+class SpaceSaving:
+    def __init__(self, capacity, counters=None):
+        self.capacity = capacity
+        # item -> [count, error]; count - error <= true count <= count
+        self.counters = {item: [count, error] for item, count, error in counters or []}
+
+    def add(self, item, weight=1):
+        counter = self.counters.get(item)
+        if counter:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0]
+        else:
+            evicted = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(evicted)[0]
+            self.counters[item] = [floor + weight, floor]
+
+    def _floor(self):
+        # Any item missing from a full summary may have occurred up to this often
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def merge(self, other):
+        floor, other_floor = self._floor(), other._floor()
+        merged = {}
+        for item in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(item, (floor, floor))
+            other_count, other_error = other.counters.get(item, (other_floor, other_floor))
+            merged[item] = [count + other_count, error + other_error]
+        top = sorted(merged.items(), key=lambda entry: entry[1][0], reverse=True)[:self.capacity]
+        self.counters = dict(top)
+
+    def top(self, n):
+        return sorted(
+            ((item, count, error) for item, (count, error) in self.counters.items()),
+            key=lambda entry: entry[1],
+            reverse=True
+        )[:n]
+
+    def to_json(self):
+        return [[item, count, error] for item, (count, error) in self.counters.items()]
+
+
+class DaySketch:
+    def __init__(self, capacity, row=None):
+        self.events = row['events'] if row else 0
+        self.users = HyperLogLog(USERS_PRECISION, row['users_hll'] if row else None)
+        self.event_types = HyperLogLog(EVENT_TYPES_PRECISION, row['event_types_hll'] if row else None)
+        self.top_users = SpaceSaving(capacity, row['top_users'] if row else None)
+        self.top_events = SpaceSaving(capacity, row['top_events'] if row else None)
+
+    def observe(self, user_counts, event_counts):
+        for user_id, count in user_counts.items():
+            self.users.add(user_id)
+            self.top_users.add(user_id, count)
+        for event_type, count in event_counts.items():
+            self.event_types.add(event_type)
+            self.top_events.add(event_type, count)
+        self.events += sum(event_counts.values())
+
+    def merge(self, other):
+        self.events += other.events
+        self.users.merge(other.users)
+        self.event_types.merge(other.event_types)
+        self.top_users.merge(other.top_users)
+        self.top_events.merge(other.top_events)
+
+
+class SketchStore:
+    def __init__(self, db):
+        self.db = db
+        self.capacity = int(os.getenv('ANALYTICS_TOPK_CAPACITY', 100))
+        self.flush_interval = float(os.getenv('ANALYTICS_SKETCH_FLUSH_INTERVAL', 5))
+        self.pending = {}
+        self._task = None
+
+    def observe(self, events):
+        """Fold committed AnalyticsData events into the in-memory per-day deltas."""
+        by_day = defaultdict(lambda: (Counter(), Counter()))
+        for event in events:
+            user_counts, event_counts = by_day[(event.timestamp or datetime.utcnow()).date()]
+            user_counts[event.user_id] += 1
+            event_counts[event.event_type] += 1
+
+        for day, (user_counts, event_counts) in by_day.items():
+            if day not in self.pending:
+                self.pending[day] = DaySketch(self.capacity)
+            self.pending[day].observe(user_counts, event_counts)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        for day, delta in pending.items():
+            try:
+                async with self.db.acquire() as conn:
+                    await merge_day(conn, day, delta, self.capacity)
+            except Exception as e:
+                logger.error(f"Failed to flush sketches for {day}: {e}")
+                if day in self.pending:
+                    delta.merge(self.pending[day])
+                self.pending[day] = delta
+
+    async def load(self, conn, start_date=None, end_date=None):
+        """Merge the stored sketches for the whole days covering [start_date, end_date].
+
+        An end_date at midnight stops at the previous day rather than pulling
+        in a full day for a single instant.
+        """
+        end_day = end_date.date() if end_date else None
+        if end_date and end_date.time() == time.min:
+            end_day -= timedelta(days=1)
+        rows = await conn.fetch("""
+            SELECT bucket, events, users_hll, event_types_hll, top_users, top_events
+            FROM analytics_sketches
+            WHERE ($1::date IS NULL OR bucket >= $1)
+              AND ($2::date IS NULL OR bucket <= $2)
+            ORDER BY bucket
+        """, start_date.date() if start_date else None, end_day)
+
+        merged = DaySketch(self.capacity)
+        events_by_day = {}
+        for row in rows:
+            merged.merge(DaySketch(self.capacity, row))
+            events_by_day[row['bucket']] = row['events']
+        return merged, events_by_day
+
+
+async def merge_day(conn, day, delta, capacity):
+    async with conn.transaction():
+        await conn.execute(
+            "INSERT INTO analytics_sketches (bucket) VALUES ($1) ON CONFLICT (bucket) DO NOTHING", day
+        )
+        row = await conn.fetchrow("""
+            SELECT events, users_hll, event_types_hll, top_users, top_events
+            FROM analytics_sketches WHERE bucket = $1 FOR UPDATE
+        """, day)
+        stored = DaySketch(capacity, row)
+        stored.merge(delta)
+        await conn.execute("""
+            UPDATE analytics_sketches
+            SET events = $2, users_hll = $3, event_types_hll = $4, top_users = $5, top_events = $6
+            WHERE bucket = $1
+        """, day, stored.events, stored.users.to_bytes(), stored.event_types.to_bytes(),
+            stored.top_users.to_json(), stored.top_events.to_json())
+
+
+async def backfill_sketches(conn):
+    """Seed analytics_sketches from the day rollup; used by the schema migration."""
+    capacity = int(os.getenv('ANALYTICS_TOPK_CAPACITY', 100))
+    days = await conn.fetch("SELECT DISTINCT bucket FROM analytics_rollup_day WHERE count > 0 ORDER BY bucket")
+    for day in days:
+        rows = await conn.fetch("""
+            SELECT event_type, user_id, count FROM analytics_rollup_day
+            WHERE bucket = $1 AND count > 0
+        """, day['bucket'])
+        user_counts, event_counts = Counter(), Counter()
+        for row in rows:
+            user_counts[row['user_id']] += row['count']
+            event_counts[row['event_type']] += row['count']
+        sketch = DaySketch(capacity)
+        sketch.observe(user_counts, event_counts)
+        await merge_day(conn, day['bucket'].date(), sketch, capacity)
+
+
+def error_bounds(sketch):
+    return {
+        "unique_users_relative_std_error": round(sketch.users.relative_error, 4),
+        "unique_event_types_relative_std_error": round(sketch.event_types.relative_error, 4),
+        "top_k_max_count_error": math.ceil(sketch.events / sketch.top_users.capacity)
+    }
+
+
+def approximate_aggregates(sketch, events_by_day):
+    """Build the AnalyticsResponse fields from merged sketches."""
+    return {
+        "total_events": sketch.events,
+        "events_by_type": {event_type: count for event_type, count, _ in sketch.top_events.top(sketch.top_events.capacity)},
+        "events_by_user": {str(user_id): count for user_id, count, _ in sketch.top_users.top(USERS_LIMIT)},
+        "events_by_date": {str(day): count for day, count in sorted(events_by_day.items(), reverse=True)[:DATES_LIMIT]},
+        "top_users": [{"user_id": user_id, "count": count} for user_id, count, _ in sketch.top_users.top(TOP_LIMIT)],
+        "top_events": [{"event_type": event_type, "count": count} for event_type, count, _ in sketch.top_events.top(TOP_LIMIT)],
+        "approximate": True,
+        "error_bounds": error_bounds(sketch)
+    }
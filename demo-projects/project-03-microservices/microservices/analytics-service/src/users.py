@@ -0,0 +1,66 @@
+"""Read path for GET /api/analytics/users/{user_id}.
+
+analytics_user_counters holds one row per (user_id, event_type) with the
+event count and first/last timestamps, kept current by triggers on
+analytics_data (see schema.py). A user's profile is a primary-key range read
+of those rows plus their most recent events, which come from an index-only
+scan of idx_analytics_user_recent. Before the counters exist the same figures
+are grouped from analytics_data on idx_analytics_user_type_timestamp.
+"""
+RECENT_MAX_EVENTS = 100
+
+
+async def user_counters(conn, user_id):
+    return await conn.fetch("""
+        SELECT event_type, count, first_seen, last_seen
+        FROM analytics_user_counters
+        WHERE user_id = $1
+    """, user_id)
+
+
+async def raw_user_counters(conn, user_id):
+    return await conn.fetch("""
+        SELECT event_type, COUNT(*) AS count, MIN(timestamp) AS first_seen, MAX(timestamp) AS last_seen
+        FROM analytics_data
+        WHERE user_id = $1
+        GROUP BY event_type
+    """, user_id)
+
+
+async def recent_user_events(conn, user_id, limit):
+    if not limit:
+        return []
+    return await conn.fetch("""
+        SELECT id, event_type, timestamp
+        FROM analytics_data
+        WHERE user_id = $1
+        ORDER BY timestamp DESC, id DESC
+        LIMIT $2
+    """, user_id, limit)
+
+
+def user_profile(user_id, counters, recent):
+    """Shape counter rows and recent events into the response body."""
+    counters = sorted(counters, key=lambda row: row['count'], reverse=True)
+    first_seen = min((row['first_seen'] for row in counters if row['first_seen']), default=None)
+    last_seen = max((row['last_seen'] for row in counters if row['last_seen']), default=None)
+
+    return {
+        "user_id": user_id,
+        "total_events": sum(row['count'] for row in counters),
+        "events_by_type": {row['event_type']: row['count'] for row in counters},
+        "last_seen_by_type": {
+            row['event_type']: row['last_seen'].isoformat() if row['last_seen'] else None
+            for row in counters
+        },
+        "first_seen": first_seen.isoformat() if first_seen else None,
+        "last_seen": last_seen.isoformat() if last_seen else None,
+        "recent_events": [
+            {
+                "id": row['id'],
+                "event_type": row['event_type'],
+                "timestamp": row['timestamp'].isoformat() if row['timestamp'] else None
+            }
+            for row in recent
+        ]
+    }
@@ -0,0 +1,32 @@
+import base64
+from datetime import datetime
+
+import pytest
+
+from src.events import CursorError, decode_cursor, encode_cursor
+
+
+def raw_cursor(raw):
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    assert decode_cursor(encode_cursor(timestamp, 42)) == (timestamp, 42)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    raw_cursor('2024-05-01T12:30:15'),
+    raw_cursor('yesterday|42'),
+    raw_cursor('2024-05-01T12:30:15|forty-two'),
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(CursorError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize('timestamp', ['2024-05-01T12:30:15+00:00', '2024-05-01T14:30:15+02:00'])
+def test_offset_aware_cursor_is_rejected(timestamp):
+    with pytest.raises(CursorError):
+        decode_cursor(raw_cursor(f"{timestamp}|42"))
@@ -0,0 +1,6 @@
+"""Benchmarks; the endpoint load-test harness is shared with the other services."""
+import os
+import sys
+
+# demo-projects/shared, which holds loadtest.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), *[os.pardir] * 4, 'shared'))
@@ -0,0 +1,81 @@
+"""Compare cache serializers on synthetic product catalogs.
+
+Times encoding and decoding of a whole catalog as one cached value, the
+largest thing the product cache could hold, for each codec and compression
+setting, and reports payload sizes. The str()/eval() pair the cache used before is included as the
+reference. Run from the product-service directory:
+
+    python -m benchmarks.bench_codec --products 10000 100000 1000000
+
+Nothing external is needed beyond the codec packages in requirements.txt.
+"""
+import argparse
+import ast
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.bench_endpoints import make_product
+from src.cache_codec import CODECS, COMPRESSORS, CacheSerializer
+
+
+class ReprSerializer:
+    """The original format: str() to write, eval() to read."""
+
+    def dumps(self, value):
+        return str(value).encode()
+
+    def loads(self, payload):
+        # literal_eval is the safe equivalent, and no faster than eval
+        return ast.literal_eval(payload.decode())
+
+
+def make_catalog(count):
+    rng = random.Random(0)
+    start = datetime(2024, 1, 1)
+    catalog = []
+    for i in range(1, count + 1):
+        product = make_product(rng, f"SKU-{i:07d}")
+        created = (start + timedelta(minutes=i)).isoformat()
+        product.update(id=str(i), created_at=created, updated_at=created)
+        catalog.append(product)
+    return catalog
+
+
+def timed(run, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = run()
+        samples.append(time.perf_counter() - start)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--repr-max', type=int, default=100_000, help="skip str()/eval() above this many products")
+    args = parser.parse_args()
+
+    serializers = [(f"{codec}", CacheSerializer(codec)) for codec in CODECS]
+    serializers += [
+        (f"{codec}+{compression}", CacheSerializer(codec, compression, compress_min=0))
+        for codec in ('orjson', 'msgpack') for compression in COMPRESSORS
+    ]
+
+    print(f"{'products':>10} {'serializer':<16} {'encode p50':>11} {'decode p50':>11} {'size':>10}")
+    for count in args.products:
+        catalog = make_catalog(count)
+        rows = serializers if count > args.repr_max else [("str/literal_eval", ReprSerializer())] + serializers
+        for label, serializer in rows:
+            payload, encode = timed(lambda: serializer.dumps(catalog), args.iterations)
+            decoded, decode = timed(lambda: serializer.loads(payload), args.iterations)
+            if decoded != catalog:
+                raise SystemExit(f"{label} did not round-trip {count} products")
+            print(f"{count:>10,} {label:<16} {encode * 1000:>9.1f}ms {decode * 1000:>9.1f}ms {len(payload) / 2**20:>8.2f}MiB")
+
+
+if __name__ == '__main__':
+    main()
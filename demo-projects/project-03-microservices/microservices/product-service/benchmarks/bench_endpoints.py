@@ -0,0 +1,127 @@
+"""Load-test the product-service endpoints and compare against a baseline.
+
+Runs against a service on the local machine backed by local MongoDB and
+Redis, so results do not depend on shared infrastructure. Three steps, run
+from the product-service directory:
+
+    # 1. Reset the scratch collection and load synthetic products
+    python -m benchmarks.bench_endpoints seed --products 10000
+    # 2. Start the service against it
+    MONGODB_DB=products_bench gunicorn --bind 0.0.0.0:5001 --workers 4 src.app:app
+    # 3. Drive each scenario at each concurrency level
+    python -m benchmarks.bench_endpoints run --concurrency 1 16 64 --save-baseline baseline.json
+
+Later runs pass --baseline baseline.json. The run exits non-zero when a
+scenario's p95 latency or throughput is worse than the baseline by more than
+--tolerance. Write scenarios add products, so reseed between runs that are
+compared. Baselines are only comparable on the machine that recorded them.
+Requires httpx.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+import loadtest
+import pymongo
+import redis
+
+CATEGORIES = ['electronics', 'books', 'clothing', 'home', 'garden', 'toys', 'sports', 'beauty']
+
+
+def make_product(rng, sku):
+    return {
+        'name': f"Product {sku}",
+        'description': f"Synthetic product {sku} for load testing",
+        'price': round(rng.uniform(1, 500), 2),
+        'category': rng.choice(CATEGORIES),
+        'stock': rng.randrange(1000),
+        'sku': sku
+    }
+
+
+def scenarios(args):
+    """Return (name, make_request) pairs; make_request(rng) gives httpx.request() kwargs."""
+    # SKUs must be unique, including across runs against the same data
+    run_id = int(time.time())
+    created = iter(range(sys.maxsize))
+
+    def product_id(rng):
+        return str(rng.randrange(1, args.products + 1))
+
+    return [
+        ("products", lambda rng: {"method": "GET", "url": "/api/products"}),
+        ("products_filtered", lambda rng: {"method": "GET", "url": "/api/products", "params": {
+            "category": rng.choice(CATEGORIES), "max_price": rng.choice([50, 100, 250]),
+            "in_stock": "true", "fields": "id,name,price"
+        }}),
+        ("product", lambda rng: {"method": "GET", "url": f"/api/products/{product_id(rng)}"}),
+        # Writes invalidate the read caches, so they run last
+        ("create_product", lambda rng: {
+            "method": "POST", "url": "/api/products", "json": make_product(rng, f"LOAD-{run_id}-{next(created)}")
+        }),
+        ("update_product", lambda rng: {
+            "method": "PUT", "url": f"/api/products/{product_id(rng)}", "json": make_product(rng, f"LOAD-{run_id}-{next(created)}")
+        }),
+    ]
+
+
+def flush_cache():
+    cache = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)))
+    for key in cache.scan_iter(match='product*'):
+        cache.delete(key)
+    cache.close()
+
+
+def reset(args):
+    database = os.getenv('BENCH_MONGODB_DB', 'products_bench')
+    client = pymongo.MongoClient(
+        host=os.getenv('MONGODB_HOST', 'localhost'),
+        port=int(os.getenv('MONGODB_PORT', 27017)),
+        username=os.getenv('MONGODB_USER', 'root'),
+        password=os.getenv('MONGODB_PASSWORD', 'password')
+    )
+    collection = client[database].products
+    collection.drop()
+    # The service reseeds its ID counter from the new products on startup
+    client[database].counters.delete_one({'_id': 'products'})
+
+    rng = random.Random(0)
+    now = datetime.utcnow().isoformat()
+    batch = []
+    for i in range(1, args.products + 1):
+        product = make_product(rng, f"SEED-{i:07d}")
+        product.update(id=str(i), created_at=now, updated_at=now)
+        batch.append(product)
+        if len(batch) == 1000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    client.close()
+
+    flush_cache()
+    print(f"Seeded {args.products:,} products; start the service with MONGODB_DB={database}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=10_000)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('seed', help="reset BENCH_MONGODB_DB and load synthetic products")
+
+    loadtest.add_run_parser(commands, url='http://localhost:5001')
+    args = parser.parse_args()
+
+    if args.command == 'seed':
+        reset(args)
+    else:
+        asyncio.run(loadtest.run(args, scenarios(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Compare the WSGI and ASGI serving modes under concurrent clients.
+
+Starts the service once per mode with the same gunicorn.conf.py settings
+and worker count, drives the read scenarios from bench_endpoints at each
+concurrency level, and prints throughput and p95 latency side by side. The
+product cache is flushed before each mode so both start cold. Run from the
+product-service directory after seeding, as for bench_endpoints:
+
+    python -m benchmarks.bench_endpoints seed --products 10000
+    python -m benchmarks.bench_modes --workers 4 --concurrency 1 16 64 256
+
+The service gets the current environment (MONGODB_HOST, REDIS_HOST, ...)
+with MONGODB_DB set to BENCH_MONGODB_DB. Requires httpx.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+from loadtest import run_scenario
+
+from benchmarks.bench_endpoints import flush_cache, scenarios
+
+MODES = ('wsgi', 'asgi')
+READ_SCENARIOS = ('products', 'products_filtered', 'product')
+
+
+def start_service(mode, args):
+    env = {
+        **os.environ,
+        'PRODUCT_SERVICE_MODE': mode,
+        'MONGODB_DB': os.getenv('BENCH_MONGODB_DB', 'products_bench'),
+        'WEB_CONCURRENCY': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+        'BIND': f"127.0.0.1:{args.port}",
+    }
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{mode} service exited with status {process.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f"{mode} service did not become healthy within 30s")
+
+
+async def measure(url, selected, args):
+    results = {}
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        for name, make_request in selected:
+            for concurrency in args.concurrency:
+                # Same request sequence in both modes
+                rng = random.Random(f"{args.seed}:{name}:{concurrency}")
+                await run_scenario(client, make_request, args.warmup, concurrency, rng)
+                results[name, concurrency] = await run_scenario(client, make_request, args.requests, concurrency, rng)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=10_000, help="products in the seeded collection")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1, help="threads per WSGI worker")
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64, 256])
+    parser.add_argument('--requests', type=int, default=2_000, help="measured requests per scenario and level")
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--scenarios', nargs='+', default=list(READ_SCENARIOS))
+    parser.add_argument('--seed', default='0', help="seed for the generated request parameters")
+    args = parser.parse_args()
+
+    selected = [(name, make) for name, make in scenarios(args) if name in args.scenarios]
+    results = {}
+    for mode in MODES:
+        flush_cache()
+        process, url = start_service(mode, args)
+        try:
+            results[mode] = asyncio.run(measure(url, selected, args))
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f"{'scenario':<20} {'conc':>5} {'wsgi req/s':>11} {'asgi req/s':>11} {'wsgi p95':>10} {'asgi p95':>10} {'speedup':>8}")
+    for name, _ in selected:
+        for concurrency in args.concurrency:
+            wsgi, asgi = results['wsgi'][name, concurrency], results['asgi'][name, concurrency]
+            errors = f"  ({wsgi['errors']}/{asgi['errors']} errors)" if wsgi['errors'] or asgi['errors'] else ""
+            print(
+                f"{name:<20} {concurrency:>5} {wsgi['throughput']:>11,.0f} {asgi['throughput']:>11,.0f} "
+                f"{wsgi['p95_ms']:>8.1f}ms {asgi['p95_ms']:>8.1f}ms {asgi['throughput'] / wsgi['throughput']:>7.2f}x{errors}"
+            )
+
+
+if __name__ == '__main__':
+    main()
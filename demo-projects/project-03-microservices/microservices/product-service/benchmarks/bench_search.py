@@ -0,0 +1,102 @@
+"""Measure the in-memory search index on synthetic catalogs.
+
+Builds a SearchIndex in-process for each catalog size and reports load time,
+resident memory added, and latency percentiles for full-text queries (with
+and without filters) and autocomplete. Names and descriptions are drawn from
+a Zipf-distributed vocabulary, so some words match most of the catalog and
+others a handful of products, as in real catalogs. Run from the
+product-service directory:
+
+    python -m benchmarks.bench_search --products 100000 1000000
+
+Memory is read from /proc, so the figures are Linux-only. The index is per
+worker: multiply by WEB_CONCURRENCY for the pod.
+"""
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from benchmarks.bench_endpoints import CATEGORIES
+from src.search import SearchIndex
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'shi', 'ber', 'dan', 'el', 'fo', 'gra', 'hu', 'ix', 'jun']
+
+
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda word: rng.random())
+
+
+def make_products(count, vocabulary, seed):
+    rng = random.Random(seed)
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    for i in range(1, count + 1):
+        yield {
+            'id': str(i),
+            'name': ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=3)).title(),
+            'description': ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=12)),
+            'sku': f"SKU-{i:07d}",
+            'category': rng.choice(CATEGORIES),
+            'price': round(rng.lognormvariate(4, 1), 2),
+        }
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * 4096
+
+
+def queries(vocabulary, count, rng):
+    """(name, run(index)) pairs; words are picked by frequency rank."""
+    common, mid, rare = vocabulary[:10], vocabulary[100:1000], vocabulary[-5000:]
+    return [
+        ("common word", lambda index: index.search(q=rng.choice(common))),
+        ("two words", lambda index: index.search(q=f"{rng.choice(common)} {rng.choice(mid)}")),
+        ("rare word", lambda index: index.search(q=rng.choice(rare))),
+        ("filtered", lambda index: index.search(
+            q=rng.choice(mid), category=rng.choice(CATEGORIES), max_price=rng.choice([25, 50, 100])
+        )),
+        ("autocomplete 2", lambda index: index.autocomplete(q=rng.choice(SYLLABLES) + rng.choice('aeiou'))),
+        ("autocomplete 4", lambda index: index.autocomplete(q=rng.choice(mid)[:4])),
+        ("autocomplete 2+", lambda index: index.autocomplete(q=f"{rng.choice(common)} {rng.choice(SYLLABLES)}")),
+        ("sku prefix", lambda index: index.autocomplete(q=f"SKU-{rng.randrange(1, count + 1):07d}"[:9])),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--vocabulary', type=int, default=50_000, help="distinct words in names and descriptions")
+    parser.add_argument('--requests', type=int, default=200, help="measured queries per kind")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    vocabulary = make_vocabulary(args.vocabulary, random.Random(args.seed))
+    for count in args.products:
+        before = rss_bytes()
+        start = time.perf_counter()
+        index = SearchIndex()
+        index.load(make_products(count, vocabulary, args.seed))
+        elapsed = time.perf_counter() - start
+        print(f"{count:,} products: loaded in {elapsed:.1f}s, {(rss_bytes() - before) / 2**20:,.0f}MiB resident")
+
+        print(f"  {'query':<16} {'p50':>8} {'p95':>8} {'p99':>8} {'matches':>9}")
+        rng = random.Random(args.seed)
+        for name, run in queries(vocabulary, count, rng):
+            samples, matches = [], []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                result = run(index)
+                samples.append((time.perf_counter() - started) * 1000)
+                matches.append(result[1] if isinstance(result, tuple) else len(result))
+            p = statistics.quantiles(samples, n=100)
+            print(f"  {name:<16} {p[49]:>6.2f}ms {p[94]:>6.2f}ms {p[98]:>6.2f}ms {statistics.mean(matches):>9,.0f}")
+        del index
+
+
+if __name__ == '__main__':
+    main()
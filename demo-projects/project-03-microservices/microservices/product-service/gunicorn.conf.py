@@ -0,0 +1,35 @@
+"""Gunicorn settings; PRODUCT_SERVICE_MODE picks the serving mode at startup.
+
+wsgi (default): the Flask app in src/app.py on threaded workers.
+asgi: the FastAPI app in src/asgi.py on uvicorn workers, one event loop each.
+
+Workers write their metrics under PROMETHEUS_MULTIPROC_DIR, and /metrics
+on any worker sums them (see src/metrics.py).
+"""
+import os
+import shutil
+
+mode = os.getenv('PRODUCT_SERVICE_MODE', 'wsgi')
+if mode not in ('wsgi', 'asgi'):
+    raise ValueError(f"PRODUCT_SERVICE_MODE must be wsgi or asgi, not {mode!r}")
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+timeout = 120
+
+if mode == 'asgi':
+    wsgi_app = 'src.asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'src.app:app'
+    # Each blocking Mongo or Redis call holds one of these
+    threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+# Read by prometheus_client when a worker imports it, so set before the fork
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/product-service-metrics')
+
+
+def on_starting(server):
+    # Files left by a previous run would be summed into this one's counts
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
@@ -1,13 +1,26 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import pymongo
-import redis
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from datetime import datetime
-from marshmallow import Schema, fields, ValidationError
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-import time
+from marshmallow import ValidationError
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from .bulk import apply_writes, bulk_errors, check_bulk_body, load_items
+from .catalog import PRODUCT_TTL, UNIQUE_INDEXES, cache_serializer, is_sku_conflict, product_cache_key
+from .ids import IdAllocator
+from .listing import EXPORT_FORMATS, LISTING_INDEXES, CursorError, fetch_page, stream_products
+from .metrics import MongoCommandTimer, TimedRedis, render, start_request
+from .page_cache import PageCache
+from .schemas import (
+    product_autocomplete_query_schema, product_bulk_schema, product_export_query_schema,
+    product_list_query_schema, product_patch_bulk_schema, product_schema, product_search_query_schema
+)
+from .search import SEARCH_ENABLED, SearchService, SearchUnavailable, in_order
+from .watcher import ProductWatcher
 
 app = Flask(__name__)
 CORS(app)
@@ -23,10 +36,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Prometheus metrics
-REQUEST_COUNT = Counter('http_requests_total', 'Total HTTP requests', ['method', 'endpoint', 'status'])
-REQUEST_DURATION = Histogram('http_request_duration_seconds', 'HTTP request duration', ['method', 'endpoint'])
-
 # MongoDB connection
 try:
     mongo_client = pymongo.MongoClient(
@@ -36,7 +45,8 @@ try:
         password=os.getenv('MONGODB_PASSWORD', 'password'),
         serverSelectionTimeoutMS=5000,
         connectTimeoutMS=5000,
-        socketTimeoutMS=5000
+        socketTimeoutMS=5000,
+        event_listeners=[MongoCommandTimer()]
     )
     db = mongo_client[os.getenv('MONGODB_DB', 'products')]
     products_collection = db.products
@@ -47,12 +57,27 @@ except Exception as e:
     db = None
     products_collection = None
 
+def ensure_indexes():
+    # Separately, so existing duplicates do not also block the listing indexes
+    for indexes in (UNIQUE_INDEXES, LISTING_INDEXES):
+        try:
+            products_collection.create_indexes(indexes)
+        except Exception as e:
+            logger.error(f"Failed to create product indexes: {e}")
+
+if products_collection is not None:
+    ensure_indexes()
+    product_ids = IdAllocator(db.counters)
+    try:
+        product_ids.seed(products_collection)
+    except Exception as e:
+        logger.error(f"Failed to seed product ID counter: {e}")
+
 # Redis connection
 try:
-    redis_client = redis.Redis(
+    redis_client = TimedRedis(
         host=os.getenv('REDIS_HOST', 'redis-service'),
         port=int(os.getenv('REDIS_PORT', 6379)),
-        decode_responses=True,
         socket_connect_timeout=5,
         socket_timeout=5,
         retry_on_timeout=True
@@ -63,33 +88,32 @@ except Exception as e:
     logger.error(f"Failed to connect to Redis: {e}")
     redis_client = None
 
-# Validation schemas
-class ProductSchema(Schema):
-    name = fields.Str(required=True, validate=lambda x: len(x) >= 2 and len(x) <= 100)
-    description = fields.Str(required=True, validate=lambda x: len(x) >= 10 and len(x) <= 1000)
-    price = fields.Float(required=True, validate=lambda x: x > 0)
-    category = fields.Str(required=True, validate=lambda x: len(x) >= 2 and len(x) <= 50)
-    stock = fields.Int(required=True, validate=lambda x: x >= 0)
-    sku = fields.Str(required=True, validate=lambda x: len(x) >= 3 and len(x) <= 50)
+page_cache = PageCache(redis_client) if redis_client else None
+
+# Loads in the background; search answers 503 until it is ready
+search_service = None
+if SEARCH_ENABLED and products_collection is not None:
+    search_service = SearchService(products_collection, redis_client)
+    search_service.start()
+
+# Applies every product write, from here or elsewhere, to listings and search
+if products_collection is not None:
+    product_watcher = ProductWatcher(products_collection, db.watch_state, redis_client, search_service)
+    product_watcher.start()
+
+def cache_product(product):
+    redis_client.setex(product_cache_key(product['id']), PRODUCT_TTL, cache_serializer.dumps(product))
 
-product_schema = ProductSchema()
 
 # Middleware for metrics
 @app.before_request
 def before_request():
-    request.start_time = time.time()
+    request.timer = start_request()
 
 @app.after_request
 def after_request(response):
-    if hasattr(request, 'start_time'):
-        duration = time.time() - request.start_time
-        REQUEST_DURATION.labels(method=request.method, endpoint=request.endpoint).observe(duration)
-    
-    REQUEST_COUNT.labels(
-        method=request.method, 
-        endpoint=request.endpoint or 'unknown',
-        status=response.status_code
-    ).inc()
+    if hasattr(request, 'timer'):
+        request.timer.finish(request.method, request.endpoint, response.status_code)
     
     return response
 
@@ -125,55 +149,138 @@ def health_check():
 
 @app.route('/metrics')
 def metrics():
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+    return render(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
 
 @app.route('/api/products')
 def get_products():
     try:
-        # Check cache first
-        if redis_client:
-            cached = redis_client.get('products:all')
-            if cached:
-                logger.info("Products retrieved from cache")
-                return jsonify(eval(cached))
+        try:
+            query = product_list_query_schema.load(request.args)
+        except ValidationError as e:
+            return jsonify({'error': 'Validation error', 'details': e.messages}), 400
         
-        # Get from database
-        if not products_collection:
+        if products_collection is None:
             return jsonify({'error': 'Database not available'}), 503
-            
-        products = list(products_collection.find({}, {'_id': 0}).sort('created_at', -1))
         
-        # Cache for 5 minutes
-        if redis_client:
-            redis_client.setex('products:all', 300, str(products))
+        def build_page():
+            products, next_cursor = fetch_page(products_collection, query)
+            return {'products': products, 'count': len(products), 'next_cursor': next_cursor}
+        
+        # Check cache first; only one worker rebuilds a missing or stale page
+        try:
+            if page_cache:
+                page, cached = page_cache.get_or_build(query, build_page)
+            else:
+                page, cached = build_page(), False
+        except CursorError as e:
+            return jsonify({'error': str(e)}), 400
         
-        logger.info(f"Retrieved {len(products)} products from database")
-        return jsonify(products)
+        if cached:
+            logger.info("Products page retrieved from cache")
+        else:
+            logger.info(f"Retrieved {page['count']} products from database")
+        return jsonify(page)
     except Exception as e:
         logger.error(f"Error getting products: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/products/export')
+def export_products():
+    try:
+        query = product_export_query_schema.load(request.args)
+    except ValidationError as e:
+        return jsonify({'error': 'Validation error', 'details': e.messages}), 400
+    
+    if products_collection is None:
+        return jsonify({'error': 'Database not available'}), 503
+    
+    export_format = query['format']
+    
+    def body():
+        try:
+            yield from stream_products(products_collection, query, export_format)
+        except Exception as e:
+            # Headers are already sent, so the client sees a truncated body
+            logger.error(f"Error exporting products: {str(e)}")
+            raise
+    
+    logger.info(f"Exporting products as {export_format}")
+    return Response(
+        stream_with_context(body()),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename="products.{export_format}"'}
+    )
+
+@app.route('/api/products/search')
+def search_products():
+    try:
+        try:
+            query = product_search_query_schema.load(request.args)
+        except ValidationError as e:
+            return jsonify({'error': 'Validation error', 'details': e.messages}), 400
+        
+        if search_service is None:
+            return jsonify({'error': 'Search not available'}), 503
+        
+        try:
+            product_ids, total, facets = search_service.search(**query)
+        except SearchUnavailable as e:
+            return jsonify({'error': str(e)}), 503
+        
+        # The index ranks; the page itself comes from the database
+        products = in_order(products_collection.find({'id': {'$in': product_ids}}, {'_id': 0}), product_ids)
+        
+        logger.info(f"Search matched {total} products")
+        return jsonify({'products': products, 'total': total, 'facets': facets})
+    except Exception as e:
+        logger.error(f"Error searching products: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/products/search/autocomplete')
+def autocomplete_products():
+    try:
+        try:
+            query = product_autocomplete_query_schema.load(request.args)
+        except ValidationError as e:
+            return jsonify({'error': 'Validation error', 'details': e.messages}), 400
+        
+        if search_service is None:
+            return jsonify({'error': 'Search not available'}), 503
+        
+        try:
+            product_ids = search_service.autocomplete(**query)
+        except SearchUnavailable as e:
+            return jsonify({'error': str(e)}), 503
+        
+        suggestions = in_order(
+            products_collection.find({'id': {'$in': product_ids}}, {'_id': 0, 'id': 1, 'name': 1, 'sku': 1}),
+            product_ids
+        )
+        return jsonify({'suggestions': suggestions})
+    except Exception as e:
+        logger.error(f"Error autocompleting products: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/products/<product_id>')
 def get_product(product_id):
     try:
         # Check cache first
         if redis_client:
-            cached = redis_client.get(f'product:{product_id}')
+            cached = redis_client.get(product_cache_key(product_id))
             if cached:
                 logger.info(f"Product {product_id} retrieved from cache")
-                return jsonify(eval(cached))
+                return jsonify(cache_serializer.loads(cached))
         
         # Get from database
-        if not products_collection:
+        if products_collection is None:
             return jsonify({'error': 'Database not available'}), 503
             
         product = products_collection.find_one({'id': product_id}, {'_id': 0})
         if not product:
             return jsonify({'error': 'Product not found'}), 404
         
-        # Cache for 10 minutes
         if redis_client:
-            redis_client.setex(f'product:{product_id}', 600, str(product))
+            cache_product(product)
         
         logger.info(f"Product {product_id} retrieved from database")
         return jsonify(product)
@@ -194,21 +301,23 @@ def create_product():
         except ValidationError as e:
             return jsonify({'error': 'Validation error', 'details': e.messages}), 400
         
-        # Check if SKU already exists
-        if products_collection and products_collection.find_one({'sku': validated_data['sku']}):
-            return jsonify({'error': 'SKU already exists'}), 409
-        
-        # Add metadata
-        validated_data['id'] = str(products_collection.count_documents({}) + 1)
-        validated_data['created_at'] = datetime.utcnow().isoformat()
-        validated_data['updated_at'] = datetime.utcnow().isoformat()
-        
-        if products_collection:
-            result = products_collection.insert_one(validated_data)
+        if products_collection is not None:
+            # Add metadata
+            validated_data['id'] = product_ids.allocate()
+            validated_data['created_at'] = datetime.utcnow().isoformat()
+            validated_data['updated_at'] = datetime.utcnow().isoformat()
+            
+            product = dict(validated_data)
+            try:
+                result = products_collection.insert_one(validated_data)
+            except DuplicateKeyError as e:
+                if is_sku_conflict(e.details or {}):
+                    return jsonify({'error': 'SKU already exists'}), 409
+                raise
             
-            # Invalidate cache
+            # Write through; the watcher updates listings and search
             if redis_client:
-                redis_client.delete('products:all')
+                cache_product(product)
             
             logger.info(f"Product created with ID: {validated_data['id']}")
             return jsonify({'id': validated_data['id'], 'message': 'Product created'}), 201
@@ -232,31 +341,32 @@ def update_product(product_id):
         except ValidationError as e:
             return jsonify({'error': 'Validation error', 'details': e.messages}), 400
         
-        if not products_collection:
+        if products_collection is None:
             return jsonify({'error': 'Database not available'}), 503
         
-        # Check if product exists
-        existing_product = products_collection.find_one({'id': product_id})
-        if not existing_product:
-            return jsonify({'error': 'Product not found'}), 404
-        
         # Update product
         validated_data['updated_at'] = datetime.utcnow().isoformat()
-        result = products_collection.update_one(
-            {'id': product_id},
-            {'$set': validated_data}
-        )
+        try:
+            product = products_collection.find_one_and_update(
+                {'id': product_id},
+                {'$set': validated_data},
+                projection={'_id': 0},
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError as e:
+            if is_sku_conflict(e.details or {}):
+                return jsonify({'error': 'SKU already exists'}), 409
+            raise
         
-        if result.modified_count > 0:
-            # Invalidate cache
-            if redis_client:
-                redis_client.delete(f'product:{product_id}')
-                redis_client.delete('products:all')
-            
-            logger.info(f"Product {product_id} updated")
-            return jsonify({'message': 'Product updated successfully'}), 200
-        else:
-            return jsonify({'error': 'Product not updated'}), 500
+        if product is None:
+            return jsonify({'error': 'Product not found'}), 404
+        
+        # Write through; the watcher updates listings and search
+        if redis_client:
+            cache_product(product)
+        
+        logger.info(f"Product {product_id} updated")
+        return jsonify({'message': 'Product updated successfully'}), 200
             
     except Exception as e:
         logger.error(f"Error updating product {product_id}: {str(e)}")
@@ -265,32 +375,98 @@ def update_product(product_id):
 @app.route('/api/products/<product_id>', methods=['DELETE'])
 def delete_product(product_id):
     try:
-        if not products_collection:
+        if products_collection is None:
             return jsonify({'error': 'Database not available'}), 503
         
-        # Check if product exists
-        existing_product = products_collection.find_one({'id': product_id})
-        if not existing_product:
-            return jsonify({'error': 'Product not found'}), 404
-        
         # Delete product
         result = products_collection.delete_one({'id': product_id})
+        if result.deleted_count == 0:
+            return jsonify({'error': 'Product not found'}), 404
         
-        if result.deleted_count > 0:
-            # Invalidate cache
-            if redis_client:
-                redis_client.delete(f'product:{product_id}')
-                redis_client.delete('products:all')
-            
-            logger.info(f"Product {product_id} deleted")
-            return jsonify({'message': 'Product deleted successfully'}), 200
-        else:
-            return jsonify({'error': 'Product not deleted'}), 500
+        # Invalidate cache; the watcher updates listings and search
+        if redis_client:
+            redis_client.delete(product_cache_key(product_id))
+        
+        logger.info(f"Product {product_id} deleted")
+        return jsonify({'message': 'Product deleted successfully'}), 200
             
     except Exception as e:
         logger.error(f"Error deleting product {product_id}: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/products/bulk', methods=['POST'])
+def create_products_bulk():
+    try:
+        data = request.get_json(silent=True)
+        error = check_bulk_body(data)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        if products_collection is None:
+            return jsonify({'error': 'Database not available'}), 503
+        
+        products, invalid = load_items(product_bulk_schema, data)
+        
+        # One counter round trip for the whole batch
+        indexes = list(products)
+        now = datetime.utcnow().isoformat()
+        operations = []
+        for index, product_id in zip(indexes, product_ids.allocate_many(len(indexes))):
+            products[index].update(id=product_id, created_at=now, updated_at=now)
+            operations.append(InsertOne(products[index]))
+        
+        failed = apply_writes(products_collection, operations, indexes)
+        created = [{'index': index, 'id': products[index]['id']} for index in indexes if index not in failed]
+        
+        logger.info(f"Bulk create: {len(created)} created, {len(data) - len(created)} rejected")
+        return jsonify({'created': created, 'errors': bulk_errors(invalid, failed)}), 200
+        
+    except Exception as e:
+        logger.error(f"Error bulk creating products: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/products/bulk', methods=['PATCH'])
+def update_products_bulk():
+    try:
+        data = request.get_json(silent=True)
+        error = check_bulk_body(data)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        if products_collection is None:
+            return jsonify({'error': 'Database not available'}), 503
+        
+        changes, invalid = load_items(product_patch_bulk_schema, data)
+        
+        # One query finds every target; bulk results do not say which updates matched
+        requested = list({change['id'] for change in changes.values()})
+        existing = {product['id'] for product in products_collection.find({'id': {'$in': requested}}, {'_id': 0, 'id': 1})}
+        missing = [index for index, change in changes.items() if change['id'] not in existing]
+        for index in missing:
+            del changes[index]
+        
+        indexes = list(changes)
+        now = datetime.utcnow().isoformat()
+        operations = [
+            UpdateOne(
+                {'id': changes[index]['id']},
+                {'$set': {**{field: value for field, value in changes[index].items() if field != 'id'}, 'updated_at': now}}
+            )
+            for index in indexes
+        ]
+        
+        failed = apply_writes(products_collection, operations, indexes)
+        updated = [{'index': index, 'id': changes[index]['id']} for index in indexes if index not in failed]
+        
+        # Invalidate cache once for the batch; the watcher updates listings and search
+        if updated and redis_client:
+            redis_client.delete(*{product_cache_key(product['id']) for product in updated})
+        
+        logger.info(f"Bulk update: {len(updated)} updated, {len(data) - len(updated)} rejected")
+        return jsonify({'updated': updated, 'errors': bulk_errors(invalid, failed, missing)}), 200
+        
+    except Exception as e:
+        logger.error(f"Error bulk updating products: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Route not found'}), 404
@@ -0,0 +1,536 @@
+"""ASGI serving mode for product-service.
+
+Serves the same routes as the Flask app in app.py, with the same
+validation, cache entries and response bodies, but talks to MongoDB through
+Motor and to Redis through redis.asyncio. A worker waiting on either keeps
+serving other requests, so concurrency is no longer capped by the thread
+count. Select it at startup with PRODUCT_SERVICE_MODE=asgi (see
+gunicorn.conf.py), or run it directly:
+
+    uvicorn src.asgi:app --port 5000
+"""
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import os
+import logging
+from datetime import datetime
+from marshmallow import ValidationError
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from .bulk import apply_writes_async, bulk_errors, check_bulk_body, load_items
+from .catalog import PRODUCT_TTL, UNIQUE_INDEXES, cache_serializer, is_sku_conflict, product_cache_key
+from .ids import AsyncIdAllocator
+from .listing import EXPORT_FORMATS, LISTING_INDEXES, CursorError, fetch_page_async, stream_products_async
+from .metrics import AsyncTimedRedis, MongoCommandTimer, render, start_request
+from .page_cache import AsyncPageCache
+from .schemas import (
+    product_autocomplete_query_schema, product_bulk_schema, product_export_query_schema,
+    product_list_query_schema, product_patch_bulk_schema, product_schema, product_search_query_schema
+)
+from .search import SEARCH_ENABLED, AsyncSearchService, SearchUnavailable, in_order
+from .watcher import AsyncProductWatcher
+
+app = FastAPI(
+    title="Product Service",
+    description="Product microservice for microservices demo",
+    version="1.0.0"
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(),
+        logging.FileHandler('/var/log/product-service.log')
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# Set up on startup, inside the worker's event loop
+mongo_client = None
+db = None
+products_collection = None
+product_ids = None
+redis_client = None
+page_cache = None
+search_service = None
+product_watcher = None
+
+def jsonify(content, status_code=200):
+    return ORJSONResponse(content, status_code=status_code)
+
+async def get_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def cache_product(product):
+    await redis_client.setex(product_cache_key(product['id']), PRODUCT_TTL, cache_serializer.dumps(product))
+
+# Lifecycle
+@app.on_event("startup")
+async def startup():
+    global mongo_client, db, products_collection, product_ids, redis_client, page_cache, search_service
+    global product_watcher
+
+    # MongoDB connection
+    try:
+        mongo_client = AsyncIOMotorClient(
+            host=os.getenv('MONGODB_HOST', 'mongodb-service'),
+            port=int(os.getenv('MONGODB_PORT', 27017)),
+            username=os.getenv('MONGODB_USER', 'root'),
+            password=os.getenv('MONGODB_PASSWORD', 'password'),
+            serverSelectionTimeoutMS=5000,
+            connectTimeoutMS=5000,
+            socketTimeoutMS=5000,
+            event_listeners=[MongoCommandTimer()]
+        )
+        db = mongo_client[os.getenv('MONGODB_DB', 'products')]
+        products_collection = db.products
+        logger.info("Connected to MongoDB")
+    except Exception as e:
+        logger.error(f"Failed to connect to MongoDB: {e}")
+
+    if products_collection is not None:
+        # Separately, so existing duplicates do not also block the listing indexes
+        for indexes in (UNIQUE_INDEXES, LISTING_INDEXES):
+            try:
+                await products_collection.create_indexes(indexes)
+            except Exception as e:
+                logger.error(f"Failed to create product indexes: {e}")
+        product_ids = AsyncIdAllocator(db.counters)
+        try:
+            await product_ids.seed(products_collection)
+        except Exception as e:
+            logger.error(f"Failed to seed product ID counter: {e}")
+
+    # Redis connection
+    try:
+        redis_client = AsyncTimedRedis(
+            host=os.getenv('REDIS_HOST', 'redis-service'),
+            port=int(os.getenv('REDIS_PORT', 6379)),
+            socket_connect_timeout=5,
+            socket_timeout=5,
+            retry_on_timeout=True
+        )
+        await redis_client.ping()
+        page_cache = AsyncPageCache(redis_client)
+        logger.info("Connected to Redis")
+    except Exception as e:
+        logger.error(f"Failed to connect to Redis: {e}")
+        redis_client = None
+
+    # Loads in the background; search answers 503 until it is ready
+    if SEARCH_ENABLED and products_collection is not None:
+        search_service = AsyncSearchService(products_collection, redis_client)
+        search_service.start()
+
+    # Applies every product write, from here or elsewhere, to listings and search
+    if products_collection is not None:
+        product_watcher = AsyncProductWatcher(products_collection, db.watch_state, redis_client, search_service)
+        product_watcher.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if product_watcher:
+        await product_watcher.stop()
+    if search_service:
+        await search_service.stop()
+    if redis_client:
+        await redis_client.aclose()
+    if mongo_client:
+        mongo_client.close()
+
+# Middleware for metrics
+@app.middleware("http")
+async def metrics_middleware(request, call_next):
+    timer = start_request()
+
+    response = await call_next(request)
+
+    # Labelled by handler name, like Flask's request.endpoint
+    endpoint = request.scope.get('endpoint')
+    timer.finish(request.method, endpoint.__name__ if endpoint else None, response.status_code)
+
+    return response
+
+# CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+@app.get('/health')
+async def health_check():
+    try:
+        # Check MongoDB connection
+        if mongo_client:
+            await mongo_client.admin.command('ping')
+        else:
+            raise Exception("MongoDB not connected")
+
+        # Check Redis connection
+        if redis_client:
+            await redis_client.ping()
+        else:
+            raise Exception("Redis not connected")
+
+        return jsonify({
+            'status': 'healthy',
+            'service': 'product-service',
+            'timestamp': datetime.utcnow().isoformat(),
+            'version': '1.0.0'
+        }, 200)
+    except Exception as e:
+        logger.error(f"Health check failed: {str(e)}")
+        return jsonify({
+            'status': 'unhealthy',
+            'service': 'product-service',
+            'error': str(e),
+            'timestamp': datetime.utcnow().isoformat()
+        }, 503)
+
+@app.get('/metrics')
+async def metrics():
+    # Reads every worker's files under gunicorn; off the event loop
+    body = await asyncio.to_thread(render)
+    return Response(body, media_type=CONTENT_TYPE_LATEST)
+
+@app.get('/api/products')
+async def get_products(request: Request):
+    try:
+        try:
+            query = product_list_query_schema.load(request.query_params)
+        except ValidationError as e:
+            return jsonify({'error': 'Validation error', 'details': e.messages}, 400)
+
+        if products_collection is None:
+            return jsonify({'error': 'Database not available'}, 503)
+
+        async def build_page():
+            products, next_cursor = await fetch_page_async(products_collection, query)
+            return {'products': products, 'count': len(products), 'next_cursor': next_cursor}
+
+        # Check cache first; only one worker rebuilds a missing or stale page
+        try:
+            if page_cache:
+                page, cached = await page_cache.get_or_build(query, build_page)
+            else:
+                page, cached = await build_page(), False
+        except CursorError as e:
+            return jsonify({'error': str(e)}, 400)
+
+        if cached:
+            logger.info("Products page retrieved from cache")
+        else:
+            logger.info(f"Retrieved {page['count']} products from database")
+        return jsonify(page)
+    except Exception as e:
+        logger.error(f"Error getting products: {str(e)}")
+        return jsonify({'error': 'Internal server error'}, 500)
+
+@app.get('/api/products/export')
+async def export_products(request: Request):
+    try:
+        query = product_export_query_schema.load(request.query_params)
+    except ValidationError as e:
+        return jsonify({'error': 'Validation error', 'details': e.messages}, 400)
+
+    if products_collection is None:
+        return jsonify({'error': 'Database not available'}, 503)
+
+    export_format = query['format']
+
+    async def body():
+        try:
+            async for chunk in stream_products_async(products_collection, query, export_format):
+                yield chunk
+        except Exception as e:
+            # Headers are already sent, so the client sees a truncated body
+            logger.error(f"Error exporting products: {str(e)}")
+            raise
+
+    logger.info(f"Exporting products as {export_format}")
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename="products.{export_format}"'}
+    )
+
+@app.get('/api/products/search')
+async def search_products(request: Request):
+    try:
+        try:
+            query = product_search_query_schema.load(request.query_params)
+        except ValidationError as e:
+            return jsonify({'error': 'Validation error', 'details': e.messages}, 400)
+
+        if search_service is None:
+            return jsonify({'error': 'Search not available'}, 503)
+
+        try:
+            product_ids, total, facets = await search_service.search(**query)
+        except SearchUnavailable as e:
+            return jsonify({'error': str(e)}, 503)
+
+        # The index ranks; the page itself comes from the database
+        cursor = products_collection.find({'id': {'$in': product_ids}}, {'_id': 0})
+        products = in_order(await cursor.to_list(len(product_ids)), product_ids)
+
+        logger.info(f"Search matched {total} products")
+        return jsonify({'products': products, 'total': total, 'facets': facets})
+    except Exception as e:
+        logger.error(f"Error searching products: {str(e)}")
+        return jsonify({'error': 'Internal server error'}, 500)
+
+@app.get('/api/products/search/autocomplete')
+async def autocomplete_products(request: Request):
+    try:
+        try:
+            query = product_autocomplete_query_schema.load(request.query_params)
+        except ValidationError as e:
+            return jsonify({'error': 'Validation error', 'details': e.messages}, 400)
+
+        if search_service is None:
+            return jsonify({'error': 'Search not available'}, 503)
+
+        try:
+            product_ids = await search_service.autocomplete(**query)
+        except SearchUnavailable as e:
+            return jsonify({'error': str(e)}, 503)
+
+        cursor = products_collection.find({'id': {'$in': product_ids}}, {'_id': 0, 'id': 1, 'name': 1, 'sku': 1})
+        suggestions = in_order(await cursor.to_list(len(product_ids)), product_ids)
+        return jsonify({'suggestions': suggestions})
+    except Exception as e:
+        logger.error(f"Error autocompleting products: {str(e)}")
+        return jsonify({'error': 'Internal server error'}, 500)
+
+@app.post('/api/products/bulk')
+async def create_products_bulk(request: Request):
+    try:
+        data = await get_json(request)
+        error = check_bulk_body(data)
+        if error:
+            return jsonify({'error': error[0]}, error[1])
+        if products_collection is None:
+            return jsonify({'error': 'Database not available'}, 503)
+
+        products, invalid = load_items(product_bulk_schema, data)
+
+        # One counter round trip for the whole batch
+        indexes = list(products)
+        now = datetime.utcnow().isoformat()
+        operations = []
+        for index, product_id in zip(indexes, await product_ids.allocate_many(len(indexes))):
+            products[index].update(id=product_id, created_at=now, updated_at=now)
+            operations.append(InsertOne(products[index]))
+
+        failed = await apply_writes_async(products_collection, operations, indexes)
+        created = [{'index': index, 'id': products[index]['id']} for index in indexes if index not in failed]
+
+        logger.info(f"Bulk create: {len(created)} created, {len(data) - len(created)} rejected")
+        return jsonify({'created': created, 'errors': bulk_errors(invalid, failed)}, 200)
+
+    except Exception as e:
+        logger.error(f"Error bulk creating products: {str(e)}")
+        return jsonify({'error': 'Internal server error'}, 500)
+
+@app.patch('/api/products/bulk')
+async def update_products_bulk(request: Request):
+    try:
+        data = await get_json(request)
+        error = check_bulk_body(data)
+        if error:
+            return jsonify({'error': error[0]}, error[1])
+        if products_collection is None:
+            return jsonify({'error': 'Database not available'}, 503)
+
+        changes, invalid = load_items(product_patch_bulk_schema, data)
+
+        # One query finds every target; bulk results do not say which updates matched
+        requested = list({change['id'] for change in changes.values()})
+        existing = {
+            product['id'] async for product in products_collection.find({'id': {'$in': requested}}, {'_id': 0, 'id': 1})
+        }
+        missing = [index for index, change in changes.items() if change['id'] not in existing]
+        for index in missing:
+            del changes[index]
+
+        indexes = list(changes)
+        now = datetime.utcnow().isoformat()
+        operations = [
+            UpdateOne(
+                {'id': changes[index]['id']},
+                {'$set': {**{field: value for field, value in changes[index].items() if field != 'id'}, 'updated_at': now}}
+            )
+            for index in indexes
+        ]
+
+        failed = await apply_writes_async(products_collection, operations, indexes)
+        updated = [{'index': index, 'id': changes[index]['id']} for index in indexes if index not in failed]
+
+        # Invalidate cache once for the batch; the watcher updates listings and search
+        if updated and redis_client:
+            await redis_client.delete(*{product_cache_key(product['id']) for product in updated})
+
+        logger.info(f"Bulk update: {len(updated)} updated, {len(data) - len(updated)} rejected")
+        return jsonify({'updated': updated, 'errors': bulk_errors(invalid, failed, missing)}, 200)
+
+    except Exception as e:
+        logger.error(f"Error bulk updating products: {str(e)}")
+        return jsonify({'error': 'Internal server error'}, 500)
+
+@app.get('/api/products/{product_id}')
+async def get_product(product_id: str):
+    try:
+        # Check cache first
+        if redis_client:
+            cached = await redis_client.get(product_cache_key(product_id))
+            if cached:
+                logger.info(f"Product {product_id} retrieved from cache")
+                return jsonify(cache_serializer.loads(cached))
+
+        # Get from database
+        if products_collection is None:
+            return jsonify({'error': 'Database not available'}, 503)
+
+        product = await products_collection.find_one({'id': product_id}, {'_id': 0})
+        if not product:
+            return jsonify({'error': 'Product not found'}, 404)
+
+        if redis_client:
+            await cache_product(product)
+
+        logger.info(f"Product {product_id} retrieved from database")
+        return jsonify(product)
+    except Exception as e:
+        logger.error(f"Error getting product {product_id}: {str(e)}")
+        return jsonify({'error': 'Internal server error'}, 500)
+
+@app.post('/api/products')
+async def create_product(request: Request):
+    try:
+        data = await get_json(request)
+        if not data:
+            return jsonify({'error': 'No data provided'}, 400)
+
+        # Validate input
+        try:
+            validated_data = product_schema.load(data)
+        except ValidationError as e:
+            return jsonify({'error': 'Validation error', 'details': e.messages}, 400)
+
+        if products_collection is not None:
+            # Add metadata
+            validated_data['id'] = await product_ids.allocate()
+            validated_data['created_at'] = datetime.utcnow().isoformat()
+            validated_data['updated_at'] = datetime.utcnow().isoformat()
+
+            product = dict(validated_data)
+            try:
+                await products_collection.insert_one(validated_data)
+            except DuplicateKeyError as e:
+                if is_sku_conflict(e.details or {}):
+                    return jsonify({'error': 'SKU already exists'}, 409)
+                raise
+
+            # Write through; the watcher updates listings and search
+            if redis_client:
+                await cache_product(product)
+
+            logger.info(f"Product created with ID: {validated_data['id']}")
+            return jsonify({'id': validated_data['id'], 'message': 'Product created'}, 201)
+        else:
+            return jsonify({'error': 'Database not available'}, 503)
+
+    except Exception as e:
+        logger.error(f"Error creating product: {str(e)}")
+        return jsonify({'error': 'Internal server error'}, 500)
+
+@app.put('/api/products/{product_id}')
+async def update_product(product_id: str, request: Request):
+    try:
+        data = await get_json(request)
+        if not data:
+            return jsonify({'error': 'No data provided'}, 400)
+
+        # Validate input
+        try:
+            validated_data = product_schema.load(data)
+        except ValidationError as e:
+            return jsonify({'error': 'Validation error', 'details': e.messages}, 400)
+
+        if products_collection is None:
+            return jsonify({'error': 'Database not available'}, 503)
+
+        # Update product
+        validated_data['updated_at'] = datetime.utcnow().isoformat()
+        try:
+            product = await products_collection.find_one_and_update(
+                {'id': product_id},
+                {'$set': validated_data},
+                projection={'_id': 0},
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError as e:
+            if is_sku_conflict(e.details or {}):
+                return jsonify({'error': 'SKU already exists'}, 409)
+            raise
+
+        if product is None:
+            return jsonify({'error': 'Product not found'}, 404)
+
+        # Write through; the watcher updates listings and search
+        if redis_client:
+            await cache_product(product)
+
+        logger.info(f"Product {product_id} updated")
+        return jsonify({'message': 'Product updated successfully'}, 200)
+
+    except Exception as e:
+        logger.error(f"Error updating product {product_id}: {str(e)}")
+        return jsonify({'error': 'Internal server error'}, 500)
+
+@app.delete('/api/products/{product_id}')
+async def delete_product(product_id: str):
+    try:
+        if products_collection is None:
+            return jsonify({'error': 'Database not available'}, 503)
+
+        # Delete product
+        result = await products_collection.delete_one({'id': product_id})
+        if result.deleted_count == 0:
+            return jsonify({'error': 'Product not found'}, 404)
+
+        # Invalidate cache; the watcher updates listings and search
+        if redis_client:
+            await redis_client.delete(product_cache_key(product_id))
+
+        logger.info(f"Product {product_id} deleted")
+        return jsonify({'message': 'Product deleted successfully'}, 200)
+
+    except Exception as e:
+        logger.error(f"Error deleting product {product_id}: {str(e)}")
+        return jsonify({'error': 'Internal server error'}, 500)
+
+@app.exception_handler(StarletteHTTPException)
+async def http_error(request, exc):
+    if exc.status_code == 404:
+        return jsonify({'error': 'Route not found'}, 404)
+    return jsonify({'error': exc.detail}, exc.status_code)
+
+@app.exception_handler(Exception)
+async def internal_error(request, exc):
+    logger.error(f"Internal server error: {exc}")
+    return jsonify({'error': 'Internal server error'}, 500)
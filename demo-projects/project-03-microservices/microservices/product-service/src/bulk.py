@@ -0,0 +1,78 @@
+"""Batch writes for the bulk product endpoints.
+
+A batch is validated item by item, and the valid items are written in one
+unordered bulk_write. MongoDB applies every operation it can and reports
+the failures by position, so a bad item costs only itself. Results and
+errors point back to each item's index in the request body.
+"""
+import logging
+import os
+
+from marshmallow import ValidationError
+from pymongo.errors import BulkWriteError
+
+from .catalog import is_sku_conflict
+
+logger = logging.getLogger(__name__)
+
+BULK_MAX_ITEMS = int(os.getenv('PRODUCTS_BULK_MAX_ITEMS', 1000))
+
+
+def check_bulk_body(data):
+    """Return (message, status) if `data` is not a usable bulk request body, else None."""
+    if not isinstance(data, list) or not data:
+        return 'Expected a non-empty JSON array', 400
+    if len(data) > BULK_MAX_ITEMS:
+        return f'At most {BULK_MAX_ITEMS} products per request', 413
+    return None
+
+
+def load_items(schema, items):
+    """Validate `items` with a many=True schema.
+
+    Returns ({index: loaded item}, {index: validation messages}); an item is
+    in exactly one of the two.
+    """
+    try:
+        return dict(enumerate(schema.load(items))), {}
+    except ValidationError as e:
+        loaded = {index: item for index, item in enumerate(e.valid_data) if index not in e.messages}
+        return loaded, dict(e.messages)
+
+
+def apply_writes(collection, operations, indexes):
+    """Run `operations` unordered; return {item index: write error} for those that failed.
+
+    `indexes[n]` is the request index of the item behind `operations[n]`.
+    """
+    if not operations:
+        return {}
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        return {indexes[error['index']]: error for error in e.details['writeErrors']}
+    return {}
+
+
+async def apply_writes_async(collection, operations, indexes):
+    """apply_writes for a Motor collection."""
+    if not operations:
+        return {}
+    try:
+        await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        return {indexes[error['index']]: error for error in e.details['writeErrors']}
+    return {}
+
+
+def bulk_errors(invalid, failed, missing=()):
+    """Per-item errors, in request order, from validation messages, write errors and unknown IDs."""
+    errors = [{'index': index, 'error': 'Validation error', 'details': messages} for index, messages in invalid.items()]
+    errors += [{'index': index, 'error': 'Product not found'} for index in missing]
+    for index, write_error in failed.items():
+        if is_sku_conflict(write_error):
+            errors.append({'index': index, 'error': 'SKU already exists'})
+        else:
+            logger.error(f"Bulk write of item {index} failed: {write_error.get('errmsg')}")
+            errors.append({'index': index, 'error': 'Write failed'})
+    return sorted(errors, key=lambda error: error['index'])
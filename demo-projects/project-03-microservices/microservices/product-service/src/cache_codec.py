@@ -0,0 +1,146 @@
+"""Serialization for values cached in Redis.
+
+A codec turns a JSON-compatible value into bytes and back; datetimes are
+written as ISO 8601 strings. Payloads of at least PRODUCT_CACHE_COMPRESS_MIN
+bytes are compressed with PRODUCT_CACHE_COMPRESSION. Every payload starts
+with a one-byte header naming its compressor, so entries written under
+other compression settings still decode.
+
+The codec name and CACHE_SCHEMA_VERSION are part of every key (see
+cache_key), so switching codecs or changing the shape of cached values
+starts a fresh keyspace instead of misreading old entries.
+"""
+import json
+import os
+import zlib
+from datetime import date, datetime
+
+# Bump when the shape of cached values changes
+CACHE_SCHEMA_VERSION = 1
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+class JsonCodec:
+    name = 'json'
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':'), default=_default).encode()
+
+    def loads(self, payload):
+        return json.loads(payload)
+
+
+class OrjsonCodec:
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, value):
+        # Datetimes are handled natively, in the same format as isoformat()
+        return self.orjson.dumps(value, default=_default)
+
+    def loads(self, payload):
+        return self.orjson.loads(payload)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+
+    def __init__(self):
+        import msgpack
+        self.msgpack = msgpack
+
+    def dumps(self, value):
+        return self.msgpack.packb(value, default=_default)
+
+    def loads(self, payload):
+        return self.msgpack.unpackb(payload)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+
+
+class ZlibCompressor:
+    header = b'z'
+
+    def compress(self, payload):
+        return zlib.compress(payload, 1)
+
+    def decompress(self, payload):
+        return zlib.decompress(payload)
+
+
+class Lz4Compressor:
+    header = b'l'
+
+    def __init__(self):
+        import lz4.frame
+        self.lz4 = lz4.frame
+
+    def compress(self, payload):
+        return self.lz4.compress(payload)
+
+    def decompress(self, payload):
+        return self.lz4.decompress(payload)
+
+
+COMPRESSORS = {'zlib': ZlibCompressor, 'lz4': Lz4Compressor}
+UNCOMPRESSED = b'-'
+
+
+class CacheSerializer:
+    """Codec plus optional compression; instances are shared across threads."""
+
+    def __init__(self, codec='orjson', compression='none', compress_min=64 * 1024):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown cache codec {codec!r}; expected one of {', '.join(CODECS)}")
+        if compression != 'none' and compression not in COMPRESSORS:
+            raise ValueError(f"Unknown cache compression {compression!r}; expected none, {', '.join(COMPRESSORS)}")
+        self.codec = CODECS[codec]()
+        self.compressor = COMPRESSORS[compression]() if compression != 'none' else None
+        self.compress_min = compress_min
+        self._decompressors = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            codec=os.getenv('PRODUCT_CACHE_CODEC', 'orjson'),
+            compression=os.getenv('PRODUCT_CACHE_COMPRESSION', 'lz4'),
+            compress_min=int(os.getenv('PRODUCT_CACHE_COMPRESS_MIN', 64 * 1024))
+        )
+
+    def cache_key(self, *parts):
+        """Key for `parts` in this codec's versioned keyspace, e.g. product:v1:orjson:42."""
+        head, *rest = parts
+        return ':'.join([head, f"v{CACHE_SCHEMA_VERSION}", self.codec.name, *map(str, rest)])
+
+    def dumps(self, value):
+        payload = self.codec.dumps(value)
+        if self.compressor and len(payload) >= self.compress_min:
+            return self.compressor.header + self.compressor.compress(payload)
+        return UNCOMPRESSED + payload
+
+    def loads(self, payload):
+        header, body = payload[:1], payload[1:]
+        if header != UNCOMPRESSED:
+            body = self._decompressor(header).decompress(body)
+        return self.codec.loads(body)
+
+    def _decompressor(self, header):
+        if self.compressor and header == self.compressor.header:
+            return self.compressor
+        if header not in self._decompressors:
+            for compressor in COMPRESSORS.values():
+                if compressor.header == header:
+                    self._decompressors[header] = compressor()
+                    break
+            else:
+                raise ValueError(f"Unknown cache payload header {header!r}")
+        return self._decompressors[header]
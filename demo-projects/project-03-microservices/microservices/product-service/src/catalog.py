@@ -0,0 +1,80 @@
+"""Storage layout and cache keys shared by both serving modes.
+
+The WSGI app (app.py) and the ASGI app (asgi.py) read and write the same
+collections and cache entries, so a deployment can switch modes, or run
+both side by side, without a migration or a cold cache.
+"""
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, IndexModel
+
+from .cache_codec import CacheSerializer
+
+# Enforced by MongoDB, so creates need no lookup before inserting. Default
+# names, as database/init-mongodb.js creates the same indexes as id_1 and sku_1
+UNIQUE_INDEXES = [
+    IndexModel([('id', ASCENDING)], unique=True),
+    IndexModel([('sku', ASCENDING)], unique=True),
+]
+
+# Encodes cached values; the codec and schema version are part of each key
+cache_serializer = CacheSerializer.from_env()
+
+# Listing pages are tagged with a generation counter; a write bumps the
+# counters it affects and the pages tagged with them go stale without being
+# enumerated. Pages filtered on a category carry that category's tag, all
+# other pages the catalog-wide one.
+PRODUCTS_GENERATION_KEY = cache_serializer.cache_key('products', 'generation')
+
+
+def category_generation_key(category):
+    return cache_serializer.cache_key('products', 'generation', 'category', category)
+
+
+def page_tag_key(query):
+    if query.get('category'):
+        return category_generation_key(query['category'])
+    return PRODUCTS_GENERATION_KEY
+
+
+def write_tag_keys(*categories):
+    """Tags to bump after a write to products in `categories` (old and new)."""
+    return [PRODUCTS_GENERATION_KEY, *(category_generation_key(category) for category in sorted({c for c in categories if c}))]
+
+
+# Product entries are written through on every change, the TTL only bounds
+# entries for products nothing has asked about lately
+PRODUCT_TTL = 600
+
+
+def product_cache_key(product_id):
+    return cache_serializer.cache_key('product', product_id)
+
+
+def page_cache_key(query):
+    canonical = json.dumps(query, sort_keys=True, separators=(',', ':'))
+    return cache_serializer.cache_key('products', 'page', hashlib.sha256(canonical.encode()).hexdigest()[:32])
+
+
+def stored_datetime(value):
+    """A stored created_at or updated_at as a naive UTC datetime, or None.
+
+    The app writes ISO strings; database/init-mongodb.js seeds BSON Dates.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def is_sku_conflict(details):
+    # Servers before 4.2 only name the violated index in the message
+    return 'sku' in details.get('keyPattern', {}) or 'sku_1' in details.get('errmsg', '')
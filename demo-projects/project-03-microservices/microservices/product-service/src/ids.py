@@ -0,0 +1,111 @@
+"""Product ID allocation.
+
+IDs come from a counter document advanced with an atomic $inc, so
+concurrent creates in any number of workers never share an ID and deleted
+IDs are not handed out again. Each worker reserves a block of
+PRODUCT_ID_BLOCK_SIZE IDs per round trip and hands them out locally; with
+blocks larger than one, IDs stay unique but are no longer issued in
+creation order across workers, and a restart skips the unused rest of a
+block.
+"""
+import asyncio
+import os
+import threading
+
+from pymongo import ReturnDocument
+
+ID_BLOCK_SIZE = int(os.getenv('PRODUCT_ID_BLOCK_SIZE', 1))
+
+
+class IdAllocator:
+    """Hands out string IDs from the `seq` field of one counter document."""
+
+    def __init__(self, counters, name='products', block_size=ID_BLOCK_SIZE):
+        self.counters = counters
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def seed(self, collection):
+        """Start the counter above the highest numeric ID already in `collection`.
+
+        Only scans when the counter does not exist yet. $max makes concurrent
+        seeding from several workers safe and never moves the counter back.
+        """
+        if self.counters.find_one({'_id': self.name}) is not None:
+            return
+        highest = max(
+            (int(document['id']) for document in collection.find({}, {'_id': 0, 'id': 1})
+             if str(document.get('id', '')).isdigit()),
+            default=0
+        )
+        self.counters.update_one({'_id': self.name}, {'$max': {'seq': highest}}, upsert=True)
+
+    def _reserve(self, count):
+        """Advance the counter by `count` and return the first ID reserved."""
+        counter = self.counters.find_one_and_update(
+            {'_id': self.name},
+            {'$inc': {'seq': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter['seq'] - count + 1
+
+    def allocate(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self._reserve(self.block_size)
+                self._end = self._next + self.block_size
+            product_id = self._next
+            self._next += 1
+        return str(product_id)
+
+    def allocate_many(self, count):
+        """Reserve `count` consecutive IDs in one round trip, bypassing the local block."""
+        if count == 0:
+            return []
+        first = self._reserve(count)
+        return [str(product_id) for product_id in range(first, first + count)]
+
+
+class AsyncIdAllocator(IdAllocator):
+    """IdAllocator for a Motor counters collection."""
+
+    def __init__(self, counters, name='products', block_size=ID_BLOCK_SIZE):
+        super().__init__(counters, name, block_size)
+        self._lock = asyncio.Lock()
+
+    async def seed(self, collection):
+        if await self.counters.find_one({'_id': self.name}) is not None:
+            return
+        highest = 0
+        async for document in collection.find({}, {'_id': 0, 'id': 1}):
+            if str(document.get('id', '')).isdigit():
+                highest = max(highest, int(document['id']))
+        await self.counters.update_one({'_id': self.name}, {'$max': {'seq': highest}}, upsert=True)
+
+    async def _reserve(self, count):
+        counter = await self.counters.find_one_and_update(
+            {'_id': self.name},
+            {'$inc': {'seq': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter['seq'] - count + 1
+
+    async def allocate(self):
+        async with self._lock:
+            if self._next >= self._end:
+                self._next = await self._reserve(self.block_size)
+                self._end = self._next + self.block_size
+            product_id = self._next
+            self._next += 1
+        return str(product_id)
+
+    async def allocate_many(self, count):
+        if count == 0:
+            return []
+        first = await self._reserve(count)
+        return [str(product_id) for product_id in range(first, first + count)]
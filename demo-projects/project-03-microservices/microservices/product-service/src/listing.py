@@ -0,0 +1,187 @@
+"""Product listing: keyset pages and streaming exports.
+
+Products are listed newest first by (created_at, id). A page ends with an
+opaque cursor encoding the last (created_at, id) returned; the next page
+seeks past it on a compound index instead of skipping documents, so every
+page costs the same however deep it is. created_at is an ISO string for
+products written by the app and a BSON Date for those seeded by
+database/init-mongodb.js. MongoDB orders every Date ahead of every string
+here, so the cursor records which type it ended on. Filters are equality on category
+and ranges on price and stock, all served by LISTING_INDEXES.
+
+Exports walk the same index with a batched Mongo cursor and write each
+batch out as it arrives, so memory stays flat however large the catalog.
+"""
+import base64
+import binascii
+import os
+from datetime import datetime
+
+import orjson
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+EXPORT_BATCH_SIZE = int(os.getenv('PRODUCTS_EXPORT_BATCH_SIZE', 1000))
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+LISTABLE_FIELDS = ('id', 'name', 'description', 'price', 'category', 'stock', 'sku', 'created_at', 'updated_at')
+
+# Sort keys lead so pages come straight off the index; price and stock trail
+# so their filters are checked against index keys before documents are fetched
+LISTING_INDEXES = [
+    IndexModel(
+        [('created_at', DESCENDING), ('id', DESCENDING), ('price', ASCENDING), ('stock', ASCENDING)],
+        name='listing'
+    ),
+    IndexModel(
+        [('category', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING), ('price', ASCENDING), ('stock', ASCENDING)],
+        name='listing_by_category'
+    ),
+]
+
+
+class CursorError(Exception):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(product):
+    created_at = product['created_at']
+    if isinstance(created_at, datetime):
+        raw = f"date|{created_at.isoformat()}|{product['id']}"
+    else:
+        raw = f"str|{created_at}|{product['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (created_at, product_id); created_at is a datetime if the page ended on a Date."""
+    try:
+        kind, created_at, product_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 2)
+        if kind == 'date':
+            created_at = datetime.fromisoformat(created_at)
+        elif kind != 'str':
+            raise ValueError(kind)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise CursorError("Invalid cursor")
+    return created_at, product_id
+
+
+def build_filter(query):
+    """Translate validated list parameters into a MongoDB filter."""
+    conditions = []
+
+    if query.get('category'):
+        conditions.append({'category': query['category']})
+
+    price = {}
+    if query.get('min_price') is not None:
+        price['$gte'] = query['min_price']
+    if query.get('max_price') is not None:
+        price['$lte'] = query['max_price']
+    if price:
+        conditions.append({'price': price})
+
+    if query.get('in_stock') is True:
+        conditions.append({'stock': {'$gt': 0}})
+    elif query.get('in_stock') is False:
+        conditions.append({'stock': {'$lte': 0}})
+
+    if query.get('cursor'):
+        created_at, product_id = decode_cursor(query['cursor'])
+        after = [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, 'id': {'$lt': product_id}},
+        ]
+        if isinstance(created_at, datetime):
+            # $lt only matches values of its own type, and every string comes after the Dates
+            after.append({'created_at': {'$type': 'string'}})
+        conditions.append({'$or': after})
+
+    if not conditions:
+        return {}
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+
+def find_products(collection, query, fields):
+    # The cursor needs the sort keys even when they were not asked for
+    projection = {'_id': 0, **{field: 1 for field in {*fields, 'created_at', 'id'}}}
+    return collection.find(build_filter(query), projection).sort([('created_at', DESCENDING), ('id', DESCENDING)])
+
+
+def _page(documents, fields, limit):
+    next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    products = [{field: document[field] for field in fields if field in document} for document in documents[:limit]]
+    return products, next_cursor
+
+
+def fetch_page(collection, query):
+    """Return (products, next_cursor) for validated list parameters."""
+    fields = query.get('fields') or LISTABLE_FIELDS
+    limit = query['limit']
+    return _page(list(find_products(collection, query, fields).limit(limit + 1)), fields, limit)
+
+
+async def fetch_page_async(collection, query):
+    """fetch_page for a Motor collection."""
+    fields = query.get('fields') or LISTABLE_FIELDS
+    limit = query['limit']
+    return _page(await find_products(collection, query, fields).limit(limit + 1).to_list(limit + 1), fields, limit)
+
+
+def _export_row(document, fields):
+    return orjson.dumps({field: document[field] for field in fields if field in document})
+
+
+def _export_chunk(batch, first, format):
+    if format == 'ndjson':
+        return b'\n'.join(batch) + b'\n'
+    return (b'' if first else b',') + b','.join(batch)
+
+
+def stream_products(collection, query, format):
+    """Yield the filtered catalog as NDJSON lines or one JSON array, a batch per chunk."""
+    fields = query.get('fields') or LISTABLE_FIELDS
+    cursor = find_products(collection, query, fields).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        if format == 'json':
+            yield b'['
+        batch = []
+        first = True
+        for document in cursor:
+            batch.append(_export_row(document, fields))
+            if len(batch) == EXPORT_BATCH_SIZE:
+                yield _export_chunk(batch, first, format)
+                batch = []
+                first = False
+        if batch:
+            yield _export_chunk(batch, first, format)
+        if format == 'json':
+            yield b']'
+    finally:
+        cursor.close()
+
+
+async def stream_products_async(collection, query, format):
+    """stream_products for a Motor collection."""
+    fields = query.get('fields') or LISTABLE_FIELDS
+    cursor = find_products(collection, query, fields).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        if format == 'json':
+            yield b'['
+        batch = []
+        first = True
+        async for document in cursor:
+            batch.append(_export_row(document, fields))
+            if len(batch) == EXPORT_BATCH_SIZE:
+                yield _export_chunk(batch, first, format)
+                batch = []
+                first = False
+        if batch:
+            yield _export_chunk(batch, first, format)
+        if format == 'json':
+            yield b']'
+    finally:
+        await cursor.close()
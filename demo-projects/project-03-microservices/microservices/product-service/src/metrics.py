@@ -0,0 +1,190 @@
+"""Request metrics shared by both serving modes.
+
+Each request is timed with a monotonic clock from the first middleware hook
+to the response headers (for streamed exports, the time to the first byte).
+MongoDB commands, seen through a pymongo command listener, and Redis
+commands, timed by the client classes below, add their duration to the
+request being served. The request's latency is then recorded three ways:
+in total, as time spent waiting on each backend, and as the remainder spent
+in the handler. Calls made outside a request are not recorded. These are
+the watcher's change stream reads, which block by design, and the search
+index loads.
+
+Labels are bounded: endpoint is the handler's name, the same in both modes,
+or 'unmatched' when no route matched. Methods outside the standard set are
+counted as 'other'. Client input never reaches a label.
+
+Under gunicorn, PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py), so
+each worker writes its samples to files there. /metrics sums every
+worker's files, so whichever worker answers a scrape reports the whole pod.
+
+Histogram buckets are configured as comma-separated bounds in seconds. All
+routes share one layout, so their buckets can be summed.
+"""
+import contextvars
+import os
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from pymongo import monitoring
+import redis
+import redis.asyncio as aioredis
+
+
+def buckets_from_env(name, default):
+    value = os.getenv(name)
+    if not value:
+        return default
+    return tuple(sorted(float(bound) for bound in value.split(',')))
+
+
+REQUEST_BUCKETS = buckets_from_env('PRODUCT_METRICS_BUCKETS', Histogram.DEFAULT_BUCKETS)
+CALL_BUCKETS = buckets_from_env(
+    'PRODUCT_METRICS_CALL_BUCKETS', (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0)
+)
+
+METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+UNMATCHED = 'unmatched'
+BACKENDS = ('mongodb', 'redis')
+
+# Prometheus metrics
+REQUEST_COUNT = Counter('http_requests_total', 'Total HTTP requests', ['method', 'endpoint', 'status'])
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'HTTP request duration', ['method', 'endpoint'], buckets=REQUEST_BUCKETS
+)
+HANDLER_DURATION = Histogram(
+    'http_request_handler_seconds', 'HTTP request time not spent waiting on MongoDB or Redis',
+    ['method', 'endpoint'], buckets=REQUEST_BUCKETS
+)
+BACKEND_DURATION = Histogram(
+    'http_request_backend_seconds', 'HTTP request time spent waiting on a backend, summed over its calls',
+    ['method', 'endpoint', 'backend'], buckets=REQUEST_BUCKETS
+)
+BACKEND_CALL_DURATION = Histogram(
+    'backend_call_duration_seconds', 'MongoDB and Redis calls made while serving requests',
+    ['backend', 'operation'], buckets=CALL_BUCKETS
+)
+
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+_current_request = contextvars.ContextVar('current_request', default=None)
+
+# (method, endpoint) -> labelled children; the key space is bounded, see above
+_children = {}
+
+
+def _route_metrics(method, endpoint):
+    key = (method, endpoint)
+    children = _children.get(key)
+    if children is None:
+        children = _children[key] = (
+            REQUEST_DURATION.labels(method, endpoint),
+            HANDLER_DURATION.labels(method, endpoint),
+            [BACKEND_DURATION.labels(method, endpoint, backend) for backend in BACKENDS],
+        )
+    return children
+
+
+class RequestTimer:
+    """Times one request; backend calls made while it is current add to it.
+
+    Tasks and Motor's executor threads run in a copy of the context, which
+    still refers to this timer, so calls made there add to it.
+    """
+
+    __slots__ = ('started', 'waited')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.waited = dict.fromkeys(BACKENDS, 0.0)
+
+    def finish(self, method, endpoint, status):
+        elapsed = time.perf_counter() - self.started
+        method = method if method in METHODS else 'other'
+        endpoint = endpoint or UNMATCHED
+        duration, handler, backends = _route_metrics(method, endpoint)
+        duration.observe(elapsed)
+        REQUEST_COUNT.labels(method, endpoint, status).inc()
+        for backend, histogram in zip(BACKENDS, backends):
+            histogram.observe(self.waited[backend])
+        # Clamped: calls awaited concurrently overlap
+        handler.observe(max(elapsed - sum(self.waited.values()), 0.0))
+
+
+def start_request():
+    timer = RequestTimer()
+    _current_request.set(timer)
+    return timer
+
+
+def record_call(backend, operation, seconds):
+    timer = _current_request.get()
+    if timer is None:
+        return
+    timer.waited[backend] += seconds
+    BACKEND_CALL_DURATION.labels(backend, operation).observe(seconds)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Pass in a client's event_listeners; works for Motor clients too."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record_call('mongodb', event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        record_call('mongodb', event.command_name, event.duration_micros / 1e6)
+
+
+class TimedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            record_call('redis', args[0], time.perf_counter() - started)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class TimedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        started = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            record_call('redis', 'PIPELINE', time.perf_counter() - started)
+
+
+class AsyncTimedRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            record_call('redis', args[0], time.perf_counter() - started)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncTimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class AsyncTimedPipeline(aioredis.client.Pipeline):
+    async def execute(self, raise_on_error=True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            record_call('redis', 'PIPELINE', time.perf_counter() - started)
+
+
+def render():
+    """The /metrics body; under gunicorn, summed over every worker."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
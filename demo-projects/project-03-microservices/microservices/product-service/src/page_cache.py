@@ -0,0 +1,93 @@
+"""Cached listing pages with single-flight rebuilds.
+
+A page is stored with the generation of its tag (see catalog.page_tag_key)
+and served while that generation is current. When it is missing or stale,
+one worker takes a short Redis lock and rebuilds it from MongoDB; the
+others poll for that result instead of all running the same query at once.
+A waiter that sees no result within PRODUCTS_REBUILD_WAIT_MS queries
+MongoDB itself rather than failing the request.
+"""
+import asyncio
+import os
+import time
+import uuid
+
+from .catalog import cache_serializer, page_cache_key, page_tag_key
+
+PAGE_TTL = 300
+REBUILD_LOCK_MS = int(os.getenv('PRODUCTS_REBUILD_LOCK_MS', 5000))
+REBUILD_WAIT_MS = int(os.getenv('PRODUCTS_REBUILD_WAIT_MS', 1000))
+REBUILD_POLL_MS = 20
+
+
+def _current(cached, generation):
+    if cached:
+        entry = cache_serializer.loads(cached)
+        if entry['generation'] == generation:
+            return entry['page']
+    return None
+
+
+class PageCache:
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def get_or_build(self, query, build):
+        """Return (page, cached); build() runs in at most one worker per stale page."""
+        key = page_cache_key(query)
+        # The generation is read before the database so a write that lands
+        # in between leaves the rebuilt page tagged stale
+        generation, cached = self.redis.mget(page_tag_key(query), key)
+        generation = int(generation or 0)
+        page = _current(cached, generation)
+        if page is not None:
+            return page, True
+
+        lock, token = f"{key}:lock", uuid.uuid4().hex
+        if not self.redis.set(lock, token, nx=True, px=REBUILD_LOCK_MS):
+            deadline = time.monotonic() + REBUILD_WAIT_MS / 1000
+            while time.monotonic() < deadline:
+                time.sleep(REBUILD_POLL_MS / 1000)
+                page = _current(self.redis.get(key), generation)
+                if page is not None:
+                    return page, True
+            return build(), False
+
+        try:
+            page = build()
+            self.redis.setex(key, PAGE_TTL, cache_serializer.dumps({'generation': generation, 'page': page}))
+            return page, False
+        finally:
+            # Not atomic; a lock that expired mid-rebuild costs one extra rebuild at most
+            if self.redis.get(lock) == token.encode():
+                self.redis.delete(lock)
+
+
+class AsyncPageCache(PageCache):
+    """PageCache for a redis.asyncio client; build is a coroutine function."""
+
+    async def get_or_build(self, query, build):
+        key = page_cache_key(query)
+        generation, cached = await self.redis.mget(page_tag_key(query), key)
+        generation = int(generation or 0)
+        page = _current(cached, generation)
+        if page is not None:
+            return page, True
+
+        lock, token = f"{key}:lock", uuid.uuid4().hex
+        if not await self.redis.set(lock, token, nx=True, px=REBUILD_LOCK_MS):
+            deadline = time.monotonic() + REBUILD_WAIT_MS / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(REBUILD_POLL_MS / 1000)
+                page = _current(await self.redis.get(key), generation)
+                if page is not None:
+                    return page, True
+            return await build(), False
+
+        try:
+            page = await build()
+            await self.redis.setex(key, PAGE_TTL, cache_serializer.dumps({'generation': generation, 'page': page}))
+            return page, False
+        finally:
+            if await self.redis.get(lock) == token.encode():
+                await self.redis.delete(lock)
@@ -0,0 +1,87 @@
+"""Request validation shared by both serving modes."""
+import os
+
+from marshmallow import Schema, fields, validate, validates, validates_schema, post_load, ValidationError, EXCLUDE
+
+from .listing import EXPORT_FORMATS, LISTABLE_FIELDS
+
+class ProductSchema(Schema):
+    name = fields.Str(required=True, validate=lambda x: len(x) >= 2 and len(x) <= 100)
+    description = fields.Str(required=True, validate=lambda x: len(x) >= 10 and len(x) <= 1000)
+    price = fields.Float(required=True, validate=lambda x: x > 0)
+    category = fields.Str(required=True, validate=lambda x: len(x) >= 2 and len(x) <= 50)
+    stock = fields.Int(required=True, validate=lambda x: x >= 0)
+    sku = fields.Str(required=True, validate=lambda x: len(x) >= 3 and len(x) <= 50)
+
+product_schema = ProductSchema()
+product_bulk_schema = ProductSchema(many=True)
+
+class ProductPatchSchema(ProductSchema):
+    id = fields.Str(required=True)
+
+    # Field errors in any item would otherwise skip this for the whole batch
+    @validates_schema(pass_original=True, skip_on_field_errors=False)
+    def validate_changes(self, data, original_data, **kwargs):
+        if isinstance(original_data, dict) and not set(original_data) & set(ProductSchema._declared_fields):
+            raise ValidationError('No fields to update')
+
+# Every product field is optional in a patch; only the id is required
+product_patch_bulk_schema = ProductPatchSchema(many=True, partial=tuple(ProductSchema._declared_fields))
+
+PRODUCTS_PAGE_DEFAULT = int(os.getenv('PRODUCTS_PAGE_DEFAULT', 50))
+PRODUCTS_PAGE_MAX = int(os.getenv('PRODUCTS_PAGE_MAX', 200))
+
+class ProductFilterSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    category = fields.Str()
+    min_price = fields.Float(validate=validate.Range(min=0))
+    max_price = fields.Float(validate=validate.Range(min=0))
+    in_stock = fields.Bool()
+    # Comma-separated subset of LISTABLE_FIELDS
+    projection = fields.Str(data_key='fields')
+
+    @validates('projection')
+    def validate_projection(self, value):
+        unknown = [field for field in value.split(',') if field not in LISTABLE_FIELDS]
+        if unknown:
+            raise ValidationError(f"Unknown fields: {', '.join(unknown)}; expected {', '.join(LISTABLE_FIELDS)}")
+
+    @post_load
+    def split_projection(self, data, **kwargs):
+        if 'projection' in data:
+            data['fields'] = sorted(set(data.pop('projection').split(',')), key=LISTABLE_FIELDS.index)
+        return data
+
+class ProductListQuerySchema(ProductFilterSchema):
+    limit = fields.Int(load_default=PRODUCTS_PAGE_DEFAULT, validate=validate.Range(min=1, max=PRODUCTS_PAGE_MAX))
+    cursor = fields.Str()
+
+class ProductExportQuerySchema(ProductFilterSchema):
+    format = fields.Str(load_default='ndjson', validate=validate.OneOf(EXPORT_FORMATS))
+
+product_list_query_schema = ProductListQuerySchema()
+product_export_query_schema = ProductExportQuerySchema()
+
+class ProductSearchQuerySchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    q = fields.Str(required=True, validate=validate.Length(min=1, max=200))
+    category = fields.Str()
+    min_price = fields.Float(validate=validate.Range(min=0))
+    max_price = fields.Float(validate=validate.Range(min=0))
+    limit = fields.Int(load_default=20, validate=validate.Range(min=1, max=100))
+    # Relevance-ranked, so deep pages are not worth a cursor
+    offset = fields.Int(load_default=0, validate=validate.Range(min=0, max=1000))
+
+class ProductAutocompleteQuerySchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    q = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+    limit = fields.Int(load_default=10, validate=validate.Range(min=1, max=50))
+
+product_search_query_schema = ProductSearchQuerySchema()
+product_autocomplete_query_schema = ProductAutocompleteQuerySchema()
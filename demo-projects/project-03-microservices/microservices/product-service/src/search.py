@@ -0,0 +1,521 @@
+"""Product search served from an in-memory inverted index.
+
+Each worker holds its own SearchIndex over product names and descriptions,
+plus a sorted list of SKUs. Text is lowercased and split on anything that is not a letter or digit.
+A search matches products containing every query token and ranks those with
+all of them in the name first, newest first within each group. Autocomplete
+matches a prefix against SKUs and name tokens through sorted vocabularies.
+Facets count the matches per category and price bucket.
+
+Products get dense internal numbers in load order, so postings are append-only
+arrays of those numbers: sorted for free, at four bytes an entry. A product
+whose text changes is re-added under a new number and the old one is marked
+dead; price and category changes are made in place.
+
+The index loads products oldest first, so number order is creation order
+for the loaded products, up to the first one out of order. MongoDB sorts
+the BSON Dates of seeded products after every string, so those can come
+last. Products past that point, and those added after the load, are ranked
+by the creation time kept for each number. An edited product therefore
+keeps its place instead of jumping to the front.
+
+SearchService builds the index from MongoDB in the background at startup and
+keeps it current: the product watcher (see watcher.py) publishes changed
+product IDs on Redis, and every worker reloads those products from MongoDB.
+Once dead entries outnumber live ones the index is rebuilt and swapped in.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime
+
+from pymongo import ASCENDING
+
+from .catalog import stored_datetime
+
+logger = logging.getLogger(__name__)
+
+SEARCH_ENABLED = os.getenv('PRODUCT_SEARCH_ENABLED', 'true').lower() == 'true'
+SEARCH_LOAD_BATCH_SIZE = int(os.getenv('PRODUCT_SEARCH_LOAD_BATCH_SIZE', 5000))
+SEARCH_RETRY_SECONDS = 5
+
+# Rebuild once dead entries outnumber live ones, and at least this many
+SEARCH_REBUILD_MIN_DEAD = 10_000
+
+# Name terms examined per autocomplete prefix
+AUTOCOMPLETE_MAX_TERMS = 50
+
+CHANGES_CHANNEL = 'products:changes'
+SEARCH_FIELDS = {
+    '_id': 0, 'id': 1, 'name': 1, 'description': 1, 'sku': 1, 'category': 1, 'price': 1, 'created_at': 1
+}
+# Oldest first, backwards along the listing index
+LOAD_ORDER = [('created_at', ASCENDING), ('id', ASCENDING)]
+EPOCH = datetime(1970, 1, 1)
+
+# Upper bounds of the price facet buckets; the last bucket is open-ended
+PRICE_BUCKETS = (25, 50, 100, 250, 500)
+PRICE_BUCKET_LABELS = tuple(
+    f"{lower}-{upper}" for lower, upper in zip((0, *PRICE_BUCKETS), PRICE_BUCKETS)
+) + (f"{PRICE_BUCKETS[-1]}+",)
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def created_seconds(product):
+    """created_at as seconds since the epoch; 0 if missing or malformed."""
+    created_at = stored_datetime(product.get('created_at'))
+    if created_at is None:
+        return 0.0
+    return (created_at - EPOCH).total_seconds()
+
+
+def _contains(postings, docno):
+    position = bisect_left(postings, docno)
+    return position < len(postings) and postings[position] == docno
+
+
+def _intersect(postings):
+    """Numbers in every one of `postings`, ascending."""
+    if not postings or any(p is None for p in postings):
+        return []
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for other in postings[1:]:
+        if len(result) * 16 < len(other):
+            # Few candidates: binary search the long list for each
+            result = [docno for docno in result if _contains(other, docno)]
+        else:
+            keep = set(result)
+            result = [docno for docno in other if docno in keep]
+    return result
+
+
+class SearchUnavailable(Exception):
+    """Raised while the search index has not finished loading."""
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Per internal number
+        self._ids = []
+        self._alive = bytearray()
+        self._fingerprints = array('q')
+        self._categories = array('H')
+        self._prices = array('d')
+        self._created = array('d')
+        # Category code and price bucket in one number, so both facets count in one pass
+        self._facets = array('I')
+        self._docnos = {}
+        self._category_names = []
+        self._category_codes = {}
+        # Token -> ascending internal numbers
+        self._postings = {}
+        self._name_postings = {}
+        # Sorted for prefix lookups; SKU entries of dead numbers stay until a rebuild
+        self._name_terms = []
+        self._sku_terms = []
+        self._sku_docnos = array('i')
+        # Numbers below this are in creation order
+        self._loaded = 0
+        self.dead = 0
+
+    def __len__(self):
+        return len(self._docnos)
+
+    def load(self, products, sort=True):
+        """Add products known to be new, oldest first, then sort the prefix
+        vocabularies once.
+
+        Loading in batches, pass sort=False for all but the last.
+        """
+        with self._lock:
+            created = self._created
+            for product in products:
+                docno = self._add(product, sort=False)
+                if self._loaded == docno and (docno == 0 or created[docno - 1] <= created[docno]):
+                    self._loaded += 1
+            if not sort:
+                return
+            self._name_terms = sorted(self._name_postings)
+            order = sorted(range(len(self._sku_terms)), key=self._sku_terms.__getitem__)
+            self._sku_terms = [self._sku_terms[i] for i in order]
+            self._sku_docnos = array('i', (self._sku_docnos[i] for i in order))
+
+    def upsert(self, product):
+        with self._lock:
+            docno = self._docnos.get(product['id'])
+            if docno is not None:
+                if self._fingerprints[docno] == self._fingerprint(product):
+                    self._set_attributes(docno, product)
+                    return
+                self._kill(docno)
+            self._add(product, sort=True)
+
+    def remove(self, product_id):
+        with self._lock:
+            docno = self._docnos.pop(product_id, None)
+            if docno is not None:
+                self._kill(docno)
+
+    def search(self, q, category=None, min_price=None, max_price=None, offset=0, limit=20):
+        """Return (product IDs for the page, total matches, facets).
+
+        Each facet ignores its own filter, so the category counts show what
+        choosing another category would return, and likewise for price.
+        """
+        tokens = list(dict.fromkeys(tokenize(q)))
+        with self._lock:
+            alive, categories, prices, facets = self._alive, self._categories, self._prices, self._facets
+            matches = _intersect([self._postings.get(token) for token in tokens])
+            if self.dead:
+                matches = [docno for docno in matches if alive[docno]]
+
+            in_price = matches
+            if min_price is not None or max_price is not None:
+                low = min_price if min_price is not None else float('-inf')
+                high = max_price if max_price is not None else float('inf')
+                in_price = [docno for docno in matches if low <= prices[docno] <= high]
+            in_category = matches
+            if category is not None:
+                code = self._category_codes.get(category)
+                in_category = [docno for docno in matches if categories[docno] == code]
+                results = [docno for docno in in_price if categories[docno] == code]
+            else:
+                results = in_price
+
+            by_category = Counter(map(facets.__getitem__, in_price))
+            by_price = by_category if in_category is in_price else Counter(map(facets.__getitem__, in_category))
+            category_counts, price_counts = Counter(), Counter()
+            for key, count in by_category.items():
+                category_counts[key // len(PRICE_BUCKET_LABELS)] += count
+            for key, count in by_price.items():
+                price_counts[key % len(PRICE_BUCKET_LABELS)] += count
+
+            # Only as far into the results as the page needs
+            name_postings = [self._name_postings.get(token) for token in tokens]
+            if any(postings is None for postings in name_postings):
+                name_postings = None
+
+            def in_name(docno):
+                return name_postings is not None and all(_contains(postings, docno) for postings in name_postings)
+
+            ranked = itertools.chain(
+                (docno for docno in self._newest_first(results) if in_name(docno)),
+                (docno for docno in self._newest_first(results) if not in_name(docno)),
+            )
+            page = [self._ids[docno] for docno in itertools.islice(ranked, offset, offset + limit)]
+            return page, len(results), {
+                'category': {self._category_names[code]: count for code, count in category_counts.most_common()},
+                'price': {PRICE_BUCKET_LABELS[bucket]: count for bucket, count in sorted(price_counts.items())},
+            }
+
+    def autocomplete(self, q, limit=10):
+        """Return IDs of products whose SKU starts with `q`, then of the newest
+        whose name has every earlier word of `q` and a word starting with the last."""
+        tokens = tokenize(q)
+        if not tokens:
+            return []
+        *words, prefix = tokens
+        with self._lock:
+            alive = self._alive
+            found = []
+
+            sku_prefix = q.strip().lower()
+            position = bisect_left(self._sku_terms, sku_prefix)
+            while len(found) < limit and position < len(self._sku_terms) and self._sku_terms[position].startswith(sku_prefix):
+                docno = self._sku_docnos[position]
+                if alive[docno]:
+                    found.append(docno)
+                position += 1
+
+            required = set(_intersect([self._name_postings.get(word) for word in words])) if words else None
+            if required is not None and not required:
+                return [self._ids[docno] for docno in found]
+            newest = []
+            start = bisect_left(self._name_terms, prefix)
+            for term in itertools.islice(self._name_terms, start, start + AUTOCOMPLETE_MAX_TERMS):
+                if not term.startswith(prefix):
+                    break
+                hits = (
+                    docno for docno in self._newest_first(self._name_postings[term])
+                    if alive[docno] and (required is None or docno in required)
+                )
+                newest.extend(itertools.islice(hits, limit))
+
+            seen = set(found)
+            for docno in heapq.nlargest(limit, set(newest), key=self._created.__getitem__):
+                if len(found) == limit:
+                    break
+                if docno not in seen:
+                    found.append(docno)
+            return [self._ids[docno] for docno in found]
+
+    def _newest_first(self, docnos):
+        """Iterate ascending `docnos` newest first, lazily for the loaded ones."""
+        split = bisect_left(docnos, self._loaded)
+        loaded = itertools.islice(reversed(docnos), len(docnos) - split, None)
+        if split == len(docnos):
+            return loaded
+        created = self._created.__getitem__
+        added = sorted(docnos[split:], key=created, reverse=True)
+        return heapq.merge(loaded, added, key=created, reverse=True)
+
+    @staticmethod
+    def _fingerprint(product):
+        return hash((product.get('name', ''), product.get('description', ''), product.get('sku', '')))
+
+    def _add(self, product, sort):
+        docno = len(self._ids)
+        self._ids.append(product['id'])
+        self._docnos[product['id']] = docno
+        self._alive.append(1)
+        self._fingerprints.append(self._fingerprint(product))
+        self._categories.append(0)
+        self._prices.append(0.0)
+        self._facets.append(0)
+        self._created.append(created_seconds(product))
+        self._set_attributes(docno, product)
+
+        sku = product.get('sku', '').lower()
+        name_tokens = set(tokenize(product.get('name', '')))
+        for token in name_tokens | set(tokenize(product.get('description', ''))):
+            self._postings.setdefault(token, array('i')).append(docno)
+        for token in name_tokens:
+            postings = self._name_postings.get(token)
+            if postings is None:
+                postings = self._name_postings[token] = array('i')
+                if sort:
+                    self._name_terms.insert(bisect_left(self._name_terms, token), token)
+            postings.append(docno)
+
+        if sku:
+            position = bisect_right(self._sku_terms, sku) if sort else len(self._sku_terms)
+            self._sku_terms.insert(position, sku)
+            self._sku_docnos.insert(position, docno)
+        return docno
+
+    def _set_attributes(self, docno, product):
+        category = product.get('category', '')
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self._category_names)
+            self._category_names.append(category)
+        price = float(product.get('price', 0))
+        self._categories[docno] = code
+        self._prices[docno] = price
+        self._facets[docno] = code * len(PRICE_BUCKET_LABELS) + bisect_right(PRICE_BUCKETS, price)
+
+    def _kill(self, docno):
+        self._alive[docno] = 0
+        self.dead += 1
+
+    def needs_rebuild(self):
+        return self.dead > max(len(self), SEARCH_REBUILD_MIN_DEAD)
+
+
+class SearchService:
+    """Builds a SearchIndex in a background thread and applies published changes."""
+
+    def __init__(self, collection, redis_client):
+        self.collection = collection
+        self.redis = redis_client
+        self.index = None
+
+    def start(self):
+        threading.Thread(target=self._run, name='search-index', daemon=True).start()
+
+    def publish(self, product_ids):
+        """Have every worker, this one included, reload `product_ids` from MongoDB."""
+        if not product_ids:
+            return
+        if self.redis:
+            self.redis.publish(CHANGES_CHANNEL, json.dumps(list(product_ids)))
+        else:
+            self.apply(product_ids)
+
+    def reload(self):
+        """Have every worker rebuild its index, for when changes may have been missed."""
+        if self.redis:
+            self.redis.publish(CHANGES_CHANNEL, json.dumps(None))
+        else:
+            self._rebuild()
+
+    def apply(self, product_ids):
+        index = self.index
+        if index is None:
+            return
+        found = set()
+        for product in self.collection.find({'id': {'$in': list(product_ids)}}, SEARCH_FIELDS):
+            index.upsert(product)
+            found.add(product['id'])
+        for product_id in set(product_ids) - found:
+            index.remove(product_id)
+
+    def search(self, **query):
+        return self._ready().search(**query)
+
+    def autocomplete(self, **query):
+        return self._ready().autocomplete(**query)
+
+    def _ready(self):
+        if self.index is None:
+            raise SearchUnavailable("Search index is loading")
+        return self.index
+
+    def _run(self):
+        while True:
+            pubsub = None
+            try:
+                # Subscribe before loading so no change made during the load is missed
+                if self.redis:
+                    pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(CHANGES_CHANNEL)
+                self._rebuild()
+                if pubsub is None:
+                    logger.warning("Redis not available; search only sees this worker's writes")
+                    return
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message:
+                        self._receive(json.loads(message['data']))
+                    if self.index.needs_rebuild():
+                        self._rebuild()
+            except Exception as e:
+                # Changes published while disconnected are lost, so start over
+                logger.error(f"Search index sync failed, reloading: {e}")
+                time.sleep(SEARCH_RETRY_SECONDS)
+            finally:
+                if pubsub is not None:
+                    pubsub.close()
+
+    def _receive(self, product_ids):
+        # See reload()
+        if product_ids is None:
+            self._rebuild()
+        else:
+            self.apply(product_ids)
+
+    def _rebuild(self):
+        started = time.monotonic()
+        index = SearchIndex()
+        index.load(self.collection.find({}, SEARCH_FIELDS).sort(LOAD_ORDER).batch_size(SEARCH_LOAD_BATCH_SIZE))
+        self.index = index
+        logger.info(f"Search index loaded {len(index)} products in {time.monotonic() - started:.1f}s")
+
+
+class AsyncSearchService(SearchService):
+    """SearchService for a Motor collection and a redis.asyncio client.
+
+    Searches run in a thread so a large match set does not stall the event loop.
+    """
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def publish(self, product_ids):
+        if not product_ids:
+            return
+        if self.redis:
+            await self.redis.publish(CHANGES_CHANNEL, json.dumps(list(product_ids)))
+        else:
+            await self.apply(product_ids)
+
+    async def apply(self, product_ids):
+        index = self.index
+        if index is None:
+            return
+        found = set()
+        async for product in self.collection.find({'id': {'$in': list(product_ids)}}, SEARCH_FIELDS):
+            index.upsert(product)
+            found.add(product['id'])
+        for product_id in set(product_ids) - found:
+            index.remove(product_id)
+
+    async def reload(self):
+        if self.redis:
+            await self.redis.publish(CHANGES_CHANNEL, json.dumps(None))
+        else:
+            await self._rebuild()
+
+    async def search(self, **query):
+        index = self._ready()
+        return await asyncio.to_thread(lambda: index.search(**query))
+
+    async def autocomplete(self, **query):
+        index = self._ready()
+        return await asyncio.to_thread(lambda: index.autocomplete(**query))
+
+    async def _run(self):
+        while True:
+            pubsub = None
+            try:
+                if self.redis:
+                    pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                    await pubsub.subscribe(CHANGES_CHANNEL)
+                await self._rebuild()
+                if pubsub is None:
+                    logger.warning("Redis not available; search only sees this worker's writes")
+                    return
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message:
+                        await self._receive(json.loads(message['data']))
+                    if self.index.needs_rebuild():
+                        await self._rebuild()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Search index sync failed, reloading: {e}")
+                await asyncio.sleep(SEARCH_RETRY_SECONDS)
+            finally:
+                if pubsub is not None:
+                    await pubsub.aclose()
+
+    async def _receive(self, product_ids):
+        if product_ids is None:
+            await self._rebuild()
+        else:
+            await self.apply(product_ids)
+
+    async def _rebuild(self):
+        started = time.monotonic()
+        index = SearchIndex()
+        # Loaded a batch at a time so requests are served in between
+        cursor = self.collection.find({}, SEARCH_FIELDS).sort(LOAD_ORDER).batch_size(SEARCH_LOAD_BATCH_SIZE)
+        batch = []
+        async for product in cursor:
+            batch.append(product)
+            if len(batch) == SEARCH_LOAD_BATCH_SIZE:
+                index.load(batch, sort=False)
+                batch = []
+        index.load(batch)
+        self.index = index
+        logger.info(f"Search index loaded {len(index)} products in {time.monotonic() - started:.1f}s")
+
+
+def in_order(documents, product_ids):
+    """`documents` sorted to follow `product_ids`, skipping any since deleted."""
+    by_id = {document['id']: document for document in documents}
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
@@ -0,0 +1,547 @@
+"""Keep cached products, listing pages and search indexes in step with MongoDB.
+
+Every write to the products collection, whether from this service or from
+another job, reaches ProductWatcher. It writes the new version of the
+product through to its cache entry (or deletes the entry), marks stale the
+listing pages of the categories the product left and joined, and publishes
+the product ID so every worker's search index reloads it. Write routes keep
+only their own product's cache entry current, so the writer reads its own
+write at once.
+
+One worker per deployment watches, holding a lease in Redis that it renews
+while it works. The others wait to take over.
+
+On a replica set the watcher reads the collection's change stream. MongoDB
+is asked for pre-images, which say which category an updated or deleted
+product left. Without one, a delete carries only the document's _id, so the
+watcher also keeps each product's id by _id. A change it still cannot tie
+to a product drops everything cached. The resume token is saved in MongoDB
+after each batch, so a restarted or newly elected watcher carries on where
+the last one stopped. If there is no usable token, everything cached is
+dropped first, because changes may have been missed.
+
+A standalone server has no change streams, so the watcher polls for
+products whose updated_at has advanced instead, as the write routes set it.
+It remembers each product's category to tell moves and deletions apart, and
+notices deletions when the collection shrinks. It starts by dropping
+everything cached. This is meant for development and test setups.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from .catalog import (
+    PRODUCT_TTL, PRODUCTS_GENERATION_KEY, cache_serializer, category_generation_key, product_cache_key,
+    stored_datetime, write_tag_keys
+)
+
+logger = logging.getLogger(__name__)
+
+# auto uses the change stream where the server supports one
+WATCH_MODE = os.getenv('PRODUCT_WATCH_MODE', 'auto')
+WATCH_POLL_INTERVAL = float(os.getenv('PRODUCT_WATCH_POLL_INTERVAL', 1.0))
+WATCH_BATCH_SIZE = 500
+# Longest a change waits for others to share its Redis round trip
+WATCH_MAX_AWAIT_MS = 100
+# Idle streams still advance their token; it is saved at most this often
+WATCH_SAVE_INTERVAL = 10
+
+LEASE_KEY = 'products:watcher'
+LEASE_MS = 15_000
+LEASE_RENEW_SECONDS = 5
+
+# Polls re-read this far behind the newest updated_at seen, for writes from
+# servers whose clocks lag or that committed late
+POLL_OVERLAP = timedelta(seconds=5)
+POLL_INDEXES = [IndexModel([('updated_at', ASCENDING)], name='updated_at')]
+
+STATE_ID = 'products'
+STREAM_OPTIONS = {
+    'full_document': 'updateLookup',
+    'full_document_before_change': 'whenAvailable',
+    'max_await_time_ms': WATCH_MAX_AWAIT_MS,
+    'batch_size': WATCH_BATCH_SIZE,
+}
+NOT_REPLICA_SET = 40573
+# InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost
+RESUME_ERRORS = {260, 280, 286}
+# The stream ends after these; the next one starts from scratch
+ENDING_EVENTS = {'drop', 'rename', 'dropDatabase', 'invalidate'}
+
+# A change whose previous category is unknown could have left any listing
+UNKNOWN = object()
+
+
+def _product(document):
+    if document is None:
+        return None
+    return {field: value for field, value in document.items() if field != '_id'}
+
+
+def change_from_event(event):
+    """Return (product_id, before, after) for a change stream event.
+
+    before is UNKNOWN when MongoDB kept no pre-image and the product may
+    have changed category; product_id is None when neither version is in
+    the event (see ProductIds).
+    """
+    before = _product(event.get('fullDocumentBeforeChange'))
+    after = None if event['operationType'] == 'delete' else _product(event.get('fullDocument'))
+    known = after or before
+    if before is None and event['operationType'] != 'insert':
+        updated = event.get('updateDescription', {}).get('updatedFields', {})
+        if event['operationType'] != 'update' or 'category' in updated or after is None:
+            before = UNKNOWN
+    return (known['id'] if known else None), before, after
+
+
+class ProductIds:
+    """Each product's id by its MongoDB _id, for events that carry neither version."""
+
+    def __init__(self, products):
+        self.ids = {product['_id']: product['id'] for product in products}
+
+    def resolve(self, event, change):
+        """`change` with its product_id filled in from earlier events, if need be."""
+        product_id, before, after = change
+        key = event['documentKey']['_id']
+        if event['operationType'] == 'delete':
+            known = self.ids.pop(key, None)
+        else:
+            known = self.ids.get(key)
+            if product_id is not None:
+                self.ids[key] = product_id
+        return product_id if product_id is not None else known, before, after
+
+
+class PollState:
+    """What polling has seen: each product's category and latest updated_at.
+
+    updated_at is kept as a datetime, as seeded products hold BSON Dates and
+    written ones ISO strings.
+    """
+
+    def __init__(self, products, started):
+        self.categories = {}
+        self.recent = {}
+        self.watermark = started
+        for product in products:
+            self.categories[product['id']] = product.get('category')
+            self.recent[product['id']] = stored_datetime(product.get('updated_at'))
+        self.prune()
+
+    def since(self):
+        return self.watermark - POLL_OVERLAP
+
+    def changed(self):
+        """Filter for products updated since(), whichever type updated_at has."""
+        since = self.since()
+        return {'$or': [{'updated_at': {'$gte': since.isoformat()}}, {'updated_at': {'$gte': since}}]}
+
+    def observe(self, product):
+        """The change `product` represents, or None if it was already seen."""
+        product_id, updated_at = product['id'], stored_datetime(product.get('updated_at'))
+        if self.recent.get(product_id) == updated_at:
+            return None
+        self.recent[product_id] = updated_at
+        if updated_at is not None:
+            self.watermark = max(self.watermark, updated_at)
+        before = {'category': self.categories[product_id]} if product_id in self.categories else None
+        self.categories[product_id] = product.get('category')
+        return product_id, before, product
+
+    def removed(self, live_ids):
+        return [
+            (product_id, {'category': self.categories.pop(product_id)}, None)
+            for product_id in set(self.categories) - live_ids
+        ]
+
+    def prune(self):
+        since = self.since()
+        self.recent = {product_id: updated_at for product_id, updated_at in self.recent.items() if updated_at and updated_at >= since}
+
+
+class ProductWatcher:
+    def __init__(self, collection, state, redis_client, search_service=None):
+        self.collection = collection
+        # Holds the saved resume token
+        self.state = state
+        self.redis = redis_client
+        self.search = search_service
+        self._lease = uuid.uuid4().hex
+        self._renewed = 0.0
+
+    def start(self):
+        threading.Thread(target=self._run, name='product-watcher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                if self._acquire():
+                    self._watch()
+            except Exception as e:
+                logger.error(f"Product watcher failed: {e}")
+            time.sleep(LEASE_RENEW_SECONDS)
+
+    def _acquire(self):
+        # Without Redis there is nothing shared to keep current, so each
+        # worker watches for its own search index
+        if self.redis is None:
+            return True
+        if self.redis.set(LEASE_KEY, self._lease, nx=True, px=LEASE_MS):
+            logger.info("Product watcher took the lease")
+        elif self.redis.get(LEASE_KEY) == self._lease.encode():
+            # Still ours after a failure
+            self.redis.pexpire(LEASE_KEY, LEASE_MS)
+        else:
+            return False
+        self._renewed = time.monotonic()
+        return True
+
+    def _leading(self):
+        if self.redis is None or time.monotonic() - self._renewed < LEASE_RENEW_SECONDS:
+            return True
+        # Not atomic; two watchers overlapping briefly only repeat invalidations
+        if self.redis.get(LEASE_KEY) != self._lease.encode():
+            logger.warning("Product watcher lost the lease")
+            return False
+        self.redis.pexpire(LEASE_KEY, LEASE_MS)
+        self._renewed = time.monotonic()
+        return True
+
+    def _watch(self):
+        if WATCH_MODE != 'poll':
+            try:
+                return self._stream()
+            except OperationFailure as e:
+                if e.code != NOT_REPLICA_SET or WATCH_MODE == 'stream':
+                    raise
+                logger.warning("MongoDB is not a replica set; watching products by polling updated_at")
+        self._poll()
+
+    def _stream(self):
+        self._enable_pre_images()
+        token = self._saved_token()
+        try:
+            with self.collection.watch(start_after=token, **STREAM_OPTIONS) as stream:
+                # Opened first, so nothing written during the scan or resync is missed
+                product_ids = ProductIds(self.collection.find({}, {'_id': 1, 'id': 1}))
+                if token:
+                    logger.info("Product watcher resumed from saved token")
+                else:
+                    self._resync()
+                saved, saved_at = token, time.monotonic()
+                while self._leading():
+                    changes, ended = [], False
+                    while len(changes) < WATCH_BATCH_SIZE:
+                        event = stream.try_next()
+                        if event is None:
+                            break
+                        if event['operationType'] in ENDING_EVENTS:
+                            ended = True
+                            break
+                        changes.append(product_ids.resolve(event, change_from_event(event)))
+                    if changes:
+                        self._apply(changes)
+                    if ended:
+                        logger.warning("Products change stream ended; starting over")
+                        self._save_token(None)
+                        return
+                    if stream.resume_token != saved and (changes or time.monotonic() - saved_at > WATCH_SAVE_INTERVAL):
+                        saved, saved_at = stream.resume_token, time.monotonic()
+                        self._save_token(saved)
+        except OperationFailure as e:
+            if e.code not in RESUME_ERRORS:
+                raise
+            # Fell too far behind the oplog to resume; the next attempt resyncs
+            logger.warning(f"Products change stream cannot resume, starting over: {e}")
+            self._save_token(None)
+
+    def _poll(self):
+        self.collection.create_indexes(POLL_INDEXES)
+        started = datetime.utcnow()
+        state = PollState(self.collection.find({}, {'_id': 0, 'id': 1, 'category': 1, 'updated_at': 1}), started)
+        self._resync()
+        while self._leading():
+            products = self.collection.find(state.changed(), {'_id': 0})
+            changes = [change for change in map(state.observe, products) if change]
+            if self.collection.count_documents({}) < len(state.categories):
+                changes += state.removed({product['id'] for product in self.collection.find({}, {'_id': 0, 'id': 1})})
+            if changes:
+                self._apply(changes)
+            state.prune()
+            time.sleep(WATCH_POLL_INTERVAL)
+
+    def _apply(self, changes):
+        if any(product_id is None for product_id, _, _ in changes):
+            # A product changed but which one is unknown
+            logger.warning("Product watcher saw a change it cannot tie to a product")
+            return self._resync()
+        if self.redis:
+            pipeline = self.redis.pipeline(transaction=False)
+            categories, everywhere = set(), False
+            for product_id, before, after in changes:
+                if after is not None:
+                    pipeline.setex(product_cache_key(product_id), PRODUCT_TTL, cache_serializer.dumps(after))
+                else:
+                    pipeline.delete(product_cache_key(product_id))
+                everywhere = everywhere or before is UNKNOWN
+                categories.update(document.get('category') for document in (before, after) if isinstance(document, dict))
+            for tag in write_tag_keys(*categories):
+                pipeline.incr(tag)
+            pipeline.execute()
+            if everywhere:
+                self._invalidate_all_listings()
+        if self.search:
+            self.search.publish([product_id for product_id, _, _ in changes])
+        logger.info(f"Product watcher applied {len(changes)} changes")
+
+    def _resync(self):
+        logger.info("Product watcher dropping cached products and listings")
+        if self.redis:
+            self._delete_matching(product_cache_key('*'))
+            self._invalidate_all_listings()
+        if self.search:
+            self.search.reload()
+
+    def _invalidate_all_listings(self):
+        # Pages of a category never written to carry no tag to bump
+        self._delete_matching(cache_serializer.cache_key('products', 'page', '*'))
+        tags = [PRODUCTS_GENERATION_KEY, *self.redis.scan_iter(match=category_generation_key('*'), count=1000)]
+        pipeline = self.redis.pipeline(transaction=False)
+        for tag in tags:
+            pipeline.incr(tag)
+        pipeline.execute()
+
+    def _delete_matching(self, pattern):
+        batch = []
+        for key in self.redis.scan_iter(match=pattern, count=1000):
+            batch.append(key)
+            if len(batch) == 1000:
+                self.redis.delete(*batch)
+                batch = []
+        if batch:
+            self.redis.delete(*batch)
+
+    def _enable_pre_images(self):
+        try:
+            self.collection.database.command(
+                'collMod', self.collection.name, changeStreamPreAndPostImages={'enabled': True}
+            )
+        except OperationFailure as e:
+            logger.warning(f"No change stream pre-images; deletes and category moves will invalidate every listing: {e}")
+
+    def _saved_token(self):
+        # Without the lease several watchers could overwrite each other's token
+        if self.redis is None:
+            return None
+        state = self.state.find_one({'_id': STATE_ID})
+        return state and state.get('resume_token')
+
+    def _save_token(self, token):
+        if self.redis is None:
+            return
+        self.state.update_one(
+            {'_id': STATE_ID},
+            {'$set': {'resume_token': token, 'saved_at': datetime.utcnow().isoformat()}},
+            upsert=True
+        )
+
+
+class AsyncProductWatcher(ProductWatcher):
+    """ProductWatcher for a Motor collection and a redis.asyncio client."""
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        # Let another worker take over without waiting out the lease
+        if self.redis and await self.redis.get(LEASE_KEY) == self._lease.encode():
+            await self.redis.delete(LEASE_KEY)
+
+    async def _run(self):
+        while True:
+            try:
+                if await self._acquire():
+                    await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Product watcher failed: {e}")
+            await asyncio.sleep(LEASE_RENEW_SECONDS)
+
+    async def _acquire(self):
+        if self.redis is None:
+            return True
+        if await self.redis.set(LEASE_KEY, self._lease, nx=True, px=LEASE_MS):
+            logger.info("Product watcher took the lease")
+        elif await self.redis.get(LEASE_KEY) == self._lease.encode():
+            await self.redis.pexpire(LEASE_KEY, LEASE_MS)
+        else:
+            return False
+        self._renewed = time.monotonic()
+        return True
+
+    async def _leading(self):
+        if self.redis is None or time.monotonic() - self._renewed < LEASE_RENEW_SECONDS:
+            return True
+        if await self.redis.get(LEASE_KEY) != self._lease.encode():
+            logger.warning("Product watcher lost the lease")
+            return False
+        await self.redis.pexpire(LEASE_KEY, LEASE_MS)
+        self._renewed = time.monotonic()
+        return True
+
+    async def _watch(self):
+        if WATCH_MODE != 'poll':
+            try:
+                return await self._stream()
+            except OperationFailure as e:
+                if e.code != NOT_REPLICA_SET or WATCH_MODE == 'stream':
+                    raise
+                logger.warning("MongoDB is not a replica set; watching products by polling updated_at")
+        await self._poll()
+
+    async def _stream(self):
+        await self._enable_pre_images()
+        token = await self._saved_token()
+        try:
+            # Motor opens the stream on entering the block
+            async with self.collection.watch(start_after=token, **STREAM_OPTIONS) as stream:
+                cursor = self.collection.find({}, {'_id': 1, 'id': 1})
+                product_ids = ProductIds([product async for product in cursor])
+                if token:
+                    logger.info("Product watcher resumed from saved token")
+                else:
+                    await self._resync()
+                saved, saved_at = token, time.monotonic()
+                while await self._leading():
+                    changes, ended = [], False
+                    while len(changes) < WATCH_BATCH_SIZE:
+                        event = await stream.try_next()
+                        if event is None:
+                            break
+                        if event['operationType'] in ENDING_EVENTS:
+                            ended = True
+                            break
+                        changes.append(product_ids.resolve(event, change_from_event(event)))
+                    if changes:
+                        await self._apply(changes)
+                    if ended:
+                        logger.warning("Products change stream ended; starting over")
+                        await self._save_token(None)
+                        return
+                    if stream.resume_token != saved and (changes or time.monotonic() - saved_at > WATCH_SAVE_INTERVAL):
+                        saved, saved_at = stream.resume_token, time.monotonic()
+                        await self._save_token(saved)
+        except OperationFailure as e:
+            if e.code not in RESUME_ERRORS:
+                raise
+            logger.warning(f"Products change stream cannot resume, starting over: {e}")
+            await self._save_token(None)
+
+    async def _poll(self):
+        await self.collection.create_indexes(POLL_INDEXES)
+        started = datetime.utcnow()
+        cursor = self.collection.find({}, {'_id': 0, 'id': 1, 'category': 1, 'updated_at': 1})
+        state = PollState([product async for product in cursor], started)
+        await self._resync()
+        while await self._leading():
+            changes = []
+            async for product in self.collection.find(state.changed(), {'_id': 0}):
+                change = state.observe(product)
+                if change:
+                    changes.append(change)
+            if await self.collection.count_documents({}) < len(state.categories):
+                live = {product['id'] async for product in self.collection.find({}, {'_id': 0, 'id': 1})}
+                changes += state.removed(live)
+            if changes:
+                await self._apply(changes)
+            state.prune()
+            await asyncio.sleep(WATCH_POLL_INTERVAL)
+
+    async def _apply(self, changes):
+        if any(product_id is None for product_id, _, _ in changes):
+            logger.warning("Product watcher saw a change it cannot tie to a product")
+            return await self._resync()
+        if self.redis:
+            pipeline = self.redis.pipeline(transaction=False)
+            categories, everywhere = set(), False
+            for product_id, before, after in changes:
+                if after is not None:
+                    pipeline.setex(product_cache_key(product_id), PRODUCT_TTL, cache_serializer.dumps(after))
+                else:
+                    pipeline.delete(product_cache_key(product_id))
+                everywhere = everywhere or before is UNKNOWN
+                categories.update(document.get('category') for document in (before, after) if isinstance(document, dict))
+            for tag in write_tag_keys(*categories):
+                pipeline.incr(tag)
+            await pipeline.execute()
+            if everywhere:
+                await self._invalidate_all_listings()
+        if self.search:
+            await self.search.publish([product_id for product_id, _, _ in changes])
+        logger.info(f"Product watcher applied {len(changes)} changes")
+
+    async def _resync(self):
+        logger.info("Product watcher dropping cached products and listings")
+        if self.redis:
+            await self._delete_matching(product_cache_key('*'))
+            await self._invalidate_all_listings()
+        if self.search:
+            await self.search.reload()
+
+    async def _invalidate_all_listings(self):
+        await self._delete_matching(cache_serializer.cache_key('products', 'page', '*'))
+        tags = [PRODUCTS_GENERATION_KEY]
+        async for tag in self.redis.scan_iter(match=category_generation_key('*'), count=1000):
+            tags.append(tag)
+        pipeline = self.redis.pipeline(transaction=False)
+        for tag in tags:
+            pipeline.incr(tag)
+        await pipeline.execute()
+
+    async def _delete_matching(self, pattern):
+        batch = []
+        async for key in self.redis.scan_iter(match=pattern, count=1000):
+            batch.append(key)
+            if len(batch) == 1000:
+                await self.redis.delete(*batch)
+                batch = []
+        if batch:
+            await self.redis.delete(*batch)
+
+    async def _enable_pre_images(self):
+        try:
+            await self.collection.database.command(
+                'collMod', self.collection.name, changeStreamPreAndPostImages={'enabled': True}
+            )
+        except OperationFailure as e:
+            logger.warning(f"No change stream pre-images; deletes and category moves will invalidate every listing: {e}")
+
+    async def _saved_token(self):
+        if self.redis is None:
+            return None
+        state = await self.state.find_one({'_id': STATE_ID})
+        return state and state.get('resume_token')
+
+    async def _save_token(self, token):
+        if self.redis is None:
+            return
+        await self.state.update_one(
+            {'_id': STATE_ID},
+            {'$set': {'resume_token': token, 'saved_at': datetime.utcnow().isoformat()}},
+            upsert=True
+        )
@@ -0,0 +1,37 @@
+import base64
+from datetime import datetime
+
+import pytest
+
+from src.listing import CursorError, decode_cursor, encode_cursor, fetch_page
+
+
+@pytest.mark.parametrize('created_at', [datetime(2024, 5, 1, 12, 30, 15, 250000), '2024-05-01T12:30:15.250000'])
+def test_cursor_round_trip(created_at):
+    assert decode_cursor(encode_cursor({'created_at': created_at, 'id': '42'})) == (created_at, '42')
+
+
+@pytest.mark.parametrize('raw', ['2024-05-01T12:30:15|42', 'date|yesterday|42', 'int|7|42'])
+def test_malformed_cursor_is_rejected(raw):
+    with pytest.raises(CursorError):
+        decode_cursor(base64.urlsafe_b64encode(raw.encode()).decode())
+
+
+def test_pages_cross_from_dates_to_strings():
+    mongomock = pytest.importorskip('mongomock')
+    collection = mongomock.MongoClient().db.products
+    # Seeded Dates and app-written strings; MongoDB lists the Dates first
+    collection.insert_many([
+        {'id': '1', 'created_at': datetime(2024, 1, 1)},
+        {'id': '2', 'created_at': datetime(2024, 1, 2)},
+        {'id': '3', 'created_at': datetime(2024, 1, 2)},
+        {'id': '4', 'created_at': '2025-01-01T00:00:00'},
+        {'id': '5', 'created_at': '2025-01-02T00:00:00'},
+    ])
+    seen, cursor = [], None
+    while True:
+        products, cursor = fetch_page(collection, {'limit': 2, 'fields': ['id'], 'cursor': cursor})
+        seen += [product['id'] for product in products]
+        if cursor is None:
+            break
+    assert seen == ['3', '2', '1', '5', '4']
@@ -0,0 +1,125 @@
+from datetime import datetime
+
+from src import search as search_module
+from src.search import SearchIndex, _intersect, created_seconds, tokenize
+
+
+def product(product_id, name, created_at, description='', category='home', price=10.0, sku=None):
+    return {
+        'id': product_id, 'name': name, 'description': description, 'category': category, 'price': price,
+        'sku': sku or f"SKU-{product_id}", 'created_at': created_at,
+    }
+
+
+def day(n):
+    return f"2024-01-{n:02d}T00:00:00"
+
+
+def test_tokenize_splits_on_non_alphanumerics():
+    assert tokenize("Red_Lamp, 40W!") == ['red', 'lamp', '40w']
+
+
+def test_intersect():
+    assert _intersect([[1, 3, 5, 7], [3, 4, 5], [0, 3, 5, 9]]) == [3, 5]
+    # Lopsided lengths take the binary search path
+    assert _intersect([[40], list(range(0, 1000, 2))]) == [40]
+    assert _intersect([[1, 2], None]) == []
+    assert _intersect([]) == []
+
+
+def test_created_seconds_reads_strings_and_dates():
+    assert created_seconds({'created_at': '1970-01-02T00:00:00'}) == 86400.0
+    assert created_seconds({'created_at': '1970-01-02T01:00:00+01:00'}) == 86400.0
+    # Seeded by init-mongodb.js as a BSON Date
+    assert created_seconds({'created_at': datetime(1970, 1, 2)}) == 86400.0
+    assert created_seconds({'created_at': 'yesterday'}) == 0.0
+    assert created_seconds({}) == 0.0
+
+
+def test_search_ranks_name_matches_first_then_newest():
+    index = SearchIndex()
+    index.load([
+        product('1', 'Desk lamp', day(1)),
+        product('2', 'Shade', day(2), description='fits any lamp'),
+        product('3', 'Floor lamp', day(3)),
+        product('4', 'Chair', day(4)),
+    ])
+    ids, total, _ = index.search('lamp')
+    assert (ids, total) == (['3', '1', '2'], 3)
+    assert index.search('lamp', offset=1, limit=1)[0] == ['1']
+    assert index.search('desk lamp')[0] == ['1']
+    assert index.search('lamp unicorn') == ([], 0, {'category': {}, 'price': {}})
+
+
+def test_seeded_dates_rank_by_creation_time():
+    index = SearchIndex()
+    # The load order MongoDB gives: every string created_at before every Date
+    index.load([
+        product('3', 'Lamp', day(3)),
+        product('4', 'Lamp', day(4)),
+        product('1', 'Lamp', datetime(2024, 1, 1)),
+        product('2', 'Lamp', datetime(2024, 1, 2)),
+    ])
+    index.upsert(product('5', 'Lamp', day(5)))
+    assert index.search('lamp')[0] == ['5', '4', '3', '2', '1']
+    assert index.autocomplete('la', limit=3) == ['5', '4', '3']
+
+
+def test_facets_ignore_their_own_filter():
+    index = SearchIndex()
+    index.load([
+        product('1', 'Lamp', day(1), category='home', price=20),
+        product('2', 'Lamp', day(2), category='home', price=120),
+        product('3', 'Lamp', day(3), category='garden', price=30),
+    ])
+    ids, total, facets = index.search('lamp', category='home', max_price=50)
+    assert (ids, total) == (['1'], 1)
+    assert facets['category'] == {'home': 1, 'garden': 1}
+    assert facets['price'] == {'0-25': 1, '100-250': 1}
+
+
+def test_upsert_and_remove():
+    index = SearchIndex()
+    index.load([product('1', 'Desk lamp', day(1)), product('2', 'Chair', day(2))])
+
+    # Price and category change in place
+    index.upsert(product('1', 'Desk lamp', day(1), category='office', price=99))
+    assert index.dead == 0
+    assert index.search('lamp', category='office')[0] == ['1']
+
+    # A text change re-adds the product under a new number, in its old place
+    index.upsert(product('1', 'Desk light', day(1)))
+    assert index.dead == 1
+    assert index.search('lamp')[0] == []
+    assert index.search('light')[0] == ['1']
+    assert index.search('desk')[0] == ['1']
+
+    index.remove('2')
+    assert index.search('chair')[0] == []
+    assert len(index) == 1
+
+
+def test_needs_rebuild_once_dead_outnumber_live(monkeypatch):
+    monkeypatch.setattr(search_module, 'SEARCH_REBUILD_MIN_DEAD', 1)
+    index = SearchIndex()
+    index.load([product('1', 'Lamp', day(1)), product('2', 'Chair', day(2))])
+    index.upsert(product('1', 'Light', day(1)))
+    index.upsert(product('2', 'Stool', day(2)))
+    assert not index.needs_rebuild()
+    index.remove('2')
+    assert index.needs_rebuild()
+
+
+def test_autocomplete_prefers_skus_then_newest_names():
+    index = SearchIndex()
+    index.load([
+        product('1', 'Lamp shade', day(1), sku='LAM-001'),
+        product('2', 'Lamp base', day(2)),
+        product('3', 'Large lamp', day(3)),
+        product('4', 'Red lamp', day(4)),
+    ])
+    assert index.autocomplete('lam') == ['1', '4', '3', '2']
+    assert index.autocomplete('red la') == ['4']
+    assert index.autocomplete('lam', limit=2) == ['1', '4']
+    index.remove('1')
+    assert index.autocomplete('lam') == ['4', '3', '2']
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+from bson import ObjectId
+
+from src import watcher as watcher_module
+from src.catalog import product_cache_key
+from src.watcher import UNKNOWN, PollState, ProductIds, ProductWatcher, change_from_event
+
+PRODUCT = {'_id': ObjectId(), 'id': '7', 'name': 'Lamp', 'category': 'home'}
+
+
+class FakeStream:
+    def __init__(self, events):
+        self.events = list(events)
+        self.resume_token = {'_data': 'after'}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def try_next(self):
+        return self.events.pop(0) if self.events else None
+
+
+def stream_once(products, events):
+    """Run one pass of the change stream loop over `events`."""
+    collection = MagicMock()
+    collection.find.return_value = products
+    collection.watch.return_value = FakeStream(events)
+    state = MagicMock()
+    state.find_one.return_value = {'resume_token': {'_data': 'before'}}
+    watcher = ProductWatcher(collection, state, MagicMock(), MagicMock())
+    watcher._leading = iter([True, False]).__next__
+    watcher._stream()
+    return watcher
+
+
+def delete_event(_id):
+    # What MongoDB sends for a delete when it kept no pre-image
+    return {'operationType': 'delete', 'documentKey': {'_id': _id}}
+
+
+def test_delete_without_pre_image_has_no_product_id():
+    product_id, before, after = change_from_event(delete_event(PRODUCT['_id']))
+    assert (product_id, before, after) == (None, UNKNOWN, None)
+
+
+def test_delete_without_pre_image_resolves_id_by_document_key():
+    ids = ProductIds([{'_id': PRODUCT['_id'], 'id': '7'}])
+    event = delete_event(PRODUCT['_id'])
+    assert ids.resolve(event, change_from_event(event)) == ('7', UNKNOWN, None)
+    assert PRODUCT['_id'] not in ids.ids
+
+
+def test_inserted_product_can_be_deleted_without_pre_image():
+    ids = ProductIds([])
+    insert = {'operationType': 'insert', 'documentKey': {'_id': PRODUCT['_id']}, 'fullDocument': PRODUCT}
+    ids.resolve(insert, change_from_event(insert))
+    event = delete_event(PRODUCT['_id'])
+    assert ids.resolve(event, change_from_event(event))[0] == '7'
+
+
+def test_stream_drops_product_deleted_without_pre_image():
+    watcher = stream_once([{'_id': PRODUCT['_id'], 'id': '7'}], [delete_event(PRODUCT['_id'])])
+    pipeline = watcher.redis.pipeline.return_value
+    pipeline.delete.assert_called_once_with(product_cache_key('7'))
+    watcher.search.publish.assert_called_once_with(['7'])
+    watcher.search.reload.assert_not_called()
+
+
+def test_stream_resyncs_on_delete_it_cannot_resolve():
+    watcher = stream_once([], [delete_event(ObjectId())])
+    watcher.search.publish.assert_not_called()
+    watcher.search.reload.assert_called_once_with()
+
+
+def test_poll_state_accepts_date_and_string_updated_at():
+    started = datetime(2024, 5, 1, 12, 0)
+    # Seeded by init-mongodb.js as a BSON Date, which pymongo reads as a datetime
+    seeded = {'id': '1', 'category': 'home', 'updated_at': started - timedelta(seconds=1)}
+    written = {'id': '2', 'category': 'toys', 'updated_at': (started - timedelta(seconds=2)).isoformat()}
+    state = PollState([seeded, written], started)
+    assert state.recent == {'1': seeded['updated_at'], '2': seeded['updated_at'] - timedelta(seconds=1)}
+
+    assert state.observe(seeded) is None
+    assert state.observe(written) is None
+    moved = {**seeded, 'category': 'garden', 'updated_at': started + timedelta(seconds=1)}
+    assert state.observe(moved) == ('1', {'category': 'home'}, moved)
+    assert state.watermark == moved['updated_at']
+    state.prune()
+
+
+def test_poll_applies_change_to_date_typed_product(monkeypatch):
+    monkeypatch.setattr(watcher_module, 'WATCH_POLL_INTERVAL', 0)
+    seeded = {'id': '1', 'category': 'home', 'updated_at': datetime.utcnow()}
+    edited = {**seeded, 'name': 'Lamp', 'updated_at': seeded['updated_at'] + timedelta(seconds=1)}
+    collection = MagicMock()
+    collection.find.side_effect = [[seeded], [seeded, edited]]
+    collection.count_documents.return_value = 1
+    watcher = ProductWatcher(collection, MagicMock(), MagicMock(), MagicMock())
+    watcher._leading = iter([True, False]).__next__
+    watcher._poll()
+
+    changed = collection.find.call_args_list[1].args[0]
+    # Seeded Dates only match a Date bound
+    assert any(isinstance(branch['updated_at']['$gte'], datetime) for branch in changed['$or'])
+    pipeline = watcher.redis.pipeline.return_value
+    pipeline.setex.assert_called_once()
+    assert pipeline.setex.call_args.args[0] == product_cache_key('1')
+    watcher.search.publish.assert_called_once_with(['1'])
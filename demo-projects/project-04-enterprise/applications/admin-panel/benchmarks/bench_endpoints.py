@@ -0,0 +1,141 @@
+"""Load-test the admin-panel endpoints and compare against a baseline.
+
+Runs against a panel on the local machine backed by local Postgres and
+Redis, so results do not depend on shared infrastructure. Three steps, run
+from the admin-panel directory:
+
+    # 1. Recreate the users/products/orders tables with synthetic rows
+    python -m benchmarks.bench_endpoints seed --users 5000 --orders 20000
+    # 2. Start the panel against them
+    POSTGRES_DB=enterprise_bench gunicorn --bind 0.0.0.0:8084 --workers 4 app:app
+    # 3. Log in as the seeded admin and drive each scenario at each concurrency level
+    python -m benchmarks.bench_endpoints run --concurrency 1 16 64 --save-baseline baseline.json
+
+Later runs pass --baseline baseline.json. The run exits non-zero when a
+scenario's p95 latency or throughput is worse than the baseline by more than
+--tolerance. Baselines are only comparable on the machine that recorded them.
+Requires httpx.
+"""
+import argparse
+import asyncio
+import os
+
+import bcrypt
+import loadtest
+import psycopg2
+
+ADMIN_EMAIL = 'bench-admin@example.com'
+ADMIN_PASSWORD = 'benchmark'
+
+SCHEMA = """
+    DROP TABLE IF EXISTS orders, products, users;
+    CREATE TABLE users (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        email VARCHAR(255) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        role VARCHAR(50) NOT NULL DEFAULT 'user',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP
+    );
+    CREATE TABLE products (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        description TEXT,
+        price DECIMAL(10, 2) NOT NULL,
+        stock INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP
+    );
+    CREATE TABLE orders (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        total DECIMAL(10, 2) NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP
+    );
+"""
+
+
+def scenarios(args):
+    """Return (name, make_request) pairs; make_request(rng) gives httpx.request() kwargs."""
+    return [
+        ("dashboard", lambda rng: {"method": "GET", "url": "/dashboard"}),
+        ("users", lambda rng: {"method": "GET", "url": "/users"}),
+        ("products", lambda rng: {"method": "GET", "url": "/products"}),
+        ("orders", lambda rng: {"method": "GET", "url": "/orders"}),
+        ("cache_status", lambda rng: {"method": "GET", "url": "/cache/status"}),
+        ("health", lambda rng: {"method": "GET", "url": "/health"}),
+    ]
+
+
+async def log_in(client):
+    response = await client.post('/login', json={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+    if response.status_code != 200:
+        raise SystemExit(f"Login as {ADMIN_EMAIL} failed ({response.status_code}); run the seed step first")
+    client.headers['Authorization'] = f"Bearer {response.json()['access_token']}"
+
+
+def reset(args):
+    database = os.getenv('BENCH_POSTGRES_DB', 'enterprise_bench')
+    conn = psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST', 'localhost'),
+        port=os.getenv('POSTGRES_PORT', 5432),
+        database=database,
+        user=os.getenv('POSTGRES_USER', 'postgres'),
+        password=os.getenv('POSTGRES_PASSWORD', 'password')
+    )
+    password = bcrypt.hashpw(ADMIN_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    with conn, conn.cursor() as cursor:
+        cursor.execute(SCHEMA)
+        cursor.execute(
+            "INSERT INTO users (name, email, password, role) VALUES ('Benchmark Admin', %s, %s, 'admin')",
+            (ADMIN_EMAIL, password)
+        )
+        # Other users share the admin's hash; they never log in
+        cursor.execute("""
+            INSERT INTO users (name, email, password, created_at)
+            SELECT 'User ' || i, 'user' || i || '@example.com', %s, NOW() - i * INTERVAL '1 minute'
+            FROM generate_series(1, %s) AS i
+        """, (password, args.users))
+        cursor.execute("""
+            INSERT INTO products (name, description, price, stock, created_at)
+            SELECT 'Product ' || i, 'Synthetic product ' || i, (i %% 500) + 0.99, i %% 1000, NOW() - i * INTERVAL '1 minute'
+            FROM generate_series(1, %s) AS i
+        """, (args.products,))
+        cursor.execute("""
+            INSERT INTO orders (user_id, total, status, created_at)
+            SELECT (i %% %s) + 1, (i %% 1000) + 0.5,
+                   (ARRAY['pending', 'completed', 'cancelled'])[(i %% 3) + 1],
+                   NOW() - i * INTERVAL '1 second'
+            FROM generate_series(1, %s) AS i
+        """, (args.users + 1, args.orders))
+        cursor.execute("ANALYZE users; ANALYZE products; ANALYZE orders")
+    conn.close()
+    print(f"Seeded {args.users:,} users, {args.products:,} products and {args.orders:,} orders; "
+          f"start the panel with POSTGRES_DB={database}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help="recreate the tables in BENCH_POSTGRES_DB with synthetic rows")
+    seed_parser.add_argument('--users', type=int, default=5_000)
+    seed_parser.add_argument('--products', type=int, default=2_000)
+    seed_parser.add_argument('--orders', type=int, default=20_000)
+
+    loadtest.add_run_parser(
+        commands, url='http://localhost:8084', requests=500, warmup=50, help="drive the endpoints of a running panel"
+    )
+    args = parser.parse_args()
+
+    if args.command == 'seed':
+        reset(args)
+    else:
+        asyncio.run(loadtest.run(args, scenarios(args), prepare=log_in))
+
+
+if __name__ == '__main__':
+    main()
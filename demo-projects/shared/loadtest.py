@@ -0,0 +1,135 @@
+"""Endpoint load-test harness shared by the services' benchmarks.
+
+Each service's benchmarks/bench_endpoints.py defines its seed data and its
+scenarios: (name, make_request) pairs, where make_request(rng) returns
+httpx.request() kwargs. This module drives them against a running service
+at each concurrency level, prints throughput and latency percentiles, and
+compares them with a saved baseline. The run exits non-zero when a
+scenario's p95 latency or throughput is worse than the baseline by more
+than --tolerance, or when more of its requests fail than in the baseline
+(any failure, without one), since failing requests are often fast.
+
+The services' benchmarks/__init__.py put this directory on sys.path, so
+their modules import it as `loadtest`. Requires httpx.
+"""
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+
+def add_run_parser(commands, url, requests=2_000, warmup=100, help="drive the endpoints of a running service"):
+    """Add the `run` subcommand and its options to `commands`."""
+    run_parser = commands.add_parser('run', help=help)
+    run_parser.add_argument('--url', default=url)
+    run_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    run_parser.add_argument('--requests', type=int, default=requests, help="measured requests per scenario and level")
+    run_parser.add_argument('--warmup', type=int, default=warmup)
+    run_parser.add_argument('--scenarios', nargs='+', help="run only these scenarios")
+    run_parser.add_argument('--seed', default='0', help="seed for the generated request parameters")
+    run_parser.add_argument('--baseline', help="JSON file from an earlier --save-baseline to compare against")
+    run_parser.add_argument('--save-baseline', help="write this run's results to a JSON file")
+    run_parser.add_argument('--tolerance', type=float, default=0.15)
+    return run_parser
+
+
+async def run_scenario(client, make_request, requests, concurrency, rng):
+    latencies = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            kwargs = make_request(rng)
+            start = time.perf_counter()
+            try:
+                response = await client.request(**kwargs)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+    }
+
+
+def regressions(key, result, baseline, tolerance):
+    expected = baseline.get(key)
+    found = []
+    allowed = expected.get("errors", 0) / expected["requests"] if expected else 0
+    if result["errors"] / result["requests"] > allowed:
+        found.append(f"{key}: {result['errors']} of {result['requests']} requests failed")
+    if not expected:
+        return found
+    if result["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+        found.append(f"{key}: p95 {result['p95_ms']:.1f}ms vs baseline {expected['p95_ms']:.1f}ms")
+    if result["throughput"] < expected["throughput"] * (1 - tolerance):
+        found.append(f"{key}: {result['throughput']:.0f} req/s vs baseline {expected['throughput']:.0f} req/s")
+    return found
+
+
+async def run(args, scenarios, prepare=None):
+    """Drive `scenarios` with the options from add_run_parser.
+
+    `prepare(client)`, if given, is awaited once before the first scenario,
+    for example to log in.
+    """
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    selected = [(name, make) for name, make in scenarios if not args.scenarios or name in args.scenarios]
+    results = {}
+    found = []
+
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        if prepare:
+            await prepare(client)
+
+        print(f"{'scenario':<20} {'conc':>5} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7} {'p95 vs base':>12}")
+        for name, make_request in selected:
+            for concurrency in args.concurrency:
+                # Same request sequence on every run
+                rng = random.Random(f"{args.seed}:{name}:{concurrency}")
+                await run_scenario(client, make_request, args.warmup, concurrency, rng)
+                result = await run_scenario(client, make_request, args.requests, concurrency, rng)
+
+                key = f"{name}@{concurrency}"
+                results[key] = result
+                found += regressions(key, result, baseline, args.tolerance)
+                delta = f"{result['p95_ms'] / baseline[key]['p95_ms'] - 1:+.0%}" if key in baseline else "-"
+                print(
+                    f"{name:<20} {concurrency:>5} {result['throughput']:>9,.0f} {result['p50_ms']:>7.1f}ms "
+                    f"{result['p95_ms']:>7.1f}ms {result['p99_ms']:>7.1f}ms {result['errors']:>7} {delta:>12}"
+                )
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({"recorded_at": datetime.utcnow().isoformat(), "url": args.url, "results": results}, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if found:
+        print(f"\n{len(found)} regression(s), latency and throughput tolerance {args.tolerance:.0%}:")
+        for line in found:
+            print(f"  {line}")
+        sys.exit(1)